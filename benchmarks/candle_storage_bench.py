@@ -0,0 +1,99 @@
+"""k 线存储方式对比: hash (有序集合 + 每根 k 线一个 hash) 与 packed (每个 instrument 一个有序集合)
+
+需要本机运行 redis-server，测试数据写在 okex/bench/* 下，结束后清除。
+
+    python benchmarks/candle_storage_bench.py [redis_url] [bars] [instruments]
+
+输出两种方式的内存占用 (MEMORY USAGE 之和，及包含每个 key 开销的 INFO used_memory 增量) 及每根 k 线的平均占用、读取最新 100 根 k 线的平均时间，
+并测试 hash 数据转换到 packed (okws --migrate) 的耗时。
+"""
+import asyncio
+import sys
+import time
+
+import aioredis
+
+from okws import cleanup
+from okws.interceptor import execute
+from okws.ws2redis import packed
+from okws.ws2redis.app import Ws2redis
+from okws.ws2redis.candle import config as candle
+
+NAME = 'bench'
+TABLE = 'swap/candle60s'
+
+
+def candle_frame(i, instruments):
+    # 第 i 分钟，所有 instrument 的 k 线
+    minute = 1605187200 + i * 60
+    ts = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(minute))
+    return {
+        'table': TABLE,
+        'data': [{
+            'instrument_id': f"BT{j}-USD-SWAP",
+            'candle': [ts, '15866.1', '15877.3', '15852.5', '15877.3', '5966', '37.5977']
+        } for j in range(instruments)]
+    }
+
+
+async def fill(redis_url, storage, bars, instruments):
+    ws2redis = Ws2redis(NAME, redis_url, {'CANDLE_STORAGE': storage, 'MAX_ROW': bars})
+    await ws2redis.enter({'_signal_': 'READY'})
+    try:
+        for i in range(bars):
+            await ws2redis.enter({'_signal_': 'ON_DATA', 'DATA': candle_frame(i, instruments)})
+    finally:
+        await ws2redis.close()
+
+
+async def memory(redis):
+    total = 0
+    async for key in redis.iscan(match=f"okex/{NAME}/{TABLE}*"):
+        total += await redis.execute(b'MEMORY', b'USAGE', key, b'SAMPLES', b'0') or 0
+    return total
+
+
+async def used_memory(redis):
+    info = await redis.info('memory')
+    return int(info['memory']['used_memory'])
+
+
+async def read_latency(redis, storage, times=100):
+    ctx = {'name': NAME, 'path': TABLE, 'redis': redis, 'settings': {'CANDLE_STORAGE': storage},
+           'instrument_id': 'BT0-USD-SWAP', 'n': 100}
+    start = time.perf_counter()
+    for _ in range(times):
+        c = dict(ctx)
+        await execute(c, [candle['read']])
+    return (time.perf_counter() - start) / times * 1000
+
+
+async def main(redis_url='redis://localhost', bars=1000, instruments=20):
+    redis = await aioredis.create_redis(redis_url)
+    try:
+        for storage in ['hash', 'packed']:
+            await cleanup.clear(redis, f"okex/{NAME}/*")
+            before = await used_memory(redis)
+            await fill(redis_url, storage, bars, instruments)
+            used = await memory(redis)
+            delta = await used_memory(redis) - before
+            print(f"{storage:<8} MEMORY USAGE {used:>10} bytes ({used / (bars * instruments):6.1f}/bar), "
+                  f"used_memory +{delta:>10} bytes ({delta / (bars * instruments):6.1f}/bar), "
+                  f"read 100 bars {await read_latency(redis, storage):6.3f} ms")
+
+        await cleanup.clear(redis, f"okex/{NAME}/*")
+        await fill(redis_url, 'hash', bars, instruments)
+        start = time.perf_counter()
+        n = 0
+        for j in range(instruments):
+            n += await packed.migrate(redis, f"okex/{NAME}/{TABLE}:BT{j}-USD-SWAP", 'packed')
+        print(f"migrate {n} bars to packed: {time.perf_counter() - start:.3f} s, memory {await memory(redis)} bytes")
+        await cleanup.clear(redis, f"okex/{NAME}/*")
+    finally:
+        redis.close()
+        await redis.wait_closed()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    asyncio.run(main(*args[:1], *[int(a) for a in args[1:3]]))
@@ -0,0 +1,128 @@
+"""ws 数据解码性能测试 (解压 + json 解析)
+
+    python benchmarks/decode_bench.py [frames.txt]
+    python benchmarks/decode_bench.py record frames.txt seconds channel1 channel2 ...
+
+frames.txt 每行一条 base64 编码的 ws 原始数据，可以用 record 从 okex 录制，
+没有指定文件时使用生成的 ticker、trade、depth、candle 数据。
+输出每种已安装的 json codec 解码每条数据所用的时间 (µs)。
+"""
+import asyncio
+import base64
+import json
+import sys
+import time
+import zlib
+
+import okws
+from okws.codec import available, get_codec
+from okws.okex import Decode, _inflate
+
+
+def deflate(obj):
+    c = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return c.compress(json.dumps(obj).encode('utf-8')) + c.flush()
+
+
+def sample_frames():
+    ticker = {'table': 'spot/ticker', 'data': [{
+        'instrument_id': 'ETH-USDT', 'last': '600.12', 'last_qty': '0.1', 'best_bid': '600.1', 'best_bid_size': '2',
+        'best_ask': '600.2', 'best_ask_size': '3', 'open_24h': '590', 'high_24h': '610', 'low_24h': '580',
+        'base_volume_24h': '100000', 'quote_volume_24h': '60000000', 'timestamp': '2020-11-12T13:20:00.000Z'}]}
+    trade = {'table': 'spot/trade', 'data': [{
+        'instrument_id': 'ETH-USDT', 'price': '600.1', 'side': 'buy', 'size': '0.1',
+        'timestamp': '2020-11-12T13:20:00.000Z', 'trade_id': str(i)} for i in range(50)]}
+    depth = {'table': 'spot/depth', 'action': 'partial', 'data': [{
+        'instrument_id': 'ETH-USDT',
+        'asks': [[f"{600 + i / 100:.2f}", '1.5', '2'] for i in range(400)],
+        'bids': [[f"{600 - i / 100:.2f}", '1.5', '2'] for i in range(400)],
+        'timestamp': '2020-11-12T13:20:00.000Z', 'checksum': -1200119424}]}
+    candle = {'table': 'spot/candle60s', 'data': [{
+        'instrument_id': 'ETH-USDT',
+        'candle': ['2020-11-12T13:20:00.000Z', '600', '601', '599', '600.5', '10', '0.01']}]}
+    return [deflate(f) for f in [ticker] * 50 + [trade] * 10 + [depth] + [candle] * 20]
+
+
+def load_frames(path):
+    with open(path) as f:
+        return [base64.b64decode(line) for line in f if line.strip()]
+
+
+def raw(codec):
+    # 只计算解压和解析，不含拦截器调用
+    def run(frames):
+        for frame in frames:
+            codec.loads(_inflate(frame))
+    return run
+
+
+def enter(codec):
+    # Decode.enter 整个处理过程
+    decode = Decode(codec=codec)
+    loop = asyncio.new_event_loop()
+
+    async def _run(frames):
+        for frame in frames:
+            await decode.enter({'_signal_': 'ON_DATA', '_data_': frame})
+
+    def run(frames):
+        loop.run_until_complete(_run(frames))
+    return run
+
+
+REPEAT = 7
+ROUNDS = 20
+
+
+def best(run, frames):
+    # 重复 REPEAT 次取最快的一次，换算成每条数据的 µs
+    run(frames[:10])
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            run(frames)
+        times.append(time.perf_counter() - start)
+    return min(times) / (ROUNDS * len(frames)) * 1e6
+
+
+def legacy(frames):
+    # 原来的解码方式：每条数据新建 decompressobj，解码为 str 后用 json 解析
+    for frame in frames:
+        d = zlib.decompressobj(-zlib.MAX_WBITS)
+        buff = d.decompress(frame) + d.flush()
+        json.loads(buff.decode('utf-8'))
+
+
+async def record(path, seconds, channels):
+    f = open(path, 'w')
+
+    async def app(request):
+        if request['_signal_'] == 'CONNECTED':
+            await request['_server_'].send(json.dumps({'op': 'subscribe', 'args': channels}))
+        elif request['_signal_'] == 'ON_DATA':
+            f.write(base64.b64encode(request['_data_']).decode('ascii') + '\n')
+
+    client = okws.Websockets(app)
+    task = asyncio.create_task(client.run())
+    await asyncio.sleep(seconds)
+    client.close()
+    await task
+    f.close()
+
+
+def main(args):
+    frames = load_frames(args[0]) if args else sample_frames()
+    print(f"{len(frames)} frames, {sum(map(len, frames)) / len(frames):.0f} bytes/frame (compressed)")
+    print(f"{'codec':<8} {'inflate+loads':>14} {'Decode.enter':>14}  (µs/frame)")
+    print(f"{'legacy':<8} {best(legacy, frames):14.1f} {'-':>14}")
+    for name in available():
+        codec = get_codec(name)
+        print(f"{name:<8} {best(raw(codec), frames):14.1f} {best(enter(codec), frames):14.1f}")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['record']:
+        asyncio.run(record(sys.argv[2], float(sys.argv[3]), sys.argv[4:]))
+    else:
+        main(sys.argv[1:])
@@ -0,0 +1,92 @@
+"""uni_id 表存储方式对比: zset + hash 与 redis stream
+
+需要本机运行 redis-server (>= 5.0)，测试数据写在 okex/bench/* 下，结束后清除。
+
+    python benchmarks/uni_id_storage_bench.py [redis_url] [rows]
+
+输出两种方式的内存占用 (MEMORY USAGE 之和)、读取最新 100 条数据的平均时间，
+并测试 zset 数据转换到 stream 及转换回 zset (okws --migrate) 的耗时。
+"""
+import asyncio
+import sys
+import time
+
+import aioredis
+
+from okws import cleanup
+from okws.ws2redis import stream
+from okws.ws2redis.app import Ws2redis
+from okws.ws2redis.normal import config as normal
+from okws.interceptor import execute
+
+NAME = 'bench'
+TABLE = 'spot/trade'
+KEY = f"okex/{NAME}/{TABLE}"
+
+
+def trade_frame(i, rows=50):
+    return {
+        'table': TABLE,
+        'data': [{
+            'instrument_id': 'ETH-USDT',
+            'price': '600.1',
+            'side': 'buy',
+            'size': '0.1',
+            'timestamp': '2020-11-12T13:20:00.000Z',
+            'trade_id': str(i * rows + j)
+        } for j in range(rows)]
+    }
+
+
+async def fill(redis_url, storage, rows):
+    ws2redis = Ws2redis(NAME, redis_url, {'UNI_ID_STORAGE': storage, 'MAX_ROW': rows})
+    await ws2redis.enter({'_signal_': 'READY'})
+    try:
+        for i in range(rows // 50):
+            await ws2redis.enter({'_signal_': 'ON_DATA', 'DATA': trade_frame(i)})
+    finally:
+        await ws2redis.close()
+
+
+async def memory(redis):
+    total = 0
+    async for key in redis.iscan(match=f"{KEY}*"):
+        total += await redis.execute(b'MEMORY', b'USAGE', key) or 0
+    return total
+
+
+async def read_latency(redis, storage, times=100):
+    ctx = {'name': NAME, 'path': TABLE, 'redis': redis, 'settings': {'UNI_ID_STORAGE': storage}, 'n': 100}
+    start = time.perf_counter()
+    for _ in range(times):
+        c = dict(ctx)
+        await execute(c, [normal['read']])
+    return (time.perf_counter() - start) / times * 1000
+
+
+async def main(redis_url='redis://localhost', rows=10000):
+    redis = await aioredis.create_redis(redis_url)
+    try:
+        for storage in ['zset', 'stream']:
+            await cleanup.clear(redis, f"okex/{NAME}/*")
+            await fill(redis_url, storage, rows)
+            print(f"{storage:<8} memory {await memory(redis):>12} bytes, "
+                  f"read 100 rows {await read_latency(redis, storage):8.3f} ms")
+
+        await cleanup.clear(redis, f"okex/{NAME}/*")
+        await fill(redis_url, 'zset', rows)
+        start = time.perf_counter()
+        n = await stream.migrate(redis, KEY, 'stream')
+        print(f"migrate {n} rows to stream: {time.perf_counter() - start:.3f} s")
+        start = time.perf_counter()
+        n = await stream.migrate(redis, KEY, 'zset', 'trade_id')
+        print(f"migrate {n} rows to zset: {time.perf_counter() - start:.3f} s")
+        await cleanup.clear(redis, f"okex/{NAME}/*")
+    finally:
+        redis.close()
+        await redis.wait_closed()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    asyncio.run(main(*args[:1], *[int(a) for a in args[1:2]]))
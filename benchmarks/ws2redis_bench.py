@@ -0,0 +1,100 @@
+"""Ws2redis 写入性能测试
+
+需要本机运行 redis-server，测试数据写在 okex/bench/* 下，结束后清除。
+
+    python benchmarks/ws2redis_bench.py [redis_url] [frames]
+
+对每种 REDIS_BATCH 方式 (none, pipeline, multi) 输出每秒处理的 ws 消息数，
+及每条消息产生的 redis 命令数 (INFO stats 中 total_commands_processed 的增量)。
+"""
+import asyncio
+import sys
+import time
+
+import aioredis
+
+from okws import cleanup
+from okws.ws2redis.app import Ws2redis
+from okws.ws2redis.batch import MODES
+
+NAME = 'bench'
+
+
+def trade_frame(i, rows=50):
+    # 一次 50 条成交
+    return {
+        'table': 'spot/trade',
+        'data': [{
+            'instrument_id': 'ETH-USDT',
+            'price': '600.1',
+            'side': 'buy',
+            'size': '0.1',
+            'timestamp': '2020-11-12T13:20:00.000Z',
+            'trade_id': str(i * rows + j)
+        } for j in range(rows)]
+    }
+
+
+def ticker_frame(i):
+    return {
+        'table': 'spot/ticker',
+        'data': [{
+            'instrument_id': 'ETH-USDT',
+            'last': str(600 + i % 10),
+            'best_bid': '600',
+            'best_ask': '600.1',
+            'timestamp': '2020-11-12T13:20:00.000Z'
+        }]
+    }
+
+
+def candle_frame(i):
+    # 每 10 条消息产生一根新 K 线
+    minute = i // 10
+    return {
+        'table': 'spot/candle60s',
+        'data': [{
+            'instrument_id': 'ETH-USDT',
+            'candle': [f"2020-11-12T{minute // 60 % 24:02d}:{minute % 60:02d}:00.000Z",
+                       '600', '601', '599', '600.5', '10', '0.01']
+        }]
+    }
+
+
+async def commands(redis):
+    info = await redis.info('stats')
+    return int(info['stats']['total_commands_processed'])
+
+
+async def bench(redis_url, mode, frames, make_frame):
+    ws2redis = Ws2redis(NAME, redis_url, {'REDIS_BATCH': mode})
+    await ws2redis.enter({'_signal_': 'READY'})
+    try:
+        before = await commands(ws2redis.redis)
+        start = time.perf_counter()
+        for i in range(frames):
+            await ws2redis.enter({'_signal_': 'ON_DATA', 'DATA': make_frame(i)})
+        elapsed = time.perf_counter() - start
+        # 减去 INFO 本身
+        n = await commands(ws2redis.redis) - before - 1
+        await cleanup.clear(ws2redis.redis, f"okex/{NAME}/*")
+    finally:
+        await ws2redis.close()
+    return frames / elapsed, n / frames
+
+
+async def main(redis_url='redis://localhost', frames=1000):
+    redis = await aioredis.create_redis(redis_url)
+    await cleanup.clear(redis, f"okex/{NAME}/*")
+    redis.close()
+    await redis.wait_closed()
+
+    for title, make_frame in [('trade x50', trade_frame), ('ticker', ticker_frame), ('candle', candle_frame)]:
+        for mode in MODES:
+            fps, cpf = await bench(redis_url, mode, frames, make_frame)
+            print(f"{title:<10} {mode:<10} {fps:10.1f} frames/s {cpf:6.1f} commands/frame")
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    asyncio.run(main(*args[:1], *[int(a) for a in args[1:2]]))
@@ -4,4 +4,6 @@ from .ws2redis.app import app
 from okws.client import client
 from .websocket import Websockets
 import okws.okex
+import okws.shard
+import okws.failover
 from .redis_cmd import RedisCommand
@@ -1,13 +1,18 @@
 # 给最终用户的接口， 从 redis 取 okex websockets 的数据
-import asyncio
+import itertools
 import json
 import logging
+import time
+import uuid
 from typing import Union
 
 import aioredis
 
+from okws import cleanup
 from okws.interceptor import execute
+from okws.ws2redis import catalog, retention, storage, stream
 from okws.ws2redis.candle import config as candle
+from okws.ws2redis.depth import config as depth
 from okws.ws2redis.normal import config as normal
 from .settings import default_settings
 
@@ -22,102 +27,177 @@ class Client:
             'id': self.id,
             'name': name,
             'path': path,
-            'redis': self.redis
+            'redis': self.redis,
+            'settings': await self.storage.settings(self.redis, name, self.settings)
         }
         ctx.update(params)
         await execute(ctx, self.interceptors)
         return ctx.get('response')
 
     async def close(self):
-        if self.redis is not None:
-            self.redis.close()
-            await self.redis.wait_closed()
-            self.redis = None
+        for redis in (self.redis, self.reply_redis):
+            if redis is not None:
+                redis.close()
+                await redis.wait_closed()
+        self.redis = None
+        self.reply_redis = None
 
     def __init__(self, REDIS_URL, REDIS_INFO_KEY, LISTEN_CHANNEL, **argv):
         # 注意初始化要执行 init()
         self.redis_url = REDIS_URL
         self.redis = None
-        self.interceptors = [normal['read'], candle['read']]
-        self.id = id(self)
+        # 用于阻塞等待 okws 回复的连接池，每个等待中的指令占用一个连接
+        self.reply_redis = None
+        self.interceptors = [normal['read'], candle['read'], depth['read']]
+        # 多个进程、多台机器的 client 共用 okws，id 要全局唯一
+        self.id = uuid.uuid4().hex
         self.redis_path = f"{REDIS_INFO_KEY}/{self.id}"
         self.listen_channel = LISTEN_CHANNEL
+        self.reply_timeout = argv.get('REPLY_TIMEOUT', 10)
+        # 指令编号，用于对应 okws 的回复
+        self.rids = itertools.count(1)
+        # 最近一次指令的往返时间(秒)
+        self.latency = None
+        self.settings = {'REDIS_URL': REDIS_URL, 'REDIS_INFO_KEY': REDIS_INFO_KEY,
+                         'LISTEN_CHANNEL': LISTEN_CHANNEL, **argv}
+        # okws 记录在 redis 中的存储方式，见 storage.py
+        self.storage = storage.Cache()
 
     async def init(self):
         self.redis = await aioredis.create_redis(self.redis_url)
+        self.reply_redis = await aioredis.create_redis_pool(self.redis_url)
 
     async def send(self, cmd: dict):
-        # send cmd to websocket
+        """send cmd to websocket
+
+        返回 okws 是否收到指令
+        """
         # if 'name' not in cmd:
         #     logger.warning(f"未指定 websocket 服务名! {cmd}")
         cmd['id'] = self.id
-        await self.redis.publish_json(self.listen_channel, cmd)
-
-    async def open_ws(self, name, auth_params=None):
+        cmd['rid'] = next(self.rids)
+        return await self.redis.publish_json(self.listen_channel, cmd) > 0
+
+    async def request(self, cmd: dict, timeout=None):
+        """发送指令并等待 okws 处理完成后的回复
+
+        回复中 latency 为往返时间(秒)。
+        okws 没有运行时返回 errorCode 80021，超时返回 errorCode 80020。
+        """
+        start = time.perf_counter()
+        if not await self.send(cmd):
+            return {'event': 'error', 'message': 'okws 没有运行', 'errorCode': 80021}
+        timeout = timeout or self.reply_timeout
+        # 独占一个连接，同时等待的多个指令不会互相阻塞
+        with await self.reply_redis as redis:
+            ret = await redis.blpop(f"{self.redis_path}/{cmd['rid']}", timeout=max(1, int(timeout)), encoding='utf-8')
+        if ret is None:
+            return {'event': 'error', 'message': f"等待 okws 回复超时({timeout}s)", 'errorCode': 80020}
+        reply = json.loads(ret[1])
+        self.latency = reply['latency'] = time.perf_counter() - start
+        return reply
+
+    async def open_ws(self, name, auth_params=None, timeout=None):
         if auth_params is None:
             auth_params = {}
-        await self.send({
+        return await self.request({
             'op': 'open',
             'name': name,
             'args': auth_params
-        })
-        # await self.redis.publish_json(LISTEN_CHANNEL)
-        await asyncio.sleep(1)
-        ret = await self.redis.get(self.redis_path, encoding='utf-8')
-        return json.loads(ret)
-
-    async def subscribe(self, name, channels: Union[list, str]):
-        await self.send({
+        }, timeout)
+
+    async def subscribe(self, name, channels: Union[list, str], timeout=None):
+        return await self.request({
             'op': 'subscribe',
             'name': name,
             'args': channels if type(channels) == list else [channels]
-        })
-        await asyncio.sleep(0)
-        ret = await self.redis.get(self.redis_path, encoding='utf-8')
-        return json.loads(ret)
+        }, timeout)
 
-    async def close_ws(self, name):
-        await self.send({
+    async def close_ws(self, name, timeout=None):
+        return await self.request({
             'op': 'close',
             'name': name
-        })
-        await asyncio.sleep(1)
-        ret = await self.redis.get(self.redis_path, encoding='utf-8')
-        return json.loads(ret)
+        }, timeout)
 
-    async def server_quit(self):
-        await self.send({
+    async def server_quit(self, timeout=None):
+        return await self.request({
             'op': 'quit_server'
-        })
-        await asyncio.sleep(1)
-        ret = await self.redis.get(self.redis_path, encoding='utf-8')
-        return json.loads(ret)
+        }, timeout)
 
-    async def servers(self):
-        await self.send({
+    async def servers(self, timeout=None):
+        return await self.request({
             'op': 'servers'
-        })
-        await asyncio.sleep(1)
-        ret = await self.redis.get(self.redis_path, encoding='utf-8')
-        return json.loads(ret)
-
-    async def redis_clear(self, path="okex/*"):
-        # 清除 redis 服务器中的相关数据
-        keys = await self.redis.keys(path)
-        for key in keys:
-            await self.redis.delete(key)
+        }, timeout)
+
+    async def catalog(self, name, since=None):
+        """okws 保存的频道及 instrument，一次 redis 请求
+
+        since: 秒数，只返回最近 since 秒内有更新的
+        返回 {table: {'updated': 最后更新时间(秒), 'instruments': {instrument_id: 最后更新时间(秒)}}}
+        """
+        return await catalog.read(self.redis, name, since)
+
+    async def staleness(self, name, table, instruments):
+        """多个 instrument 的数据有多久没有更新，一次 redis 请求
+
+        返回 {instrument_id: {'received': 距离最后一次收到数据的秒数, 'exchange': 距离数据中交易所 timestamp 的秒数}}，
+        没有数据时为 None，如 staleness('tests', 'spot/ticker', ['ETH-USDT', 'BTC-USDT'])
+        """
+        return await catalog.staleness(self.redis, name, table, instruments)
+
+    async def reclaimed(self, name):
+        """按保留规则(RETENTION)已删除的 key 数量，返回 {频道名: 数量}"""
+        return await retention.reclaimed(self.redis, name)
+
+    async def messages(self, name, path, group=None, consumer=None, latest_id='$', count=100):
+        """读取 uni_id 频道 (/trade, /order, /order_algo) 的 redis stream 数据，需要 UNI_ID_STORAGE: stream
+
+        不会像 pub/sub 那样丢失数据。group 不为 None 时使用消费组，每条数据只发给组内的一个 consumer，读取后自动 XACK。
+        例：
+            async for trade in okex.messages('tests', 'spot/trade'):
+                print(trade)
+        """
+        key = f"okex/{name}/{path}"
+        # 阻塞读取，需要单独的连接
+        redis = await aioredis.create_redis(self.redis_url)
+        try:
+            if group is not None:
+                try:
+                    await redis.xgroup_create(key, group, latest_id=latest_id, mkstream=True)
+                except aioredis.errors.BusyGroupError:
+                    pass
+            while True:
+                if group is None:
+                    messages = await redis.xread([key], count=count, latest_ids=[latest_id])
+                else:
+                    messages = await redis.xread_group(group, consumer or str(self.id), [key],
+                                                       count=count, latest_ids=['>'])
+                for _stream, mid, fields in messages:
+                    latest_id = mid
+                    yield stream.decode(fields)
+                    if group is not None:
+                        await redis.xack(key, group, mid)
+        finally:
+            redis.close()
+            await redis.wait_closed()
+
+    async def redis_clear(self, path="okex/*", progress=None):
+        # 清除 redis 服务器中的相关数据，返回删除的 key 数量，见 cleanup.py
+        return await cleanup.clear(self.redis, path, progress=progress)
 
     def __del__(self):
         logger.debug('退出')
-        if self.redis is not None:
-            self.redis.close()
+        for redis in (self.redis, self.reply_redis):
+            if redis is not None:
+                redis.close()
 
 
 async def client(configs=None) -> Client:
     # 使用些函数初始化 OKEX 类
     if configs is None:
         configs = {}
-    configs.update(default_settings)
+    # 用户设置优先
+    configs = {**default_settings, **configs}
     okex = Client(**configs)
     await okex.init()
     return okex
@@ -0,0 +1,74 @@
+"""清除 redis 中的 key
+
+使用 SCAN (每次最多 count 个) 查找，每 batch 个 key 一个 UNLINK，不会像 KEYS 那样长时间阻塞 redis。
+UNLINK 放到 pipeline 中，每 pipeline 个 UNLINK 发送一次，删除时不用每批等一次往返。
+clear 用于 aioredis，clear_sync 用于 redis-py，返回删除的 key 数量。
+
+progress(scanned, deleted) 在每次发送 pipeline 后调用，没有时写到日志 (debug)。
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+COUNT = 1000
+BATCH = 500
+PIPELINE = 4
+
+
+def _log(pattern):
+    def progress(scanned, deleted):
+        logger.debug(f"清除 {pattern}: 已扫描 {scanned}，已删除 {deleted}")
+    return progress
+
+
+async def clear(redis, pattern="okex/*", count=COUNT, batch=BATCH, progress=None, pipeline=PIPELINE):
+    # SCAN 时删除已经返回的 key 不影响其它 key 的扫描
+    progress = progress or _log(pattern)
+    scanned = deleted = 0
+    keys = []
+    pipe = redis.pipeline()
+    queued = 0
+    async for key in redis.iscan(match=pattern, count=count):
+        scanned += 1
+        keys.append(key)
+        if len(keys) >= batch:
+            pipe.unlink(*keys)
+            keys = []
+            queued += 1
+            if queued >= pipeline:
+                deleted += sum(await pipe.execute())
+                pipe = redis.pipeline()
+                queued = 0
+                progress(scanned, deleted)
+    if keys:
+        pipe.unlink(*keys)
+        queued += 1
+    if queued:
+        deleted += sum(await pipe.execute())
+        progress(scanned, deleted)
+    logger.info(f"清除 {pattern}: 删除 {deleted} 个 key")
+    return deleted
+
+
+def clear_sync(redis, pattern="okex/*", count=COUNT, batch=BATCH, progress=None, pipeline=PIPELINE):
+    progress = progress or _log(pattern)
+    scanned = deleted = 0
+    keys = []
+    # transaction=False: 只为减少往返，不需要 MULTI/EXEC
+    pipe = redis.pipeline(transaction=False)
+    for key in redis.scan_iter(match=pattern, count=count):
+        scanned += 1
+        keys.append(key)
+        if len(keys) >= batch:
+            pipe.unlink(*keys)
+            keys = []
+            if len(pipe) >= pipeline:
+                deleted += sum(pipe.execute())
+                progress(scanned, deleted)
+    if keys:
+        pipe.unlink(*keys)
+    if len(pipe):
+        deleted += sum(pipe.execute())
+        progress(scanned, deleted)
+    logger.info(f"清除 {pattern}: 删除 {deleted} 个 key")
+    return deleted
@@ -1,42 +1,103 @@
 import asyncio
 import getopt
+import json
 import logging
 import os
 import os.path
 import sys
+import time
 
 from yaml import Loader, load
 
+import aioredis
+
 import okws
+import okws.aioclient as aclient
 from .settings import default_settings
+from .startup import each_shard, shard_count, wait_event
+from .worker import Supervisor
+from .ws2redis import packed, storage, stream
+from .ws2redis.normal import uni_id
 
 logger = logging.getLogger(__name__)
 
 
 async def okws_exist(client):
-    client.servers()
-    await asyncio.sleep(1)
-    info = client.get_return_info()
+    info = await client.servers()
     return type(info['message']) == list
 
 
-async def open_ws(client, config):
-    # 连接到 ws 服务器
-    for server in config['servers']:
-        client.open_ws(server['name'], server)
-    await asyncio.sleep(2)
+def server_channels(config, name):
+    # 配置文件中 name 要订阅的频道
+    channels = []
+    for sub in config.get('subscribes', []):
+        if sub['server'] == name:
+            channels += sub['channels'] if type(sub['channels']) == list else [sub['channels']]
+    return channels
 
 
-async def subscribe(client, config, name=None):
-    # 发送订阅命令
-    for sub in config.get('subscribes', []):
-        if name is None or sub['server'] == name:
-            client.subscribe(sub['server'], sub['channels'])
-            await asyncio.sleep(1)
+async def start_server(client, config, server):
+    """连接到 ws 服务器，等待连接(及登录)成功后订阅频道，等待订阅成功及收到第一条数据
+
+    各阶段距开始的时间(秒)写到 okex/<name>/ready，超时的阶段为 null
+    """
+    name = server['name']
+    timeout = config['settings']['STARTUP_TIMEOUT']
+    report = {'connected': None, 'login': None, 'subscribed': None, 'first_data': None}
+    start = time.perf_counter()
+
+    def elapsed():
+        return round(time.perf_counter() - start, 3)
+
+    events = await aioredis.create_redis(config['settings']['REDIS_URL'])
+    try:
+        ch, = await events.subscribe(f"okex/{name}/event")
+        ret = await client.open_ws(name, server)
+        existed = ret['errorCode'] == 80001
+        count = shard_count(config, server)
+        if existed or await wait_event(ch, each_shard(count, lambda e: e.get('op') == 'CONNECTED'), timeout):
+            report['connected'] = elapsed()
+            if server.get('password', '') != '':
+                if await wait_event(ch, each_shard(count, lambda e: e.get('event') in ('login', 'error')), timeout):
+                    report['login'] = elapsed()
+
+            channels = server_channels(config, name)
+            if channels:
+                pending = set(channels)
+
+                def acked(event):
+                    if event.get('event') == 'subscribe':
+                        pending.discard(event.get('channel'))
+                    elif event.get('event') == 'error':
+                        logger.warning(f"{name} 订阅出错：{event}")
+                    return not pending
+
+                await client.subscribe(name, channels)
+                if await wait_event(ch, acked, timeout):
+                    report['subscribed'] = elapsed()
+                else:
+                    logger.warning(f"{name} 以下频道没有订阅成功：{pending}")
+
+                # 已存在的连接不会再发 FIRST_DATA，由心跳的 ON_DATA 判断，HEARTBEAT 为 0 时不等待
+                if existed and not config['settings'].get('HEARTBEAT'):
+                    logger.info(f"{name} 已存在且 HEARTBEAT 为 0，不等待第一条数据")
+                elif await wait_event(ch, lambda e: e.get('op') in ('FIRST_DATA', 'ON_DATA' if existed else None),
+                                      timeout):
+                    report['first_data'] = elapsed()
+        else:
+            logger.warning(f"{name} 连接 ws 服务器超时")
+    finally:
+        events.close()
+        await events.wait_closed()
+
+    logger.info(f"{name} 启动完成：{report}")
+    await client.redis.set(f"okex/{name}/ready", json.dumps(report))
+    return report
 
 
 def usage():
-    print('okws -c <configfile>')
+    print('okws -c <configfile> [--migrate]')
+    print('    --migrate  按配置文件中的存储方式转换 redis 中已有的数据后退出')
     exit(1)
 
 
@@ -51,52 +112,89 @@ def read_config(config_file):
 
 
 def parse_argv(argv):
+    # 返回 (config, migrate)
     try:
-        opts, _args = getopt.getopt(argv[1:], "-h-c:", ['help'])
+        opts, _args = getopt.getopt(argv[1:], "-h-c:", ['help', 'migrate'])
+        config = None
+        migrate = False
         for opt, arg in opts:
             if opt == "-c":
-                return read_config(arg)
+                config = read_config(arg)
+            elif opt == "--migrate":
+                migrate = True
             else:
                 usage()
-        usage()
+        if config is None:
+            usage()
+        return config, migrate
     except getopt.GetoptError:
         usage()
 
 
-async def execute_config_task(config):
-    # redis_url = config['settings']['REDIS_URL']
-    await asyncio.sleep(1)
-    client = okws.client(config['settings'])
-    if not await okws_exist(client):
-        logger.warning(f"未检测到 okws 运行，程序退出。")
-        return
+async def execute_config_task(config, redis_cmd):
+    # 等待 okws 可以接收指令
+    await redis_cmd.ready.wait()
+    client = await aclient.client(config['settings'])
+    try:
+        if not await okws_exist(client):
+            logger.warning(f"未检测到 okws 运行，程序退出。")
+            return
 
-    await open_ws(client, config)
-    await asyncio.sleep(1)
-    # 如果相应的 ws 已经连接的话，需要重新订阅一下
-    await subscribe(client, config)
+        # 连接、登录、订阅完成后才开始下一步，各服务器同时进行
+        await asyncio.gather(*[start_server(client, config, server) for server in config.get('servers', [])])
+    finally:
+        await client.close()
 
 
 async def execute(config):
     logger.debug(config)
-    config['settings'].update(default_settings)
-    redis_cmd = okws.RedisCommand(config['settings']['REDIS_URL'],
-                                  config['settings']['REDIS_INFO_KEY'])
+    # 配置文件中的设置优先
+    config['settings'] = {**default_settings, **config.get('settings', {})}
+    # WORKERS 大于 0 时，ws 连接运行在工作进程中，见 worker.py
+    command = Supervisor if config['settings'].get('WORKERS') else okws.RedisCommand
+    redis_cmd = command(config['settings']['REDIS_URL'],
+                        config['settings']['REDIS_INFO_KEY'],
+                        config['settings'])
     redis = okws.Redis(config['settings']['LISTEN_CHANNEL'], redis_cmd)
 
     await asyncio.gather(
         redis.run(),
-        execute_config_task(config)
+        execute_config_task(config, redis_cmd)
     )
 
 
+async def migrate(config):
+    # 转换 redis 中已有的数据到配置的存储方式
+    settings = {**default_settings, **config.get('settings', {})}
+    redis = await aioredis.create_redis(settings['REDIS_URL'])
+    try:
+        # uni_id 表: zset 与 stream 互相转换
+        for end, uid in uni_id.items():
+            async for key in redis.iscan(match=f"okex/*{end}"):
+                await stream.migrate(redis, key.decode('utf-8'), settings.get('UNI_ID_STORAGE', 'zset'), uid)
+        # k 线: 每个 instrument 一个有序集合 okex/<name>/<table>:<instrument_id>
+        async for key in redis.iscan(match="okex/*candle*s:*"):
+            key = key.decode('utf-8')
+            if '/' not in key.split(':', 1)[1]:
+                await packed.migrate(redis, key, settings.get('CANDLE_STORAGE', 'hash'))
+        # 更新 okws 记录的存储方式，client 不用等 okws 重启
+        async for key in redis.iscan(match=storage.key('*')):
+            await redis.hmset_dict(key, storage.modes(settings))
+    finally:
+        redis.close()
+        await redis.wait_closed()
+
+
 def main():
     logging.basicConfig(level=logging.INFO,
                         format='%(asctime)s - %(module)s[%(lineno)d] - %(levelname)s: %(message)s')
 
-    config = parse_argv(sys.argv)
+    config, to_migrate = parse_argv(sys.argv)
     # logger.info(config)
     try:
-        asyncio.run(execute(config))
+        if to_migrate:
+            asyncio.run(migrate(config))
+        else:
+            asyncio.run(execute(config))
     except KeyboardInterrupt:
         logging.info('Ctrl+C 完成退出')
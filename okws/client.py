@@ -1,14 +1,21 @@
 # 给最终用户的接口， 从 redis 取 okex websockets 的数据
 import asyncio
+import itertools
 import json
 import logging
+import time
+import uuid
 from typing import Union
 
+import aioredis
 import redis
 
+from okws import cleanup
 from okws.interceptor import execute
 from okws.settings import default_settings
+from okws.ws2redis import catalog, retention, storage
 from okws.ws2redis.candle import config as candle
+from okws.ws2redis.depth import config as depth
 from okws.ws2redis.normal import config as normal
 
 logger = logging.getLogger(__name__)
@@ -16,16 +23,30 @@ logger = logging.getLogger(__name__)
 
 class Client:
     def __init__(self, REDIS_URL, REDIS_INFO_KEY, LISTEN_CHANNEL, **argv):
+        self.redis_url = REDIS_URL
         pool = redis.ConnectionPool.from_url(REDIS_URL, encoding='utf8', decode_responses=True)
         self.redis = redis.Redis(connection_pool=pool)
-        self.interceptors = [normal['read'], candle['read']]
-        self.id = id(self)
+        self.interceptors = [normal['read'], candle['read'], depth['read']]
+        # 多个进程、多台机器的 client 共用 okws，id 要全局唯一
+        self.id = uuid.uuid4().hex
         self.redis_path = f"{REDIS_INFO_KEY}/{self.id}"
         self.listen_channel = LISTEN_CHANNEL
+        self.reply_timeout = argv.get('REPLY_TIMEOUT', 10)
+        # 指令编号，用于对应 okws 的回复
+        self.rids = itertools.count(1)
+        # 最近一次指令的往返时间(秒)
+        self.latency = None
+        self.catalog_script = self.redis.register_script(catalog.READ.source)
+        self.staleness_script = self.redis.register_script(catalog.STALENESS.source)
+        self.settings = {'REDIS_URL': REDIS_URL, 'REDIS_INFO_KEY': REDIS_INFO_KEY,
+                         'LISTEN_CHANNEL': LISTEN_CHANNEL, **argv}
+        # okws 记录在 redis 中的存储方式，见 storage.py
+        self.storage = storage.Cache()
+        # get 使用的事件循环及 aioredis 连接，第一次 get 时创建，close() 时关闭
+        self.loop = None
+        self.aioredis = None
 
     def get(self, name, path, params=None):
-        # if self.redis is None:
-        #     self.redis = await aioredis.create_redis(self.redis_url)
         if params is None:
             params = {}
 
@@ -33,31 +54,74 @@ class Client:
             'id': self.id,
             'name': name,
             'path': path,
-            'redis': self.redis
+            'settings': self.settings
         }
         ctx.update(params)
-        asyncio.run(execute(ctx, self.interceptors))
+        if self.loop is None:
+            self.loop = asyncio.new_event_loop()
+        return self.loop.run_until_complete(self._get(ctx))
+
+    async def _get(self, ctx):
+        # 读数据的函数是异步的，与 aioclient 一样使用 aioredis，连接在多次 get 之间复用
+        if self.aioredis is None or self.aioredis.closed:
+            self.aioredis = await aioredis.create_redis(self.redis_url)
+        ctx['redis'] = self.aioredis
+        ctx['settings'] = await self.storage.settings(self.aioredis, ctx['name'], ctx['settings'])
+        await execute(ctx, self.interceptors)
         return ctx.get('response')
 
+    def close(self):
+        # 关闭 get 使用的连接及事件循环
+        if self.loop is None:
+            return
+        if self.aioredis is not None:
+            self.aioredis.close()
+            self.loop.run_until_complete(self.aioredis.wait_closed())
+            self.aioredis = None
+        self.loop.close()
+        self.loop = None
+
     def send(self, cmd: dict):
-        # send cmd to websocket
+        """send cmd to websocket
+
+        返回 okws 是否收到指令
+        """
         # if 'name' not in cmd:
         #     logger.warning(f"未指定 websocket 服务名! {cmd}")
         cmd['id'] = self.id
-        self.redis.publish(self.listen_channel, json.dumps(cmd))
-
-    def open_ws(self, name, auth_params=None):
+        cmd['rid'] = next(self.rids)
+        return self.redis.publish(self.listen_channel, json.dumps(cmd)) > 0
+
+    def request(self, cmd: dict, timeout=None):
+        """发送指令并等待 okws 处理完成后的回复
+
+        回复中 latency 为往返时间(秒)。
+        okws 没有运行时返回 errorCode 80021，超时返回 errorCode 80020。
+        注意：会阻塞，不能在与 okws 服务相同的事件循环中使用。
+        """
+        start = time.perf_counter()
+        if not self.send(cmd):
+            return {'event': 'error', 'message': 'okws 没有运行', 'errorCode': 80021}
+        timeout = timeout or self.reply_timeout
+        ret = self.redis.blpop(f"{self.redis_path}/{cmd['rid']}", timeout=max(1, int(timeout)))
+        if ret is None:
+            return {'event': 'error', 'message': f"等待 okws 回复超时({timeout}s)", 'errorCode': 80020}
+        reply = json.loads(ret[1])
+        self.latency = reply['latency'] = time.perf_counter() - start
+        return reply
+
+    def open_ws(self, name, auth_params=None, timeout=None):
         if auth_params is None:
             auth_params = {}
 
-        self.send({
+        return self.request({
             'op': 'open',
             'name': name,
             'args': auth_params
-        })
+        }, timeout)
 
     def get_return_info(self):
-        # 取得服务器返回信息
+        # 取得服务器最近一次返回信息
         ret = self.redis.get(self.redis_path)
         logger.info(f"{self.redis_path}:{ret}")
         if ret is not None:
@@ -65,45 +129,59 @@ class Client:
         else:
             return ret
 
-    def subscribe(self, name, channels: Union[list, str]):
-        self.send({
+    def subscribe(self, name, channels: Union[list, str], timeout=None):
+        return self.request({
             'op': 'subscribe',
             'name': name,
             'args': channels if type(channels) == list else [channels]
-        })
+        }, timeout)
 
-    async def close_ws(self, name):
-        self.send({
+    def close_ws(self, name, timeout=None):
+        return self.request({
             'op': 'close',
             'name': name
-        })
+        }, timeout)
 
-    def server_quit(self):
+    def server_quit(self, timeout=None):
         # 关闭 ws
-        self.send({
+        return self.request({
             'op': 'quit_server'
-        })
+        }, timeout)
 
-    def servers(self):
+    def servers(self, timeout=None):
         # 返回当前运行的 ws
-        self.send({
+        return self.request({
             'op': 'servers'
-        })
-
-    def server_status(self, server):
-        # 返回对应服务器状态
-        path = f"okex/{server}/status"
+        }, timeout)
+
+    def catalog(self, name, since=None):
+        """okws 保存的频道及 instrument，一次 redis 请求，参数及返回值同 aioclient.Client.catalog"""
+        keys, args = catalog.args(name, since)
+        return catalog.parse(self.catalog_script(keys=keys, args=args))
+
+    def staleness(self, name, table, instruments):
+        """多个 instrument 的数据有多久没有更新，一次 redis 请求，参数及返回值同 aioclient.Client.staleness"""
+        instruments = list(instruments)
+        keys, args = catalog.staleness_args(name, table, instruments)
+        return catalog.ages(instruments, self.staleness_script(keys=keys, args=args))
+
+    def reclaimed(self, name):
+        """按保留规则(RETENTION)已删除的 key 数量，返回 {频道名: 数量}"""
+        return {table: int(n) for table, n in self.redis.hgetall(retention.stats_key(name)).items()}
+
+    def server_status(self, server, shard=None):
+        # 返回对应服务器状态，分片模式下为第 shard 个连接的状态
+        path = f"okex/{server}/status" if shard is None else f"okex/{server}/status/{shard}"
         return self.redis.get(path)
 
-    def redis_clear(self, path="okex/*"):
-        # 清除 redis 服务器中的相关数据
-        keys = self.redis.keys(path)
-        for key in keys:
-            self.redis.delete(key)
+    def redis_clear(self, path="okex/*", progress=None):
+        # 清除 redis 服务器中的相关数据，返回删除的 key 数量，见 cleanup.py
+        return cleanup.clear_sync(self.redis, path, progress=progress)
 
 
 def client(configs) -> Client:
     # 使用些函数初始化 OKEX 类
-    configs.update(default_settings)
+    # 用户设置优先
+    configs = {**default_settings, **configs}
     okex = Client(**configs)
     return okex
@@ -0,0 +1,80 @@
+"""JSON 编解码
+
+可以使用 stdlib json、orjson 或 ujson，auto 时按 orjson、ujson、json 的顺序选择已安装的，缺省为 json。
+loads 可以直接解析 bytes，dumps 返回 str。
+dumps 的结果与 json.dumps 逐字节相同(', '、': ' 分隔，非 ASCII 字符转义，'/' 不转义)，发布及保存的数据不随安装的库改变；
+orjson 不能设置分隔符，只用于 loads，dumps 使用 json.dumps。ujson 需要 5.2 以上的版本(separators 参数)。
+memoize(codec) 返回同一对象只编码一次的 codec，用于一条 ws 消息内多处发布同一数据。
+"""
+import json
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+Codec = namedtuple('Codec', ['name', 'loads', 'dumps'])
+
+
+def _json():
+    return Codec('json', json.loads, json.dumps)
+
+
+def _orjson():
+    import orjson
+
+    return Codec('orjson', orjson.loads, json.dumps)
+
+
+def _ujson():
+    import ujson
+
+    def dumps(obj):
+        return ujson.dumps(obj, ensure_ascii=True, escape_forward_slashes=False, separators=(', ', ': '))
+
+    return Codec('ujson', ujson.loads, dumps)
+
+
+CODECS = {
+    'json': _json,
+    'orjson': _orjson,
+    'ujson': _ujson,
+}
+
+
+def available():
+    # 已安装的 codec 名称
+    names = []
+    for name, factory in CODECS.items():
+        try:
+            factory()
+            names.append(name)
+        except ImportError:
+            pass
+    return names
+
+
+def get_codec(name='json'):
+    if isinstance(name, Codec):
+        return name
+    if name is None or name == 'auto':
+        for name in ('orjson', 'ujson', 'json'):
+            try:
+                return CODECS[name]()
+            except ImportError:
+                continue
+    if name not in CODECS:
+        raise ValueError(f"JSON_CODEC 只能是 auto 或 {list(CODECS)} 之一: {name}")
+    return CODECS[name]()
+
+
+def memoize(codec):
+    # 按 id 缓存编码结果，同时保存对象引用，保证缓存期间 id 不会被重用
+    cache = {}
+
+    def dumps(obj):
+        hit = cache.get(id(obj))
+        if hit is None:
+            hit = cache[id(obj)] = (obj, codec.dumps(obj))
+        return hit[1]
+
+    return Codec(codec.name, codec.loads, dumps)
@@ -0,0 +1,58 @@
+"""热备连接
+
+一个 ws 连接断开后按 wait_exponential 重试，连接不稳定时可能几分钟没有数据，重连后还要依次登录、订阅。
+热备模式下同时保持两个连接，各自登录并订阅相同的频道(由共用的 Subscribe 在连接时订阅)，
+两个连接的数据经过同一个处理链，由 Dedup 去掉重复的消息，一个连接断开或没有数据时另一个连接的数据不受影响，
+各自重连也互不影响。切换记录见 okws/ws2redis/dedup.py。
+
+配置(settings):
+    STANDBY: {enabled: false, silence: 5, window: 10000}
+        silence  leader 超过 silence 秒没有数据，另一个连接收到新数据时记为切换
+        window   去重时比较最近的消息数
+
+另一个连接仍在线时，CONNECTED、DISCONNECTED 带有 request['STANDBY'] = True，
+Ws2redis 不改变 status，Depth 不清除已合并的深度数据。两个连接都退出后才发送 EXIT。
+"""
+import asyncio
+
+from .websocket import Websockets
+
+
+class FailoverWebsockets:
+    """接口与 Websockets 相同(run, send, close)，指令发送到所有已连接的连接"""
+
+    def __init__(self, app, connections=2, **kwargs):
+        self.app = app
+        self.clients = [Websockets(self.dispatch, **kwargs) for _ in range(connections)]
+        self.connected = set()
+        self.exited = set()
+        self.lock = None
+
+    async def dispatch(self, request):
+        server = request['_server_']
+        if request['_signal_'] == 'CONNECTED':
+            self.connected.add(server)
+        elif request['_signal_'] == 'DISCONNECTED':
+            self.connected.discard(server)
+        elif request['_signal_'] == 'EXIT':
+            self.exited.add(server)
+            if len(self.exited) < len(self.clients):
+                return
+        request['STANDBY'] = bool(self.connected - {server})
+        # 两个连接的处理任务依次处理，保证写入顺序
+        async with self.lock:
+            await self.app(request)
+
+    async def run(self):
+        self.lock = asyncio.Lock()
+        await asyncio.gather(*[client.run() for client in self.clients])
+
+    async def send(self, msg):
+        clients = [client for client in self.clients if client.ws is not None]
+        # 都没有连接时由 Websockets.send 记录警告
+        for client in clients or self.clients[:1]:
+            await client.send(msg)
+
+    def close(self):
+        for client in self.clients:
+            client.close()
@@ -4,9 +4,11 @@ import datetime
 import hmac
 import json
 import logging
+import re
 import zlib
 from collections.abc import Mapping
 
+from .codec import get_codec
 from .interceptor import add_response, Interceptor
 
 """用法:
@@ -14,8 +16,8 @@ from .interceptor import add_response, Interceptor
     cfg: {apiKey,secret,password}
     如果有 apiKey，则当联接到 ws 服务器时，自动登录
     主要功能：
-    * 将 ws 发送的 byte 数据转换到 utf-8
-    * 将 json 字符串转换成 map 到 ctx['DATA']中，原始数据在 ctx['_data_'] 中
+    * 解压 ws 发送的数据
+    * 将 json 转换成 map 到 ctx['DATA']中，原始数据在 ctx['_data_'] 中，解压后的 json 在 ctx['RAW'] 中，json 编解码见 codec.py
     * 如果有登录参数，则在联接到 ws 服务器时，自动登录
     * 超时自动发送 ping 到 ws 服务器
 """
@@ -27,18 +29,47 @@ def _get_timestamp():
 
 
 def _inflate(data):
-    decompress = zlib.decompressobj(-zlib.MAX_WBITS)  # see above
-    inflated = decompress.decompress(data)
-    inflated += decompress.flush()
-    return inflated
+    # 每条数据是独立的 raw deflate 流，一次解压，不用每次创建 decompressobj
+    return zlib.decompress(data, -zlib.MAX_WBITS)
+
+
+# 只保存最新状态的频道，可以用新数据替换还没有处理的旧数据
+CONFLATE_TABLES = ('/ticker', '/mark_price', '/funding_rate', '/price_range', '/estimated_price', '/depth5')
+
+
+def conflate_key(data):
+    """Websockets 队列满时使用，返回 '<table>:<instrument_id>'，不能合并的数据返回 None"""
+    try:
+        msg = json.loads(_inflate(data))
+    except Exception:
+        return None
+    table = msg.get('table', '') if isinstance(msg, dict) else ''
+    rows = (msg.get('data') or []) if table.endswith(CONFLATE_TABLES) else []
+    if len(rows) == 1 and 'instrument_id' in rows[0]:
+        return f"{table}:{rows[0]['instrument_id']}"
+    return None
+
+
+def is_pong(data):
+    """Websockets 用于计算 ping 的往返时间"""
+    if isinstance(data, str):
+        return data == 'pong'
+    # 压缩后的 pong 只有几个字节，不用解压其它数据
+    if len(data) > 16:
+        return False
+    try:
+        return _inflate(data) == b'pong'
+    except zlib.error:
+        return False
 
 
 class Decode(Interceptor):
-    def __init__(self, cfg=None):
+    def __init__(self, cfg=None, codec='json'):
         super().__init__('Decode')
         if cfg is None:
             cfg = {}
         self.cfg = cfg
+        self.codec = get_codec(codec)
 
     @staticmethod
     async def ping(ws):
@@ -52,13 +83,16 @@ class Decode(Interceptor):
                 await logon(ctx, self.cfg)
 
         elif ctx["_signal_"] == "ON_DATA":
+            buff = ctx["_data_"]
             try:
-                buff = _inflate(ctx["_data_"]).decode("utf-8")
-                if buff == 'pong':
+                buff = _inflate(buff)
+                if buff == b'pong':
                     ctx["_signal_"] = "PING"
                     # ctx["DATA"] = {}
                 else:
-                    ctx["DATA"] = json.loads(buff)
+                    ctx["DATA"] = self.codec.loads(buff)
+                    # 解压后的 json 原样转发，不用再编码
+                    ctx["RAW"] = buff
             except Exception:
                 logging.exception(f"不能解析收到的交易所信息:{buff}")
                 ctx["DATA"] = {}
@@ -73,12 +107,19 @@ class Decode(Interceptor):
             resp = []
             for res in ctx["response"]:
                 if isinstance(res, Mapping):
-                    resp.append(json.dumps(res))
+                    resp.append(self.codec.dumps(res))
                 elif isinstance(res, str):
                     resp.append(res)
             ctx["response"] = resp
 
 
+def error_channels(data, channels):
+    """error 回复中提到的频道，okex 的错误信息中有频道名，如 Channel spot/tickr:BTC-USDT doesn't exist"""
+    words = set(re.findall(r"[\w/:.\-]+", str(data.get('message', ''))))
+    words.add(data.get('channel'))
+    return [channel for channel in channels if channel in words]
+
+
 # 一些工具函数
 
 
@@ -29,69 +29,107 @@ logger = logging.getLogger(__name__)
 class RedisCommand:
     # 处理通过 redis 发过来的用户命令
 
-    def __init__(self, redis_url='redis://localhost', redis_info_key='trade-ws/info'):
+    # 回复列表的过期时间(秒)，客户端超时后不会留下垃圾数据
+    REPLY_EXPIRE = 60
+
+    def __init__(self, redis_url='redis://localhost', redis_info_key='trade-ws/info', settings=None):
         self.ws_clients = {}
+        self.settings = settings if settings is not None else {}
         self.tasks = {}
         self.redis = None
         self.redis_url = redis_url
         self.redis_info_key = redis_info_key
-
-    async def redis_msg(self, cid, event, msg, errorcode):
-        # event: info, warn, error
-        msg = {"event": event, "message": msg, "errorCode": errorcode}
-        msg = json.dumps(msg)
-        logger.debug(msg)
-        await self.redis.set(f"{self.redis_info_key}/{cid}", msg)
-
-    async def ws_send(self, ctx):
-        cmd = json.loads(ctx['_data_'])
+        # 已订阅 LISTEN_CHANNEL，可以接收指令
+        self.ready = asyncio.Event()
+
+    async def redis_msg(self, cmd, event, msg, errorcode):
+        """回复客户端
+
+        event: info, warn, error
+        指令中有 rid 时，回复写入列表 REDIS_INFO_KEY/<id>/<rid>，客户端使用 BLPOP 等待，
+        同时写入 REDIS_INFO_KEY/<id> 兼容旧的客户端。
+        """
+        reply = {"event": event, "message": msg, "errorCode": errorcode}
+        if 'rid' in cmd:
+            reply['rid'] = cmd['rid']
+        reply = json.dumps(reply)
+        logger.debug(reply)
+        pipe = self.redis.pipeline()
+        pipe.set(f"{self.redis_info_key}/{cmd.get('id')}", reply)
+        if 'rid' in cmd:
+            reply_key = f"{self.redis_info_key}/{cmd.get('id')}/{cmd['rid']}"
+            pipe.rpush(reply_key, reply)
+            pipe.expire(reply_key, self.REPLY_EXPIRE)
+        await pipe.execute()
+
+    async def ws_send(self, cmd):
         name = cmd['name']
-        cid = cmd['id']
         if name in self.ws_clients:
-            del cmd['name']
-            del cmd['id']
-            await self.ws_clients[name].send(json.dumps(cmd))
-            await self.redis_msg(cid, 'info', '已发送到 websocket 服务器', 80000)
+            msg = {k: v for k, v in cmd.items() if k not in ('name', 'id', 'rid')}
+            await self.ws_clients[name].send(json.dumps(msg))
+            await self.redis_msg(cmd, 'info', '已发送到 websocket 服务器', 80000)
         else:
-            await self.redis_msg(cid, 'error',
+            await self.redis_msg(cmd, 'error',
                                  f"没有对应的 {cmd['name']} websocket 连接！", 80011)
 
-    async def close_ws(self, ctx):
-        cmd = json.loads(ctx['_data_'])
+    async def close_ws(self, cmd):
         if cmd['name'] in self.ws_clients:
             self.ws_clients[cmd['name']].close()
             del self.ws_clients[cmd['name']]
-            await self.redis_msg(cmd['id'], 'info', '', 80000)
+            await self.redis_msg(cmd, 'info', '', 80000)
         else:
             msg = f"没有对应的 {cmd['name']} websocket 连接！"
             logging.warning(msg)
-            await self.redis_msg(cmd['id'], 'error', msg, 80011)
+            await self.redis_msg(cmd, 'error', msg, 80011)
 
-    async def open_ws(self, ctx):
-        cmd = json.loads(ctx['_data_'])
+    async def open_ws(self, cmd):
         if cmd['name'] in self.ws_clients:
             msg = f"{cmd['name']} 已存在!"
-            await self.redis_msg(cmd['id'], 'error', msg, 80001)
+            await self.redis_msg(cmd, 'error', msg, 80001)
             logger.warning(msg)
             return
         if 'name' in cmd:
             args = cmd.get('args', {})
-            client = okws.Websockets(okws.app(cmd['name'], args, self.redis_url))
+            queue = self.settings.get('WS_QUEUE') or {}
+            ping = self.settings.get('PING') or {}
+            kwargs = dict(queue_size=queue.get('size', 1000),
+                          overflow=queue.get('overflow', 'block'),
+                          conflate_key=okws.okex.conflate_key,
+                          ping_interval=ping.get('interval', 0),
+                          ping_timeout=ping.get('timeout', 5),
+                          is_pong=okws.okex.is_pong,
+                          rtt_samples=ping.get('samples', 100))
+            # 热备模式，见 failover.py
+            websockets = okws.failover.FailoverWebsockets if (self.settings.get('STANDBY') or {}).get('enabled') \
+                else okws.Websockets
+            # 一个服务名使用多个 ws 连接，见 shard.py
+            shards = self.settings.get('SHARDS') or {}
+            count = args.get('shards') or shards.get('count', 1)
+            if count > 1:
+                client = okws.shard.ShardedWebsockets(
+                    lambda n: okws.app(cmd['name'], args, self.redis_url, self.settings, shard=n),
+                    count, shards.get('by', 'hash'), websockets=websockets, **kwargs)
+            else:
+                client = websockets(okws.app(cmd['name'], args, self.redis_url, self.settings), **kwargs)
             self.ws_clients[cmd['name']] = client
             task = asyncio.create_task(client.run())
             self.tasks[cmd['name']] = task
-            await self.redis_msg(cmd['id'], 'info', '', 80000)
+            await self.redis_msg(cmd, 'info', '', 80000)
         else:
             msg = f"指令错误:{cmd}"
-            await self.redis_msg(cmd['id'], 'error', msg, 80010)
+            await self.redis_msg(cmd, 'error', msg, 80010)
             logger.warning(msg)
 
     async def execute(self, ctx):
         if ctx['_signal_'] == 'CONNECTED':
             logger.info('okws 服务已启动！')
+            self.ready.set()
+        elif ctx['_signal_'] == 'DISCONNECTED':
+            self.ready.clear()
 
         elif ctx['_signal_'] == 'ON_DATA':
             # logging.info(ctx)
+            cmd = {}
             try:
                 self.check_tasks()
                 cmd = json.loads(ctx['_data_'])
@@ -101,22 +139,23 @@ class RedisCommand:
                     del msg['args']
                 logger.info(f"收到命令：{msg}")
                 if cmd['op'] == 'open':
-                    await self.open_ws(ctx)
+                    await self.open_ws(cmd)
                 elif cmd['op'] == 'close':
-                    await self.close_ws(ctx)
+                    await self.close_ws(cmd)
                 elif cmd['op'] == 'quit_server':
+                    # 先回复，close 后任务会被取消
+                    await self.redis_msg(cmd, 'info', '', 80000)
                     ctx['_server_'].close()
-                    await self.redis_msg(cmd['id'], 'info', '', 80000)
                 elif cmd['op'] == 'servers':
-                    await self.redis_msg(cmd['id'], 'info', list(self.ws_clients.keys()), 80000)
+                    await self.redis_msg(cmd, 'info', list(self.ws_clients.keys()), 80000)
                 else:
                     # 发送到对应的 ws client
-                    await self.ws_send(ctx)
+                    await self.ws_send(cmd)
 
             except Exception:
                 msg = f"指令错误：{ctx['_data_']}"
                 logging.exception(msg)
-                await self.redis_msg(cmd['id'], 'error', msg, 80010)
+                await self.redis_msg(cmd, 'error', msg, 80010)
 
     async def __call__(self, *args, **kwargs):
         if self.redis is None:
@@ -152,6 +191,6 @@ class RedisCommand:
         logger.info("okws 退出！")
 
 
-async def run(redis_url='redis://localhost', listen_channel='trade-ws', redis_info_key='trade-ws/info'):
-    redis = okws.Redis(listen_channel, RedisCommand(redis_url, redis_info_key))
+async def run(redis_url='redis://localhost', listen_channel='trade-ws', redis_info_key='trade-ws/info', settings=None):
+    redis = okws.Redis(listen_channel, RedisCommand(redis_url, redis_info_key, settings))
     await redis.run()
@@ -2,5 +2,41 @@ default_settings = {
     'REDIS_URL': "redis://localhost",
     'MAX_ROW': 1000,
     'LISTEN_CHANNEL': 'trade-ws',
-    'REDIS_INFO_KEY': 'trade-ws/info'
+    'REDIS_INFO_KEY': 'trade-ws/info',
+    # 客户端等待 okws 回复指令的超时时间(秒)
+    'REPLY_TIMEOUT': 10,
+    # okws 启动时等待连接、登录、订阅、第一条数据各阶段的超时时间(秒)
+    'STARTUP_TIMEOUT': 60,
+    # ws 消息写入 redis 的方式: pipeline, multi(MULTI/EXEC), none(逐条发送)
+    'REDIS_BATCH': 'pipeline',
+    # 按频道名匹配的数据保留规则，见 okws/ws2redis/retention.py
+    'RETENTION': {},
+    # /trade, /order, /order_algo 的存储方式: zset(有序集合 + hash) 或 stream(redis stream，保留规则只支持 max_row)
+    'UNI_ID_STORAGE': 'zset',
+    # 深度数据在本地合并后写入 redis 的档数及最短间隔(秒)
+    'DEPTH': {'levels': 20, 'interval': 0.1},
+    # ws 接收数据队列的长度，及队列满时的处理方式: block(等待), drop_oldest(丢弃最早的数据), conflate(合并 ticker 等数据)
+    'WS_QUEUE': {'size': 1000, 'overflow': 'block'},
+    # JSON 编解码: auto(按 orjson, ujson, json 的顺序选择已安装的), json, orjson, ujson
+    'JSON_CODEC': 'json',
+    # 合并 ticker 等高频数据，只定时写入每个 instrument 的最新数据，见 okws/ws2redis/conflate.py
+    'CONFLATE': {'tables': [], 'interval': 0.1, 'max_rows': 1000},
+    # 由基础 k 线合成大周期 k 线，如 {'candle60s': [300, 900, 3600]}，见 okws/ws2redis/aggregate.py
+    'CANDLE_AGGREGATE': {},
+    # k 线的存储方式: hash(有序集合 + 每根 k 线一个 hash) 或 packed(每个 instrument 一个有序集合)，见 okws/ws2redis/packed.py
+    'CANDLE_STORAGE': 'hash',
+    # 记录保存了哪些频道及 instrument，用 Client.catalog 查询，见 okws/ws2redis/catalog.py
+    'CATALOG': True,
+    # 心跳间隔(秒)，收到数据时定时在 okex/<name>/event 上发送 ON_DATA 及消息数并更新 status，queue 每次心跳都更新
+    'HEARTBEAT': 1,
+    # 一个服务名使用 count 个 ws 连接，频道按 hash(频道名)或 load(连接的频道数)分配，见 okws/shard.py
+    'SHARDS': {'count': 1, 'by': 'hash'},
+    # 工作进程数，大于 0 时每个服务名分配到一个工作进程中运行，主进程转发指令，0 为单进程，见 okws/worker.py
+    'WORKERS': 0,
+    # 热备模式: 每个连接同时保持两个 ws 连接并订阅相同的频道，去掉重复的消息，切换记录在 okex/<name>/failover，见 okws/failover.py
+    'STANDBY': {'enabled': False, 'silence': 5, 'window': 10000},
+    # 每隔 interval 秒 ping 一次，timeout 秒内没有 pong 时重新连接，最近 samples 次往返时间的统计写在 okex/<name>/status/rtt，interval 为 0 时不发送
+    'PING': {'interval': 5, 'timeout': 5, 'samples': 100},
+    # 重连后分批重新订阅: 每批最多 chunk 个频道及 max_bytes 字节，最多 inflight 批等待回复，timeout 秒没有回复的重试 retries 次，见 okws/ws2redis/subscribe.py
+    'RESUBSCRIBE': {'chunk': 100, 'max_bytes': 4000, 'inflight': 2, 'timeout': 10, 'retries': 2}
 }
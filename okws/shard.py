@@ -0,0 +1,119 @@
+"""一个服务名使用多个 ws 连接
+
+频道很多时(如几百个深度、成交频道)，一个 ws 连接的带宽及一个处理任务会成为瓶颈。
+分片模式下一个服务名的订阅分到 count 个连接(shard)上，每个连接有自己的 Decode、Subscribe、Depth、Ws2redis，
+数据仍写到 okex/<name>/... 下，Client.get 不需要改变。
+
+配置(settings):
+    SHARDS: {count: 连接数, by: hash 或 load}
+        hash  按频道名的 crc32 分配，同一个频道总在同一个连接上
+        load  分配到当前订阅频道最少的连接上
+    servers 中可以用 shards: <连接数> 单独设置某个服务的连接数。
+
+一个频道订阅后固定在所分配的连接上(重连时由该连接的 Subscribe 重新订阅)，退订或收到订阅的 error 回复后释放。
+每个连接在 okex/<name>/event 上发送的事件(包括 login 等 ws 事件)带有 shard，
+连接状态及接收队列的统计数据写在 okex/<name>/status/<shard>、okex/<name>/queue/<shard> 上。
+"""
+import asyncio
+import json
+import logging
+import zlib
+
+from .okex import error_channels
+from .websocket import Websockets
+
+logger = logging.getLogger(__name__)
+
+MODES = ('hash', 'load')
+
+
+class Router:
+    """分配频道到连接"""
+
+    def __init__(self, count, by='hash'):
+        if count < 1:
+            raise ValueError(f"SHARDS count 应大于 0: {count}")
+        if by not in MODES:
+            raise ValueError(f"SHARDS by 应为 {MODES} 之一: {by}")
+        self.count = count
+        self.by = by
+        # 频道 -> 连接序号
+        self.channels = {}
+        # 每个连接的频道数
+        self.load = [0] * count
+
+    def shard(self, channel):
+        """返回频道所在的连接，没有时分配一个"""
+        if channel not in self.channels:
+            if self.by == 'hash':
+                n = zlib.crc32(channel.encode('utf-8')) % self.count
+            else:
+                n = min(range(self.count), key=self.load.__getitem__)
+            self.channels[channel] = n
+            self.load[n] += 1
+        return self.channels[channel]
+
+    def release(self, channel):
+        """退订时释放频道，返回所在的连接，没有分配过时返回 None"""
+        n = self.channels.pop(channel, None)
+        if n is not None:
+            self.load[n] -= 1
+        return n
+
+    def split(self, op, channels):
+        """按连接分组: {连接序号: [频道, ...]}
+
+        退订没有分配过的频道时，连接序号为 None，表示发送到所有连接
+        """
+        groups = {}
+        for channel in channels:
+            n = self.shard(channel) if op == 'subscribe' else self.release(channel)
+            groups.setdefault(n, []).append(channel)
+        return groups
+
+    def shards(self):
+        """每个连接的频道 [[频道, ...], ...]"""
+        result = [[] for _ in range(self.count)]
+        for channel, n in self.channels.items():
+            result[n].append(channel)
+        return result
+
+
+class ShardedWebsockets:
+    """接口与 Websockets 相同(run, send, close)，send 的订阅、退订指令按 Router 分到各个连接"""
+
+    def __init__(self, make_app, count, by='hash', websockets=Websockets, **kwargs):
+        """make_app(shard) 返回第 shard 个连接的 app，kwargs 传给 websockets(Websockets 或 FailoverWebsockets)"""
+        self.router = Router(count, by)
+        self.clients = [websockets(self.watch(make_app(n), n), **kwargs) for n in range(count)]
+
+    def watch(self, app, n):
+        # 订阅收到 error 回复(如频道不存在)的频道与退订一样从 Router 中释放，不再占用连接
+        async def _app(request):
+            await app(request)
+            data = request.get('DATA')
+            if request['_signal_'] == 'ON_DATA' and isinstance(data, dict) and data.get('event') == 'error':
+                channels = [channel for channel, shard in self.router.channels.items() if shard == n]
+                for channel in error_channels(data, channels):
+                    self.router.release(channel)
+                    logger.info(f"shard {n} 订阅失败，释放频道 {channel}")
+
+        return _app
+
+    async def run(self):
+        await asyncio.gather(*[client.run() for client in self.clients])
+
+    async def send(self, msg):
+        cmd = json.loads(msg)
+        if cmd.get('op') in ('subscribe', 'unsubscribe'):
+            for n, channels in self.router.split(cmd['op'], cmd.get('args', [])).items():
+                part = json.dumps({**cmd, 'args': channels})
+                for client in self.clients if n is None else [self.clients[n]]:
+                    await client.send(part)
+        else:
+            for client in self.clients:
+                await client.send(msg)
+
+    def close(self):
+        for client in self.clients:
+            client.close()
@@ -0,0 +1,42 @@
+"""启动及恢复服务时等待 okex/<name>/event 上的事件，cli.start_server 及 worker.Supervisor.restore 共用"""
+import asyncio
+
+
+async def wait_event(ch, done, timeout):
+    """等待 okex/<name>/event 上的事件，直到 done(event) 返回 True
+
+    超时返回 False
+    """
+    async def _wait():
+        while True:
+            event = await ch.get_json()
+            if event is None:
+                return False
+            if done(event):
+                return True
+
+    try:
+        return await asyncio.wait_for(_wait(), timeout)
+    except asyncio.TimeoutError:
+        return False
+
+
+def shard_count(config, server):
+    # 分片模式下服务的连接数，见 shard.py
+    return server.get('shards') or (config['settings'].get('SHARDS') or {}).get('count', 1)
+
+
+def each_shard(count, match):
+    """返回 done(event)，count 个连接都收到 match 的事件后才返回 True
+
+    分片模式下先连接(登录)的连接会先发出事件，这时订阅的频道在其它连接上会丢失。
+    按事件中的 shard 计数，同一个连接重连的事件只算一次，热备连接的事件(standby: true)不计
+    """
+    seen = set()
+
+    def done(event):
+        if match(event) and not event.get('standby'):
+            seen.add(event.get('shard'))
+        return len(seen) >= count
+
+    return done
@@ -1,7 +1,9 @@
 import asyncio
 import logging
 import socket
+import time
 from asyncio.exceptions import CancelledError, TimeoutError
+from collections import deque
 
 import websockets
 from tenacity import retry, wait_exponential
@@ -9,6 +11,177 @@ from websockets.exceptions import ConnectionClosed, ConnectionClosedError
 
 logger = logging.getLogger(__name__)
 
+OVERFLOWS = ('block', 'drop_oldest', 'conflate')
+
+
+class FrameQueue:
+    """接收和处理之间的有界队列
+
+    overflow: 队列满时的处理方式
+        block: 等待处理，不接收新数据 (缺省)
+        drop_oldest: 丢弃最早的数据
+        conflate: 用新数据替换队列中 conflate_key 相同的数据，没有可替换的数据时等待
+    conflate_key(frame): 返回数据的 key (如 'spot/ticker:BTC-USDT')，不能合并的数据返回 None
+    信号 (如 TIMEOUT) 不会被丢弃或替换。
+    """
+
+    def __init__(self, maxsize=1000, overflow='block', conflate_key=None):
+        if overflow not in OVERFLOWS:
+            raise ValueError(f"overflow 只能是 {OVERFLOWS} 之一: {overflow}")
+        if overflow == 'conflate' and conflate_key is None:
+            raise ValueError("overflow 为 conflate 时需要 conflate_key")
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.conflate_key = conflate_key
+        # [signal, frame, 入队时间, key]，key 在需要时才计算
+        self.items = deque()
+        self.not_empty = asyncio.Event()
+        self.not_full = asyncio.Event()
+        self.not_full.set()
+        self.unfinished = 0
+        self.all_done = asyncio.Event()
+        self.all_done.set()
+        self.counters = {'received': 0, 'taken': 0, 'processed': 0, 'dropped': 0, 'conflated': 0,
+                         'max_depth': 0, 'blocked': 0.0, 'wait': 0.0, 'max_wait': 0.0}
+
+    def __len__(self):
+        return len(self.items)
+
+    def full(self):
+        return len(self.items) >= self.maxsize
+
+    def _key(self, item):
+        if item[0] == 'ON_DATA' and item[3] is None:
+            item[3] = self.conflate_key(item[1]) or ''
+        return item[3]
+
+    def _conflate(self, item):
+        # 替换队列中 key 相同的数据，保留原来的位置
+        key = self._key(item)
+        if key:
+            for queued in self.items:
+                if queued[0] == 'ON_DATA' and self._key(queued) == key:
+                    queued[1] = item[1]
+                    self.counters['conflated'] += 1
+                    return True
+        return False
+
+    async def put(self, signal, frame=None):
+        item = [signal, frame, time.perf_counter(), None]
+        if signal == 'ON_DATA':
+            self.counters['received'] += 1
+        while self.full():
+            if signal == 'ON_DATA' and self.overflow == 'drop_oldest':
+                for i, queued in enumerate(self.items):
+                    if queued[0] == 'ON_DATA':
+                        del self.items[i]
+                        self.counters['dropped'] += 1
+                        self._task_done()
+                        break
+                else:
+                    await self._wait_not_full()
+            elif signal == 'ON_DATA' and self.overflow == 'conflate' and self._conflate(item):
+                return
+            else:
+                await self._wait_not_full()
+        self.items.append(item)
+        self.unfinished += 1
+        self.all_done.clear()
+        self.counters['max_depth'] = max(self.counters['max_depth'], len(self.items))
+        self.not_empty.set()
+
+    async def _wait_not_full(self):
+        start = time.perf_counter()
+        self.not_full.clear()
+        await self.not_full.wait()
+        self.counters['blocked'] += time.perf_counter() - start
+
+    async def get(self):
+        """返回 (signal, frame)，处理完后要调用 task_done()"""
+        while not self.items:
+            self.not_empty.clear()
+            await self.not_empty.wait()
+        signal, frame, enqueued, _key = self.items.popleft()
+        wait = time.perf_counter() - enqueued
+        self.counters['taken'] += 1
+        self.counters['wait'] += wait
+        self.counters['max_wait'] = max(self.counters['max_wait'], wait)
+        self.not_full.set()
+        return signal, frame
+
+    def task_done(self):
+        self.counters['processed'] += 1
+        self._task_done()
+
+    def _task_done(self):
+        self.unfinished -= 1
+        if self.unfinished <= 0:
+            self.all_done.set()
+
+    async def join(self):
+        await self.all_done.wait()
+
+    def clear(self):
+        # 丢弃队列中的数据
+        for signal, _frame, _enqueued, _key in self.items:
+            if signal == 'ON_DATA':
+                self.counters['dropped'] += 1
+            self._task_done()
+        self.items.clear()
+        self.not_full.set()
+
+    def stats(self):
+        """depth: 当前队列长度，max_depth: 最大长度，blocked: 因队列满接收等待的总时间(秒)，
+        wait_avg / max_wait: 数据在队列中的平均 / 最长等待时间(秒)，dropped / conflated: 丢弃 / 合并的数据数
+        """
+        counters = self.counters
+        return {
+            'depth': len(self.items),
+            'max_depth': counters['max_depth'],
+            'received': counters['received'],
+            'processed': counters['processed'],
+            'dropped': counters['dropped'],
+            'conflated': counters['conflated'],
+            'blocked': round(counters['blocked'], 6),
+            'wait_avg': round(counters['wait'] / counters['taken'], 6) if counters['taken'] else 0,
+            'max_wait': round(counters['max_wait'], 6),
+        }
+
+
+class RTT:
+    """最近 samples 次 ping 的往返时间(秒)
+
+    stats() 中时间单位为毫秒，le_<n>ms 为往返时间不超过 n 毫秒的次数(累计直方图)，missed 为没有按时收到 pong 的总次数
+    """
+    BUCKETS = (5, 10, 20, 50, 100, 200, 500, 1000)
+
+    def __init__(self, samples=100):
+        self.samples = deque(maxlen=samples)
+        self.missed = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds * 1000)
+
+    def miss(self):
+        self.missed += 1
+
+    @property
+    def last(self):
+        return self.samples[-1] if self.samples else None
+
+    def stats(self):
+        stats = {'missed': self.missed, 'samples': len(self.samples)}
+        if self.samples:
+            ordered = sorted(self.samples)
+            stats.update(last=round(self.samples[-1], 3), min=round(ordered[0], 3),
+                         avg=round(sum(ordered) / len(ordered), 3),
+                         p50=round(ordered[len(ordered) // 2], 3),
+                         p99=round(ordered[min(len(ordered) - 1, len(ordered) * 99 // 100)], 3),
+                         max=round(ordered[-1], 3))
+            for bucket in self.BUCKETS:
+                stats[f"le_{bucket}ms"] = sum(1 for rtt in ordered if rtt <= bucket)
+        return stats
+
 
 class Websockets:
     """连接到 OKEX ws 服务器
@@ -35,12 +208,18 @@ class Websockets:
 
     """
 
-    def __init__(self, app, ws_url="wss://real.okex.com:8443/ws/v3", timeout=25):
+    def __init__(self, app, ws_url="wss://real.okex.com:8443/ws/v3", timeout=25,
+                 queue_size=1000, overflow='block', conflate_key=None,
+                 ping_interval=0, ping_timeout=5, is_pong=None, rtt_samples=100):
         """初始化
 
         Args:
             app ([type]): websocket 回调函数，当接收到服务器数据时，会调用 app(request)
             ws_url (str, optional): [description]. Defaults to "wss://real.okex.com:8443/ws/v3".
+            queue_size, overflow, conflate_key: 接收数据后放到队列中，由另一个任务调用 app 处理，
+                处理慢时不会影响接收，队列满时的处理方式见 FrameQueue
+            ping_interval, ping_timeout, is_pong: 连接后每隔 ping_interval 秒发送 ping，is_pong(frame) 判断收到的是否为 pong，
+                往返时间记录在 rtt 中，ping_timeout 秒内没有收到 pong 时断开重连，ping_interval 为 0 时不发送
         """
         self.ws_url = ws_url
         self.timeout = timeout
@@ -48,6 +227,12 @@ class Websockets:
         self.app = app
         self.lock = None
         self.task = None
+        self.queue = FrameQueue(queue_size, overflow, conflate_key)
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.is_pong = is_pong
+        self.rtt = RTT(rtt_samples)
+        self.pong = None
 
     async def run_app(self, signal, **request):
         request["_signal_"] = signal
@@ -64,6 +249,66 @@ class Websockets:
         await asyncio.wait_for(self.send("ping"), timeout=10)
         return await asyncio.wait_for(self.ws.recv(), timeout=10)
 
+    async def heartbeat(self):
+        # 独立于 recv 超时，定时 ping，没有按时收到 pong 时中断连接，由 serve 重连
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            self.pong.clear()
+            start = time.perf_counter()
+            await self.send("ping")
+            try:
+                await asyncio.wait_for(self.pong.wait(), self.ping_timeout)
+                self.rtt.add(time.perf_counter() - start)
+            except TimeoutError:
+                self.rtt.miss()
+                logger.warning(f"{self.ping_timeout} 秒内没有收到 pong，重新连接")
+                if self.ws is not None:
+                    self.ws.transport.abort()
+                return
+
+    async def process(self):
+        # 从队列中取数据调用 app
+        while True:
+            signal, frame = await self.queue.get()
+            try:
+                if signal == 'ON_DATA':
+                    await self.run_app("ON_DATA", _data_=frame)
+                else:
+                    # 其它任务放入的信号(如 RESUBSCRIBED)，frame 为 request 中的数据
+                    await self.run_app(signal, **(frame or {}))
+            except CancelledError:
+                raise
+            except Exception:
+                logger.exception("处理数据出错")
+            finally:
+                self.queue.task_done()
+
+    async def receive(self, processor):
+        while True:
+            try:
+                res_b = await asyncio.wait_for(
+                    self.ws.recv(), timeout=self.timeout
+                )
+                if self.is_pong is not None and self.is_pong(res_b):
+                    self.pong.set()
+                await self.queue.put("ON_DATA", res_b)
+            except TimeoutError:
+                await self.queue.put('TIMEOUT')
+            if processor.done():
+                # 处理任务意外退出
+                processor.result()
+                raise RuntimeError("处理任务已退出")
+
+    @staticmethod
+    async def stop(tasks):
+        # 取消任务并等待结束
+        for task in tasks:
+            task.cancel()
+        await asyncio.wait(tasks)
+        for task in tasks:
+            if not task.cancelled() and task.exception() is not None:
+                logger.error(f"任务出错：{task.exception()!r}")
+
     # 重试 最短时间停1s,最大停5分钟后重试
     @retry(wait=wait_exponential(multiplier=1, min=1, max=300))
     async def serve(self):
@@ -72,16 +317,23 @@ class Websockets:
             await self.run_app("READY")
             async with websockets.connect(self.ws_url) as self.ws:
                 logger.info("已连接到 ws 服务器")
+                # 上一个连接没有处理完的数据
+                self.queue.clear()
                 await self.run_app("CONNECTED")
-                while True:
-                    # await asyncio.sleep(0)
+                processor = asyncio.create_task(self.process())
+                pinger = asyncio.create_task(self.heartbeat()) if self.ping_interval and self.is_pong else None
+                try:
+                    await self.receive(processor)
+                except (ConnectionClosed, ConnectionClosedError, ConnectionResetError, socket.error):
+                    # 处理完已经收到的数据
                     try:
-                        res_b = await asyncio.wait_for(
-                            self.ws.recv(), timeout=self.timeout
-                        )
-                        await self.run_app("ON_DATA", _data_=res_b)
+                        await asyncio.wait_for(self.queue.join(), timeout=self.timeout)
                     except TimeoutError:
-                        await self.run_app('TIMEOUT')
+                        logger.warning(f"连接断开时还有 {len(self.queue)} 条数据没有处理")
+                    raise
+                finally:
+                    # 等待任务结束后才发送 DISCONNECTED，不会与还在运行的处理任务同时调用 app
+                    await self.stop([task for task in (processor, pinger) if task is not None])
 
         except (ConnectionClosed, ConnectionClosedError, ConnectionResetError, socket.error):
             logger.exception("连接断开")
@@ -97,6 +349,7 @@ class Websockets:
         try:
             self.task = asyncio.current_task()
             self.lock = asyncio.Lock()
+            self.pong = asyncio.Event()
             # self.task = asyncio.create_task(self.serve())
             # await self.task
             await self.serve()
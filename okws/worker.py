@@ -0,0 +1,209 @@
+"""多进程模式
+
+一个进程只能用一个 CPU 核心解压、解析 ws 数据及写入 redis，WORKERS 大于 0 时:
+    主进程 (Supervisor) 仍侦听 LISTEN_CHANNEL 上的用户指令，启动 WORKERS 个工作进程，
+    每个工作进程是一个普通的 RedisCommand，侦听 <LISTEN_CHANNEL>/worker/<序号>。
+    open 指令把服务名分配给一个工作进程(servers 中可用 worker: <序号> 指定，否则分配给服务最少的进程)，
+    之后该服务名的指令都转发给这个进程，由它直接回复客户端。
+    工作进程退出后自动重启，并重新发送 open 及订阅指令。
+
+一个服务名(包括它的所有分片连接，见 shard.py)只在一个工作进程中运行，要分到多个进程请使用多个服务名。
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+
+import aioredis
+
+from .redis import Redis
+from .redis_cmd import RedisCommand
+from .startup import each_shard, shard_count, wait_event
+
+logger = logging.getLogger(__name__)
+
+# 重新发送指令时的 id，回复写在 REDIS_INFO_KEY/supervisor
+SUPERVISOR_ID = 'supervisor'
+
+
+def worker_channel(listen_channel, index):
+    return f"{listen_channel}/worker/{index}"
+
+
+def work(redis_url, channel, redis_info_key, settings):
+    # 工作进程入口
+    logging.basicConfig(level=logging.INFO,
+                        format=f'%(asctime)s - {channel} - %(module)s[%(lineno)d] - %(levelname)s: %(message)s')
+    redis = Redis(channel, RedisCommand(redis_url, redis_info_key, settings), redis_url)
+    try:
+        asyncio.run(redis.run())
+    except KeyboardInterrupt:
+        pass
+
+
+class Supervisor(RedisCommand):
+    """管理工作进程，把用户指令转发给服务名所在的进程"""
+
+    # 检查工作进程的间隔(秒)
+    CHECK_INTERVAL = 1
+
+    def __init__(self, redis_url='redis://localhost', redis_info_key='trade-ws/info', settings=None):
+        super().__init__(redis_url, redis_info_key, settings)
+        self.listen_channel = self.settings.get('LISTEN_CHANNEL', 'trade-ws')
+        self.timeout = self.settings.get('STARTUP_TIMEOUT', 60)
+        self.context = multiprocessing.get_context('spawn')
+        self.processes = [None] * self.settings.get('WORKERS', 1)
+        # 服务名 -> 工作进程序号
+        self.owners = {}
+        # 服务名 -> open 指令，及已订阅的频道，工作进程重启后重新发送
+        self.opened = {}
+        self.subscribed = {}
+        self.monitor_task = None
+        # 工作进程序号 -> 恢复服务的任务，每个重启的进程单独恢复，不互相等待
+        self.restoring = {}
+
+    def start(self, index):
+        process = self.context.Process(
+            target=work, name=f"okws-worker-{index}", daemon=True,
+            args=(self.redis_url, worker_channel(self.listen_channel, index), self.redis_info_key, self.settings))
+        process.start()
+        self.processes[index] = process
+        logger.info(f"工作进程 {index} 已启动，pid: {process.pid}")
+
+    async def forward(self, index, cmd):
+        """发送指令到工作进程，进程还没有侦听时等待，返回是否发送成功"""
+        channel = worker_channel(self.listen_channel, index)
+        msg = json.dumps(cmd)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        while await self.redis.publish(channel, msg) == 0:
+            if loop.time() > deadline:
+                return False
+            await asyncio.sleep(0.1)
+        return True
+
+    async def send_to_owner(self, cmd):
+        index = self.owners.get(cmd.get('name'))
+        if index is None:
+            await self.redis_msg(cmd, 'error', f"没有对应的 {cmd.get('name')} websocket 连接！", 80011)
+        elif not await self.forward(index, cmd):
+            await self.redis_msg(cmd, 'error', f"工作进程 {index} 没有响应", 80012)
+
+    def assign(self, cmd):
+        index = cmd.get('args', {}).get('worker')
+        if index is None or not 0 <= index < len(self.processes):
+            load = [0] * len(self.processes)
+            for n in self.owners.values():
+                load[n] += 1
+            index = min(range(len(load)), key=load.__getitem__)
+        return index
+
+    async def open_ws(self, cmd):
+        name = cmd['name']
+        if name not in self.owners:
+            self.owners[name] = self.assign(cmd)
+            self.opened[name] = {k: v for k, v in cmd.items() if k not in ('id', 'rid')}
+            self.subscribed[name] = {}
+            logger.info(f"{name} 分配到工作进程 {self.owners[name]}")
+        await self.send_to_owner(cmd)
+
+    async def close_ws(self, cmd):
+        await self.send_to_owner(cmd)
+        name = cmd['name']
+        if name in self.owners:
+            del self.owners[name]
+            del self.opened[name]
+            del self.subscribed[name]
+
+    async def ws_send(self, cmd):
+        # 记录订阅的频道，用 dict 保持订阅顺序
+        channels = self.subscribed.get(cmd['name'])
+        if channels is not None and cmd.get('op') in ('subscribe', 'unsubscribe'):
+            for channel in cmd.get('args', []):
+                if cmd['op'] == 'subscribe':
+                    channels[channel] = True
+                else:
+                    channels.pop(channel, None)
+        await self.send_to_owner(cmd)
+
+    async def restore(self, index):
+        # 工作进程重启后，重新连接其上的服务名，所有连接都连上后再订阅
+        for name, owner in list(self.owners.items()):
+            if owner != index:
+                continue
+            open_cmd = self.opened[name]
+            events = await aioredis.create_redis(self.redis_url)
+            try:
+                ch, = await events.subscribe(f"okex/{name}/event")
+                if not await self.forward(index, {**open_cmd, 'id': SUPERVISOR_ID}):
+                    logger.error(f"工作进程 {index} 没有响应，{name} 没有恢复")
+                    continue
+                count = shard_count({'settings': self.settings}, open_cmd.get('args', {}))
+                if not await wait_event(ch, each_shard(count, lambda e: e.get('op') == 'CONNECTED'), self.timeout):
+                    logger.warning(f"{name} 连接 ws 服务器超时，仍然发送订阅指令")
+            finally:
+                events.close()
+                await events.wait_closed()
+            if self.subscribed[name]:
+                await self.forward(index, {'op': 'subscribe', 'name': name, 'args': list(self.subscribed[name]),
+                                           'id': SUPERVISOR_ID})
+            logger.info(f"{name} 已在工作进程 {index} 上恢复")
+
+    async def monitor(self):
+        while True:
+            await asyncio.sleep(self.CHECK_INTERVAL)
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    logger.warning(f"工作进程 {index} 已退出(exitcode: {process.exitcode})，重新启动")
+                    self.start(index)
+                    # 又退出时取消上一次还没完成的恢复
+                    if index in self.restoring:
+                        self.restoring.pop(index).cancel()
+                    task = self.restoring[index] = asyncio.create_task(self.restore(index))
+                    task.add_done_callback(lambda task, index=index: self.restored(index, task))
+
+    def restored(self, index, task):
+        if self.restoring.get(index) is task:
+            del self.restoring[index]
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"恢复工作进程 {index} 出错", exc_info=task.exception())
+
+    def stop(self):
+        if self.monitor_task is not None:
+            self.monitor_task.cancel()
+            self.monitor_task = None
+        for task in self.restoring.values():
+            task.cancel()
+        self.restoring = {}
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+
+    async def execute(self, ctx):
+        if ctx['_signal_'] == 'CONNECTED' and self.monitor_task is None:
+            for index in range(len(self.processes)):
+                self.start(index)
+            self.monitor_task = asyncio.create_task(self.monitor())
+        elif ctx['_signal_'] == 'EXIT':
+            self.stop()
+        elif ctx['_signal_'] == 'ON_DATA':
+            cmd = {}
+            try:
+                cmd = json.loads(ctx['_data_'])
+                if cmd.get('op') == 'servers':
+                    await self.redis_msg(cmd, 'info', list(self.owners.keys()), 80000)
+                    return
+                if cmd.get('op') == 'quit_server':
+                    for index in range(len(self.processes)):
+                        await self.forward(index, {'op': 'quit_server', 'id': SUPERVISOR_ID})
+                    self.stop()
+            except Exception:
+                msg = f"指令错误：{ctx['_data_']}"
+                logging.exception(msg)
+                await self.redis_msg(cmd, 'error', msg, 80010)
+                return
+        await super().execute(ctx)
+
+    def __del__(self):
+        self.stop()
+        super().__del__()
@@ -0,0 +1,165 @@
+"""由基础 k 线合成大周期 k 线
+
+只订阅一个基础 k 线频道(如 swap/candle60s)，按配置合成大周期 k 线(如 swap/candle300s)，
+保存和发布方式与直接订阅的 k 线相同，get(name, 'swap/candle300s', ...) 不需要改变。
+每收到一条基础 k 线，每个周期只做一次 O(1) 的合并。
+
+配置(settings):
+    CANDLE_AGGREGATE: 基础 k 线频道(不含 spot/ 等前缀) -> 合成的周期(秒)
+        CANDLE_AGGREGATE:
+          candle60s: [300, 900, 3600]
+    周期必须是基础周期的整数倍，按 UTC 0 点对齐(不支持周线)。
+    合成的频道不要再订阅，否则两份数据会互相覆盖。
+
+重启后第一次合成时，从 redis 读出当前周期内已保存的基础 k 线。
+"""
+import logging
+import re
+from datetime import datetime, timezone
+
+from .candle import FIELDS, fetch, score, store
+
+logger = logging.getLogger(__name__)
+
+_CANDLE = re.compile(r'^(.*/)?candle(\d+)s$')
+
+
+def timestamp(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def _fmt(x):
+    # 成交量累加后的字符串形式，去掉浮点误差及多余的 0
+    return f"{round(x, 8):.8f}".rstrip('0').rstrip('.')
+
+
+class Bar:
+    """一个 instrument 一个周期正在合成的 k 线
+
+    已收线的基础 k 线合并在 open, high, low, volume, currency_volume 中，
+    当前基础 k 线会不断更新，单独保存在 current 中，合成时再合并。
+    """
+    __slots__ = ('start', 'open', 'high', 'low', 'volume', 'currency_volume', 'current')
+
+    def __init__(self, start):
+        self.start = start
+        self.open = None
+        self.high = None
+        self.low = None
+        self.volume = 0.0
+        self.currency_volume = 0.0
+        self.current = None
+
+    def fold(self, candle):
+        # 合并一根已收线的基础 k 线
+        if self.open is None:
+            self.open, self.high, self.low = candle['open'], candle['high'], candle['low']
+        else:
+            if float(candle['high']) > float(self.high):
+                self.high = candle['high']
+            if float(candle['low']) < float(self.low):
+                self.low = candle['low']
+        self.volume += float(candle['volume'] or 0)
+        self.currency_volume += float(candle['currency_volume'] or 0)
+
+    def tick(self, candle):
+        """更新当前基础 k 线，返回是否有变化"""
+        if self.current is None or candle['timestamp'] == self.current['timestamp']:
+            self.current = candle
+        elif candle['timestamp'] > self.current['timestamp']:
+            self.fold(self.current)
+            self.current = candle
+        else:
+            # 旧的基础 k 线
+            return False
+        return True
+
+    def candle(self):
+        current = self.current
+        high, low = current['high'], current['low']
+        if self.open is not None:
+            if float(self.high) > float(high):
+                high = self.high
+            if float(self.low) < float(low):
+                low = self.low
+        return {
+            'timestamp': timestamp(self.start),
+            'open': current['open'] if self.open is None else self.open,
+            'high': high,
+            'low': low,
+            'close': current['close'],
+            'volume': _fmt(self.volume + float(current['volume'] or 0)),
+            'currency_volume': _fmt(self.currency_volume + float(current['currency_volume'] or 0)),
+        }
+
+
+class Aggregator:
+    def __init__(self, settings=None):
+        self.config = (settings or {}).get('CANDLE_AGGREGATE') or {}
+        for base, periods in self.config.items():
+            m = _CANDLE.match(base)
+            if m is None:
+                raise ValueError(f"CANDLE_AGGREGATE 基础频道应为 candle<秒>s: {base}")
+            for period in periods:
+                if period % int(m.group(2)) != 0:
+                    raise ValueError(f"CANDLE_AGGREGATE {base} 的周期 {period} 不是基础周期的整数倍")
+        # (table, instrument_id) -> Bar
+        self.bars = {}
+        self._cache = {}
+
+    @property
+    def enabled(self):
+        return bool(self.config)
+
+    def targets(self, table):
+        """基础 k 线频道合成的 [(周期, 频道), ...]"""
+        if table not in self._cache:
+            self._cache[table] = []
+            m = _CANDLE.match(table)
+            if m is not None:
+                prefix = m.group(1) or ''
+                for period in self.config.get(table[len(prefix):], []):
+                    self._cache[table].append((period, f"{prefix}candle{period}s"))
+        return self._cache[table]
+
+    def bar(self, table, instrument_id, period, seconds):
+        """返回 (bar, new)，new 为本地还没有这个 instrument 的 k 线，需要从 redis 补齐
+
+        bar 为 None 时表示是旧的 k 线，不需要处理
+        """
+        start = seconds - seconds % period
+        key = (table, instrument_id)
+        bar = self.bars.get(key)
+        if bar is None or start > bar.start:
+            self.bars[key] = Bar(start)
+            return self.bars[key], bar is None
+        if start < bar.start:
+            return None, False
+        return bar, False
+
+
+async def write(ctx):
+    # 在 candle.write 之前处理，不标记 response
+    aggregator = ctx.get('aggregator')
+    table = ctx['data']['table']
+    if aggregator is None or not aggregator.targets(table):
+        return
+    for d in ctx['data']['data']:
+        candle = dict(zip(FIELDS, d['candle']))
+        seconds = score(candle['timestamp'])
+        for period, target in aggregator.targets(table):
+            bar, new = aggregator.bar(target, d['instrument_id'], period, seconds)
+            if bar is None:
+                continue
+            if new:
+                # 重启后，合并当前周期内已保存的基础 k 线
+                key = f"okex/{ctx['name']}/{table}:{d['instrument_id']}"
+                for base in await fetch(ctx, key, bar.start, seconds - 1):
+                    bar.fold(base)
+            if bar.tick(candle):
+                store(ctx, target, d['instrument_id'], bar.candle())
+
+
+config = {
+    "write": {'enter': write},
+}
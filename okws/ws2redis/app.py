@@ -1,28 +1,52 @@
 """处理 okex ws 数据
 """
+import asyncio
 import json
 import logging
+import math
+import time
+from collections import Counter
 
 import aioredis
 
 import okws
+from okws.codec import get_codec, memoize
 from okws.interceptor import Interceptor, execute
-from okws.ws2redis.candle import config as candle
-from okws.ws2redis.normal import config as normal
+from okws.ws2redis.aggregate import Aggregator, config as aggregate
+from okws.ws2redis.catalog import config as catalog
+from okws.ws2redis.candle import UPSERT as candle_upsert, config as candle
+from okws.ws2redis.depth import Depth, config as depth, write_books
+from okws.ws2redis.normal import config as normal, write_row
+from .batch import batch
+from .packed import UPSERT as packed_upsert
+from .conflate import Conflate, stats_key as conflate_stats_key
+from .dedup import Dedup
+from .retention import TRIM, Retention
+from . import storage
+from .script import is_noscript, rerun_noscript
 from .subscribe import Subscribe
 
 logger = logging.getLogger(__name__)
 
 
-def app(name, api_params=None, redis_url="redis://localhost"):
+def app(name, api_params=None, redis_url="redis://localhost", settings=None, shard=None):
+    """shard: 分片模式下连接的序号，见 okws/shard.py"""
     if api_params is None:
         api_params = {}
-    decode = okws.okex.Decode(api_params)
-    ws2redis = Ws2redis(name, redis_url)
-    subscribe_record = Subscribe()
+    if settings is None:
+        settings = {}
+    decode = okws.okex.Decode(api_params, settings.get('JSON_CODEC', 'json'))
+    order_books = Depth(settings)
+    ws2redis = Ws2redis(name, redis_url, settings, shard, order_books)
+    subscribe_record = Subscribe(shard, settings)
+    interceptors = [decode, subscribe_record, order_books, ws2redis]
+    if (settings.get('STANDBY') or {}).get('enabled'):
+        # 热备模式下两个连接共用处理链，去掉重复的消息，见 okws/failover.py
+        # 放在 Subscribe 后面，每个连接都要收到自己的订阅回复
+        interceptors.insert(2, Dedup(settings))
 
     async def _app(ctx):
-        await execute(ctx, [decode, subscribe_record, ws2redis])
+        await execute(ctx, interceptors)
 
     return _app
 
@@ -30,53 +54,276 @@ def app(name, api_params=None, redis_url="redis://localhost"):
 class Ws2redis(Interceptor):
     MAX_ARRAY_LENGTH = 100,
 
-    def __init__(self, name, redis_url="redis://localhost"):
+    def __init__(self, name, redis_url="redis://localhost", settings=None, shard=None, depth=None):
+        """depth: 处理链中的 Depth，定时写入节流后还没写的 order book"""
         super().__init__(name)
+        if settings is None:
+            settings = {}
         self.name = name
+        # 分片模式下连接的序号，事件中带有 shard，见 okws/shard.py
+        self.shard = shard
         self.redis_url = redis_url
         self.redis = None
+        # 每条 ws 消息产生的 redis 写命令的发送方式，见 batch.py
+        self.batch_mode = settings.get('REDIS_BATCH', 'pipeline')
+        self.settings = settings
+        self.codec = get_codec(settings.get('JSON_CODEC', 'json'))
+        self.depth_levels = (settings.get('DEPTH') or {}).get('levels', 20)
+        self.depth = depth
+        self.depth_task = None
+        # 数据保留规则，见 retention.py
+        self.retention = Retention(settings)
+        # 合并 ticker 等高频数据，见 conflate.py
+        self.conflate = Conflate(settings)
+        self.flush_task = None
+        # 每个 (table, instrument_id) 当前的 k 线，用于判断收线，见 candle.py
+        self.candles = {}
+        # 由基础 k 线合成大周期 k 线，见 aggregate.py
+        self.aggregator = Aggregator(settings)
         # 用于指示当前 ws 状态，分别有 READY，CONNECTED，DISCONNECTED，EXIT，ON_DATA
-        self.status_path = f"okex/{self.name}/status"
+        # 分片模式下每个连接一个 status，okex/<name>/status/<shard>
+        self.status_path = f"okex/{self.name}/status" if shard is None else f"okex/{self.name}/status/{shard}"
         self.event_path = f"okex/{self.name}/event"
+        # ws 接收队列的统计数据，随心跳写入
+        self.queue_path = f"okex/{self.name}/queue" if shard is None else f"okex/{self.name}/queue/{shard}"
+        # ping 往返时间的统计数据(毫秒)，随心跳写入，见 websocket.RTT
+        self.rtt_path = f"okex/{self.name}/status/rtt" if shard is None else f"okex/{self.name}/status/rtt/{shard}"
+        # 心跳间隔(秒)，收到数据时每隔 interval 秒发送一次 ON_DATA 事件及收到的消息数，
+        # status 在没有数据约 2 个间隔后过期，0 为不发送
+        self.heartbeat = settings.get('HEARTBEAT', 1)
+        self.status_ttl = max(1, math.ceil(2 * (self.heartbeat or 0)))
+        self.heartbeat_task = None
+        self.server = None
+        # 上次心跳后收到的消息数，总消息数
+        self.received = Counter()
+        self.total = 0
+        # 连接后是否已收到频道数据，收到第一条时发送 FIRST_DATA 事件
+        self.first_data = False
+        # 热备连接的切换记录，见 dedup.py
+        self.failover_path = f"okex/{self.name}/failover"
 
     async def enter(self, request):
         # logger.debug(f"request={request}")
         if request['_signal_'] == 'READY' and self.redis is None:
             self.redis = await aioredis.create_redis_pool(self.redis_url)
+            await candle_upsert.load(self.redis)
+            await TRIM.load(self.redis)
+            await packed_upsert.load(self.redis)
+            # client 按记录的存储方式读取
+            await self.redis.hmset_dict(storage.key(self.name), storage.modes(self.settings))
+            if self.conflate.enabled:
+                self.flush_task = asyncio.create_task(self.flush_loop())
+            if self.depth is not None and self.depth.interval > 0:
+                self.depth_task = asyncio.create_task(self.depth_loop())
+            if self.heartbeat:
+                self.heartbeat_task = asyncio.create_task(self.heartbeat_loop())
+        elif request['_signal_'] in ('CONNECTED', 'DISCONNECTED') and request.get('STANDBY'):
+            # 热备模式下另一个连接仍在线，不改变 status
+            await self.redis.publish(self.event_path, self.event(request['_signal_'], standby=True))
+            logger.info(f"{self.name} 热备连接 {request['_signal_']}")
         elif request['_signal_'] == 'CONNECTED':
-            await self.redis.publish(self.event_path, json.dumps({'op': 'CONNECTED'}))
-            await self.redis.setex(self.status_path, 1, 'CONNECTED')
+            self.first_data = False
+            # 还没有收到数据时心跳也要写接收队列的统计数据
+            self.server = request.get('_server_')
+            await self.redis.publish(self.event_path, self.event('CONNECTED'))
+            await self.redis.setex(self.status_path, self.status_ttl, 'CONNECTED')
             logger.info(f"{self.name} 已连接")
         elif request['_signal_'] == 'DISCONNECTED':
-            await self.redis.publish(self.event_path, json.dumps({'op': 'DISCONNECTED'}))
+            await self.redis.publish(self.event_path, self.event('DISCONNECTED'))
             await self.redis.set(self.status_path, 'DISCONNECTED')
             logger.info(f"{self.name} DISCONNECTED")
+        elif request['_signal_'] == 'RESUBSCRIBED':
+            await self.redis.publish(self.event_path, self.event('RESUBSCRIBED', **request['RESUBSCRIBED']))
         elif request['_signal_'] == 'EXIT':
-            await self.redis.publish(self.event_path, json.dumps({'op': 'EXIT'}))
+            await self.redis.publish(self.event_path, self.event('EXIT'))
             await self.redis.set(self.status_path, 'EXIT')
             logger.info(f"{self.name} 退出")
             await self.close()
         elif request['_signal_'] == 'ON_DATA':
-            # 用于指示收到数据
-            await self.redis.publish(self.event_path, json.dumps({'op': 'ON_DATA'}))
-            await self.redis.setex(self.status_path, 1, 'ON_DATA')
+            # 一条 ws 消息产生的所有写命令，一次发送到 redis
+            pipe = batch(self.redis, self.batch_mode)
+            scripts = []
+            # 收到数据由心跳定时发送，不用每条消息写一次
+            self.server = request.get('_server_')
+            self.received[request['DATA'].get('table') or request['DATA'].get('event') or ''] += 1
             logger.debug(request['DATA'])
+            if request.get('FAILOVER'):
+                self.record_failover(pipe, request['FAILOVER'])
+            # 原样转发收到的 json，没有时(如测试直接构造 DATA)才编码
+            raw = request.get('RAW')
+            if raw is None:
+                raw = self.codec.dumps(request['DATA'])
             if "table" in request['DATA']:
-                await self.redis.publish(f"okex/{self.name}/{request['DATA']['table']}", json.dumps(request['DATA']))
+                if not self.first_data:
+                    self.first_data = True
+                    pipe.publish(self.event_path, self.event('FIRST_DATA', table=request['DATA']['table']))
+                pipe.publish(f"okex/{self.name}/{request['DATA']['table']}", raw)
                 # save to redis
-                await execute({"data": request['DATA'], "redis": self.redis, "name": self.name},
-                              [normal['write'], candle['write']])
+                ctx = {"data": request['DATA'], "redis": self.redis, "pipe": pipe, "name": self.name,
+                       "settings": self.settings, "retention": self.retention, "codec": memoize(self.codec),
+                       "books": request.get('BOOKS', []), "depth_levels": self.depth_levels,
+                       "conflate": self.conflate if self.conflate.enabled else None,
+                       "candles": self.candles,
+                       "aggregator": self.aggregator if self.aggregator.enabled else None}
+                await execute(ctx, [catalog['write'], depth['write'], normal['write'], aggregate['write'], candle['write']])
+                scripts = ctx.get('scripts', [])
 
             elif "event" in request['DATA']:
-                await self.redis.publish(self.event_path, json.dumps(request['DATA']))
+                # 分片模式下带有 shard，用于判断每个连接是否都已登录
+                pipe.publish(self.event_path, raw if self.shard is None else
+                             self.codec.dumps({**request['DATA'], 'shard': self.shard}))
                 if request['DATA']['event'] == 'error':
                     logger.warning(f"{self.name} 收到错误信息：{request['DATA']}")
                 else:
                     logger.info(f"{self.name} ：{request['DATA']}")
             else:
                 logger.warning(f"{self.name} 收到未知数据：{request['DATA']}")
+            books = request.get('BOOKS', [])
+            try:
+                results = await pipe.execute(return_exceptions=True)
+            except BaseException:
+                # 连接出错或被取消，order book 放回下次再写
+                self.retry_books(books)
+                raise
+            # redis 重启后脚本会丢失，重新加载后再执行
+            await rerun_noscript(self.redis, scripts)
+            errors = [r for r in results if isinstance(r, Exception) and not is_noscript(r)]
+            if errors:
+                self.retry_books(books)
+                logger.error(f"{self.name} 写入 redis 出错：{errors}")
+
+    def event(self, op, **kwargs):
+        # okex/<name>/event 上的事件，分片模式下带有 shard
+        if self.shard is not None:
+            kwargs['shard'] = self.shard
+        return json.dumps({'op': op, **kwargs})
+
+    def record_failover(self, pipe, failover):
+        # 最近 100 次切换保存在 okex/<name>/failover 列表中，最新的在前
+        failover = {'time': time.time(), **failover}
+        logger.warning(f"{self.name} 切换到热备连接：{failover}")
+        pipe.publish(self.event_path, self.event('FAILOVER', **failover))
+        pipe.lpush(self.failover_path, json.dumps(failover))
+        pipe.ltrim(self.failover_path, 0, 99)
+
+    async def heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            try:
+                await self.beat()
+            except Exception:
+                logger.exception(f"{self.name} 发送心跳出错")
+
+    async def beat(self):
+        """更新 ws 接收队列及 ping 往返时间的统计数据，有数据时发送上次心跳后收到的消息数并更新 status
+
+        事件如 {"op": "ON_DATA", "count": 120, "total": 35000, "tables": {"spot/ticker": 100, "subscribe": 1, ...},
+               "rtt": 最近一次 ping 的往返时间(毫秒)}
+        没有收到数据时统计数据也要更新，这时正是需要查看队列及连接状态的时候
+        """
+        if self.redis is None:
+            return
+        rtt = getattr(self.server, 'rtt', None)
+        pipe = self.redis.pipeline()
+        if self.received:
+            count = sum(self.received.values())
+            self.total += count
+            last = None if rtt is None or rtt.last is None else round(rtt.last, 3)
+            pipe.publish(self.event_path, self.event('ON_DATA', count=count, total=self.total,
+                                                       tables=dict(self.received), rtt=last))
+            pipe.setex(self.status_path, self.status_ttl, 'ON_DATA')
+            self.received = Counter()
+        queue = getattr(self.server, 'queue', None)
+        if queue is not None:
+            pipe.hmset_dict(self.queue_path, queue.stats())
+        # 没有 pong 时 missed 增加，也要写入
+        if rtt is not None and (rtt.samples or rtt.missed):
+            pipe.hmset_dict(self.rtt_path, rtt.stats())
+        await pipe.execute()
+
+    async def flush_loop(self):
+        # 每隔 interval 秒，或待写入的条数达到 max_rows 时，写入合并的数据
+        while True:
+            try:
+                await asyncio.wait_for(self.conflate.full.wait(), self.conflate.interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception(f"{self.name} 写入合并数据出错")
+
+    async def flush(self):
+        if not self.conflate.pending or self.redis is None:
+            return
+        rows, stats = self.conflate.take()
+        pipe = batch(self.redis, self.batch_mode)
+        ctx = {"redis": self.redis, "pipe": pipe, "name": self.name,
+               "retention": self.retention, "codec": self.codec}
+        for table, data in rows:
+            write_row(ctx, table, data)
+        key = conflate_stats_key(self.name)
+        for field, n in stats.items():
+            pipe.hincrby(key, field, n)
+        try:
+            results = await pipe.execute(return_exceptions=True)
+        except BaseException:
+            # 连接出错或 close() 时被取消，放回数据下次再写
+            self.conflate.restore(rows, stats)
+            raise
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            logger.error(f"{self.name} 写入合并数据出错：{errors}")
+
+    async def depth_loop(self):
+        # 节流后没有新数据时，order book 到写入时间后写入
+        while True:
+            await asyncio.sleep(self.depth.wait())
+            try:
+                await self.write_books()
+            except Exception:
+                logger.exception(f"{self.name} 写入深度数据出错")
+
+    async def write_books(self):
+        if self.redis is None or not self.depth.dirty:
+            return
+        books = self.depth.due()
+        if not books:
+            return
+        pipe = batch(self.redis, self.batch_mode)
+        write_books({"pipe": pipe, "name": self.name, "codec": self.codec,
+                     "depth_levels": self.depth_levels}, books)
+        try:
+            results = await pipe.execute(return_exceptions=True)
+        except BaseException:
+            self.retry_books(books)
+            raise
+        errors = [r for r in results if isinstance(r, Exception)]
+        if errors:
+            self.retry_books(books)
+            logger.error(f"{self.name} 写入深度数据出错：{errors}")
+
+    def retry_books(self, books):
+        # 没有写入的 order book 放回 Depth，由定时任务再写
+        if books and self.depth is not None:
+            self.depth.retry(books)
 
     async def close(self):
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+        if self.depth_task is not None:
+            self.depth_task.cancel()
+            self.depth_task = None
+        if self.flush_task is not None:
+            # 等待取消的任务结束，正在写入的数据会放回，再一次写入
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+            self.flush_task = None
+            await self.flush()
         if self.redis is not None:
             self.redis.close()
             await self.redis.wait_closed()
@@ -0,0 +1,62 @@
+"""批量写 redis
+
+ws 每收到一条消息，所产生的所有 redis 写命令先收集起来，最后一次发送出去。
+    pipeline: 使用 redis pipeline，一次往返发送所有命令（缺省）
+    multi: 使用 MULTI/EXEC，一次往返，并且所有命令原子执行
+           (例外: redis 重启或 SCRIPT FLUSH 后 EVALSHA 返回 NOSCRIPT，失败的脚本在 EXEC 之后单独重新执行，
+           这一条消息的脚本写入与其它命令不再是原子的，见 script.py)
+    none: 逐条发送，每条命令一次往返，与旧版行为相同，用于对比测试
+
+注意：写函数中对 ctx['pipe'] 的命令调用不能 await，否则会一直阻塞，读数据请使用 ctx['redis']。
+"""
+import asyncio
+
+from aioredis.errors import PipelineError
+
+MODES = ('pipeline', 'multi', 'none')
+
+
+class Sequential:
+    # 记录命令，在 execute 时逐条发送，接口与 aioredis Pipeline 相同
+
+    def __init__(self, redis):
+        self._redis = redis
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._redis, name)
+
+        def _command(*args, **kwargs):
+            fut = asyncio.get_event_loop().create_future()
+            self._commands.append((fut, method, args, kwargs))
+            return fut
+
+        return _command
+
+    async def execute(self, *, return_exceptions=False):
+        results = []
+        errors = []
+        for fut, method, args, kwargs in self._commands:
+            try:
+                res = await method(*args, **kwargs)
+                fut.set_result(res)
+            except Exception as exc:
+                fut.set_exception(exc)
+                errors.append(exc)
+                res = exc
+            results.append(res)
+        self._commands = []
+        if errors and not return_exceptions:
+            raise PipelineError(errors)
+        return results
+
+
+def batch(redis, mode='pipeline'):
+    if mode == 'pipeline':
+        return redis.pipeline()
+    elif mode == 'multi':
+        return redis.multi_exec()
+    elif mode is None or mode == 'none':
+        return Sequential(redis)
+    else:
+        raise ValueError(f"REDIS_BATCH 只能是 {MODES} 之一: {mode}")
@@ -1,46 +1,115 @@
 # 处理 k 线数据的保存和取出
 import logging
-from datetime import datetime
-import json
+from datetime import datetime, timezone
+
+from . import index, packed
+from .retention import TRIM_FUNCTION, stats_key
+from .script import Script
 
 logger = logging.getLogger(__name__)
 
-MAXLENGTH = 1000
+# 保存一根 k 线，一次 EVALSHA 完成:
+#   seed 为 '1' 时(重启后第一次收到这个 instrument 的 k 线，本地还没有上一根 k 线)，
+#   如果是新的 timestamp，表示上一根 k 线已经确定，发布上一根 k 线；
+#   保存 k 线，按保留规则删除多余或过期的 k 线。
+# 之后的 k 线由 write 在本地判断是否收线，不需要读 redis。
+# KEYS: okex/<name>/<table>:<instrument_id>, okex/<name>/retention
+# ARGV: score, timestamp, table, max_row, min_score, check_expired, ttl, seed, field1, value1, ...
+UPSERT = Script(TRIM_FUNCTION + """
+local key = KEYS[1]
+local ts = ARGV[2]
+if ARGV[8] == '1' and not redis.call('ZSCORE', key, ts) then
+    local last = redis.call('ZRANGE', key, -1, -1)
+    if #last > 0 then
+        local fields = redis.call('HGETALL', key .. '/' .. last[1])
+        local candle = {}
+        for i = 1, #fields, 2 do
+            candle[fields[i]] = fields[i + 1]
+        end
+        redis.call('PUBLISH', key, cjson.encode({candle = candle, timestamp = last[1]}))
+    end
+end
+redis.call('ZADD', key, ARGV[1], ts)
+redis.call('HMSET', key .. '/' .. ts, unpack(ARGV, 9))
+if tonumber(ARGV[7]) > 0 then
+    redis.call('EXPIRE', key .. '/' .. ts, ARGV[7])
+end
+return trim(key, KEYS[2], ARGV[3], tonumber(ARGV[4]), ARGV[5], ARGV[6])
+""")
+
+
+FIELDS = ["timestamp", "open", "high", "low", "close", "volume", "currency_volume"]
+
+
+def score(timestamp):
+    # k 线时间 (UTC) 转换为秒，数字原样返回
+    if timestamp is None or isinstance(timestamp, (int, float)):
+        return timestamp
+    dt = datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S.%fZ')
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+def update(candles, key, candle):
+    """更新本地保存的当前 k 线
+
+    candles: {(table, instrument_id): 当前 k 线}
+    返回 (seed, closed):
+        seed 本地没有这个 instrument 的 k 线，需要由 redis 判断是否收线
+        closed 已经确定的上一根 k 线，没有时为 None
+    """
+    last = candles.get(key)
+    if last is None:
+        candles[key] = candle
+        return True, None
+    if candle['timestamp'] > last['timestamp']:
+        candles[key] = candle
+        return False, last
+    if candle['timestamp'] == last['timestamp']:
+        candles[key] = candle
+    # 旧的 k 线，只保存，不改变当前 k 线
+    return False, None
+
+
+def store(ctx, table, instrument_id, candle):
+    # 保存一根 k 线，收线时发布上一根 k 线
+    max_row, min_score, check_expired, ttl = ctx['retention'].args(table)
+    key = f"okex/{ctx['name']}/{table}:{instrument_id}"
+    # 没有本地状态时(如直接调用 write)，每次由 redis 判断
+    candles = ctx.get('candles')
+    seed, closed = (True, None) if candles is None else update(candles, (table, instrument_id), candle)
+    if closed is not None:
+        ctx['pipe'].publish(key, ctx['codec'].dumps({'candle': closed, 'timestamp': closed['timestamp']}))
+    if ctx.get('settings', {}).get('CANDLE_STORAGE') == 'packed':
+        packed.queue(ctx, key, stats_key(ctx['name']),
+                     [score(candle['timestamp']), packed.pack(candle), table, max_row, min_score, '1' if seed else '0'])
+        return
+    args = [score(candle['timestamp']), candle['timestamp'], table,
+            max_row, min_score, check_expired, ttl, '1' if seed else '0']
+    for k, v in candle.items():
+        args += [k, v]
+    UPSERT.queue(ctx, [key, stats_key(ctx['name'])], args)
 
 
 # 保存到 redis
 
 async def write(ctx):
+    # 每根 k 线一次 EVALSHA，放到 ctx['pipe'] 中由 Ws2redis 一次发送
     table = ctx['data']['table']
     if ('response' not in ctx) and (table.find("candle") > 0):
         for d in ctx['data']['data']:
             # logger.info(d)
-            candle = dict(zip(["timestamp", "open", "high", "low",
-                               "close", "volume", "currency_volume"], d['candle']))
-            key = f"okex/{ctx['name']}/{table}:{d['instrument_id']}"
-            dt = datetime.strptime(
-                candle['timestamp'], '%Y-%m-%dT%H:%M:%S.%fZ')
-            # await ctx['redis'].delete(key)
-            ret = await ctx['redis'].zrank(key, candle['timestamp'])
-            # logger.info(f"{candle['timestamp']}: {ret}")
-            if ret is None:
-                # 开始新的  timestamp 数据，表示上个 `timestamp` 的 K 线已经确定，可以使用。
-                l = await ctx['redis'].zcard(key)
-                if l > 0:
-                    ts = await ctx['redis'].zrange(key, l-1, l-1, encoding='utf-8')
-                    last_candle = await ctx['redis'].hgetall(f"{key}/{ts[0]}", encoding='utf-8')
-                    # logger.info(f"last candle={last_candle}")
-                    await ctx['redis'].publish(key, json.dumps({'candle': last_candle, 'timestamp': ts[0]}))
-
-            await ctx['redis'].zadd(key, dt.timestamp(), candle['timestamp'])
-            l = await ctx['redis'].zcard(key)
-            if l > MAXLENGTH:
-                await ctx['redis'].zremrangebyrank('key', 0, l - MAXLENGTH)
-            await ctx['redis'].hmset_dict(f"{key}/{candle['timestamp']}", candle)
+            store(ctx, table, d['instrument_id'], dict(zip(FIELDS, d['candle'])))
         # 标记已处理
         ctx['response'] = True
 
 
+async def fetch(ctx, key, start=None, end=None):
+    # 按 CANDLE_STORAGE 取 k 线，n, fields, format 参数在 ctx 中
+    if ctx.get('settings', {}).get('CANDLE_STORAGE') == 'packed':
+        return await packed.read(ctx, key, start, end)
+    return await index.read(ctx, key, start, end, FIELDS)
+
+
 # 从 redis 取数据
 async def read(ctx):
     """取 k 线数据
@@ -48,7 +117,10 @@ async def read(ctx):
         ctx:
             channel: okex 频道名, 如 'swap/candle60s'
             {'instrument_id': 'BTC-USD-SWAP','n':100} n 可选参数，取最新的 n 条 k 线数据
-    返回：最新的 n 条 k 线数据列表。
+            start, end 可选参数，取这段时间内的 k 线，可以是 '2020-11-12T13:20:00.000Z' 或秒数
+            fields 可选参数，只取这些字段，如 ['timestamp', 'close']
+            format 可选参数，'numpy' 或 'pandas' 时按列返回，timestamp 为 int64 毫秒，其它字段为 float64
+    返回：最新的 n 条 k 线数据列表，一次 redis 请求完成。
         subscribe 'okex/name/swap/candle60s' 可以在有新 k 线时得到通知，通知内容为最新 k 线的 timestamp,表示这个 timestamp 之前的 k 线已经确定，可以使用。
 
     ```
@@ -66,24 +138,13 @@ async def read(ctx):
     ```
 
     例：`get('pub', 'swap/candle60s', {'instrument_id': 'BTC-USD-SWAP','n':100})`
+       `get('pub', 'swap/candle60s', {'instrument_id': 'BTC-USD-SWAP', 'start': '2020-11-12T00:00:00.000Z', 'fields': ['timestamp', 'close']})`
     """
     if ('response' not in ctx) and ctx['path'].find("candle") > 0:
         if 'instrument_id' not in ctx:
             raise Exception(" params 参数中没有 instrument_id")
         real_path = f"okex/{ctx['name']}/{ctx['path']}:{ctx['instrument_id']}"
-        index = 0
-        if 'n' in ctx:
-            l = await ctx['redis'].zcard(real_path)
-            if ctx['n'] < l:
-                index = l - ctx['n']
-
-        timestamps = await ctx['redis'].zrange(real_path, index, encoding='utf-8')
-        candles = []
-        for timestamp in timestamps:
-            candle = await ctx['redis'].hgetall(f"{real_path}/{timestamp}", encoding='utf-8')
-            candles.append(candle)
-        # logger.info(candles)
-        ctx['response'] = candles
+        ctx['response'] = await fetch(ctx, real_path, score(ctx.get('start')), score(ctx.get('end')))
 
 
 config = {
@@ -0,0 +1,139 @@
+"""数据目录
+
+每收到一条频道数据，记录有哪些频道及每个频道有哪些 instrument，score 为最后更新时间(秒)，
+客户端不需要使用 KEYS 就可以知道 okws 保存了哪些数据:
+    okex/<name>/catalog                        有序集合，member 为频道名，如 spot/ticker
+    okex/<name>/catalog/<table>/instruments    有序集合，member 为 instrument_id (account 为 currency)
+    okex/<name>/catalog/<table>/exchange       有序集合，score 为数据中交易所的 timestamp(秒)，没有 timestamp 的频道(如 k 线)不记录
+
+Client.catalog(name, since) 一次请求取出整个目录，since 为秒数时只返回最近 since 秒内有更新的。
+Client.staleness(name, table, instruments) 一次请求取出多个 instrument 距离最后一次收到数据及交易所 timestamp 的时间(秒)。
+settings 中 CATALOG: false 时不记录。
+"""
+import time
+from collections.abc import Mapping
+
+from .candle import score
+from .script import Script
+
+# KEYS[1]: okex/<name>/catalog
+# ARGV[1]: 最早的更新时间，'-inf' 为全部
+# 返回: {table1, score1, {instrument1, score1, ...}, table2, ...}
+READ = Script("""
+local tables = redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[1], '+inf', 'WITHSCORES')
+local result = {}
+for i = 1, #tables, 2 do
+    result[#result + 1] = tables[i]
+    result[#result + 1] = tables[i + 1]
+    result[#result + 1] = redis.call('ZRANGEBYSCORE', KEYS[1] .. '/' .. tables[i] .. '/instruments',
+        ARGV[1], '+inf', 'WITHSCORES')
+end
+return result
+""")
+
+
+# KEYS: okex/<name>/catalog/<table>/instruments, okex/<name>/catalog/<table>/exchange
+# ARGV: instrument_id1, instrument_id2, ...
+# 返回: {{收到时间, 交易所时间}, ...}，没有数据时为 nil
+STALENESS = Script("""
+local result = {}
+for i, id in ipairs(ARGV) do
+    result[i] = {redis.call('ZSCORE', KEYS[1], id) or false, redis.call('ZSCORE', KEYS[2], id) or false}
+end
+return result
+""")
+
+
+def tables_key(name):
+    return f"okex/{name}/catalog"
+
+
+def instruments_key(name, table):
+    return f"{tables_key(name)}/{table}/instruments"
+
+
+def exchange_key(name, table):
+    return f"{tables_key(name)}/{table}/exchange"
+
+
+def _str(v):
+    return v.decode('utf-8') if isinstance(v, bytes) else v
+
+
+def args(name, since=None):
+    # READ 的 keys, args
+    return [tables_key(name)], ['-inf' if since is None else time.time() - since]
+
+
+def parse(result):
+    """READ 的返回值转换为 {table: {'updated': 秒, 'instruments': {instrument_id: 秒}}}"""
+    catalog = {}
+    for i in range(0, len(result), 3):
+        instruments = result[i + 2]
+        catalog[_str(result[i])] = {
+            'updated': float(result[i + 1]),
+            'instruments': {_str(instruments[j]): float(instruments[j + 1]) for j in range(0, len(instruments), 2)}
+        }
+    return catalog
+
+
+def staleness_args(name, table, instruments):
+    # STALENESS 的 keys, args
+    return [instruments_key(name, table), exchange_key(name, table)], list(instruments)
+
+
+def ages(instruments, result, now=None):
+    """STALENESS 的返回值转换为 {instrument_id: {'received': 秒, 'exchange': 秒}}，没有数据时为 None"""
+    now = time.time() if now is None else now
+    return {uid: {'received': None if received is None else now - float(received),
+                  'exchange': None if exchange is None else now - float(exchange)}
+            for uid, (received, exchange) in zip(instruments, result)}
+
+
+async def write(ctx):
+    # 放在其它 writer 前面，不标记 response
+    if not ctx['settings'].get('CATALOG', True):
+        return
+    table = ctx['data']['table']
+    now = time.time()
+    pipe = ctx['pipe']
+    pipe.zadd(tables_key(ctx['name']), now, table)
+    ids = set()
+    # 每个 instrument 最新的交易所 timestamp
+    latest = {}
+    for data in ctx['data']['data']:
+        if isinstance(data, Mapping):
+            uid = data.get('instrument_id') or data.get('currency')
+            if uid is not None:
+                ids.add(uid)
+                ts = data.get('timestamp')
+                if isinstance(ts, str) and ts > latest.get(uid, ''):
+                    latest[uid] = ts
+    if ids:
+        pairs = []
+        for uid in ids:
+            pairs += [now, uid]
+        pipe.zadd(instruments_key(ctx['name'], table), *pairs)
+    if latest:
+        pairs = []
+        for uid, ts in latest.items():
+            try:
+                pairs += [score(ts), uid]
+            except ValueError:
+                pass
+        if pairs:
+            pipe.zadd(exchange_key(ctx['name'], table), *pairs)
+
+
+async def read(redis, name, since=None):
+    return parse(await READ(redis, *args(name, since)))
+
+
+async def staleness(redis, name, table, instruments):
+    instruments = list(instruments)
+    return ages(instruments, await STALENESS(redis, *staleness_args(name, table, instruments)))
+
+
+config = {
+    "write": {'enter': write},
+}
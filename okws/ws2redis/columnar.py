@@ -0,0 +1,77 @@
+"""按列返回数据 (get 的参数 format='numpy' 或 'pandas')
+
+需要安装 numpy (format='pandas' 还需要 pandas)。
+每个字段一个数组，所有行的同一字段一次转换：
+    时间字段 (timestamp 等) 转换为 int64 毫秒
+    id 字段 (trade_id 等) 转换为 int64
+    时间、id 字段有空值时为 float64，空值为 nan
+    其它字段能转换为数字的为 float64 (空值为 nan)，否则为字符串
+"""
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+FORMATS = ('numpy', 'pandas')
+
+TIME_FIELDS = {'timestamp', 'created_at', 'last_fill_time'}
+ID_FIELDS = {'trade_id', 'order_id', 'algo_id'}
+
+
+def _column(name, values):
+    col = np.array([b'' if v is None else v for v in values], dtype=np.bytes_)
+    if name in TIME_FIELDS or name in ID_FIELDS:
+        empty = col == b''
+        if name in TIME_FIELDS:
+            # '2020-11-12T13:20:00.000Z'，numpy 不能解析时区
+            ints = np.char.rstrip(col, b'Z').astype(np.str_).astype('datetime64[ms]').astype(np.int64)
+        else:
+            ints = np.where(empty, b'0', col).astype(np.int64)
+        if empty.any():
+            return np.where(empty, np.nan, ints)
+        return ints
+    try:
+        return np.where(col == b'', b'nan', col).astype(np.float64)
+    except ValueError:
+        return np.char.decode(col, 'utf-8')
+
+
+def frame(fields, rows, format='numpy'):
+    """rows: 每行为按 fields 顺序的值 (bytes 或 str)
+
+    返回 {field: ndarray} 或 pandas.DataFrame
+    """
+    if format not in FORMATS:
+        raise ValueError(f"format 只能是 {FORMATS} 之一: {format}")
+    if np is None:
+        raise ImportError("format='numpy' 需要安装 numpy")
+    if format == 'pandas' and pd is None:
+        raise ImportError("format='pandas' 需要安装 pandas")
+
+    # 转置为按列
+    values = list(zip(*rows)) if rows else [() for _ in fields]
+    data = {name: _column(name, col) for name, col in zip(fields, values)}
+    if format == 'pandas':
+        return pd.DataFrame(data, columns=list(fields))
+    return data
+
+
+def hash_rows(rows):
+    """HGETALL 的结果 [k1, v1, k2, v2, ...] 转换为 (fields, rows)，字段以第一行为准"""
+    rows = [row for row in rows if row]
+    if not rows:
+        return [], []
+    fields = rows[0][::2]
+    values = []
+    for row in rows:
+        if row[::2] == fields:
+            values.append(row[1::2])
+        else:
+            data = dict(zip(row[::2], row[1::2]))
+            values.append([data.get(f) for f in fields])
+    return [f.decode('utf-8') if isinstance(f, bytes) else f for f in fields], values
@@ -0,0 +1,80 @@
+"""合并高频数据
+
+ticker、mark_price 等频道，下游只需要每个 instrument 的最新数据。匹配的频道在内存中
+只保留每个 <table>:<instrument_id> 最新的一条，每隔 interval 秒，或者待写入的条数
+达到 max_rows 时，由 Ws2redis 一次写入 redis。
+频道的整条消息(okex/<name>/<table>)仍然实时发布，只合并每个 instrument 的 hash 写入和发布。
+
+配置(settings):
+    CONFLATE:
+      tables: 按频道名匹配(fnmatch)，如 ["*/ticker", "*/mark_price"]，空表示不合并
+      interval: 写入间隔(秒)
+      max_rows: 待写入的条数达到 max_rows 时立即写入
+
+合并的统计数据累计在 okex/<name>/conflate 中:
+    received: 收到的条数, written: 写入的条数, coalesced: 被新数据替换而没有写入的条数
+"""
+import asyncio
+import fnmatch
+
+
+class Conflate:
+    def __init__(self, settings=None):
+        settings = (settings or {}).get('CONFLATE') or {}
+        self.tables = settings.get('tables') or []
+        self.interval = settings.get('interval', 0.1)
+        self.max_rows = settings.get('max_rows', 1000)
+        # (table, instrument_id) -> 最新数据
+        self.pending = {}
+        # 待写入的条数达到 max_rows
+        self.full = asyncio.Event()
+        self.received = 0
+        self.coalesced = 0
+        self._cache = {}
+
+    @property
+    def enabled(self):
+        return bool(self.tables)
+
+    def match(self, table):
+        if table not in self._cache:
+            self._cache[table] = any(fnmatch.fnmatchcase(table, pattern) for pattern in self.tables)
+        return self._cache[table]
+
+    def add(self, table, data):
+        key = (table, data['instrument_id'])
+        if key in self.pending:
+            self.coalesced += 1
+        self.pending[key] = data
+        self.received += 1
+        if len(self.pending) >= self.max_rows:
+            self.full.set()
+
+    def take(self):
+        """取出待写入的数据及统计数据，返回 ([(table, data), ...], stats)"""
+        rows = [(table, data) for (table, _), data in self.pending.items()]
+        stats = {'received': self.received, 'written': len(rows), 'coalesced': self.coalesced}
+        self.pending = {}
+        self.received = 0
+        self.coalesced = 0
+        self.full.clear()
+        return rows, stats
+
+    def restore(self, rows, stats):
+        """写入失败或被取消时放回 take() 取出的数据，已有更新数据的不放回"""
+        pending = {}
+        for table, data in rows:
+            key = (table, data['instrument_id'])
+            if key in self.pending:
+                self.coalesced += 1
+            else:
+                pending[key] = data
+        self.pending = {**pending, **self.pending}
+        self.received += stats['received']
+        self.coalesced += stats['coalesced']
+        if len(self.pending) >= self.max_rows:
+            self.full.set()
+
+
+def stats_key(name):
+    return f"okex/{name}/conflate"
@@ -0,0 +1,69 @@
+"""热备连接的去重及切换记录
+
+热备模式(见 okws/failover.py)下两个连接订阅相同的频道，数据经过同一个处理链，
+先到的消息正常处理，另一个连接上相同的消息(按解压后的 json 比较)标记为 DUPLICATE，后面的拦截器不再处理。
+
+最近一直由一个连接(leader)先收到新数据，当 leader 断开，或 leader 超过 silence 秒没有数据而另一个连接在这期间
+收到过数据(包括重复的消息，都没有数据时不算)，另一个连接收到新数据时切换，切换信息放在 request['FAILOVER'] 中，由 Ws2redis 记录:
+    {"reason": "disconnected" 或 "silence", "gap": 旧连接最后一条数据到新连接第一条新数据的时间(秒)}
+没有去掉的消息 request['LEADER'] 为是否来自 leader，Depth 据此忽略另一个连接重连后的 partial 数据。
+"""
+import time
+from collections import deque
+
+from ..interceptor import Interceptor
+
+
+class Dedup(Interceptor):
+    def __init__(self, settings=None):
+        super().__init__('Dedup')
+        settings = (settings or {}).get('STANDBY') or {}
+        # 记录最近 window 条消息
+        self.window = settings.get('window', 10000)
+        self.silence = settings.get('silence', 5)
+        self.seen = set()
+        self.order = deque()
+        self.leader = None
+        # 连接 -> 最后收到数据的时间
+        self.last_seen = {}
+        # 已断开的连接
+        self.down = set()
+        self.duplicates = 0
+
+    def remember(self, key):
+        self.seen.add(key)
+        self.order.append(key)
+        if len(self.order) > self.window:
+            self.seen.discard(self.order.popleft())
+
+    async def enter(self, request):
+        server = request.get('_server_')
+        if request['_signal_'] == 'DISCONNECTED':
+            self.down.add(server)
+        elif request['_signal_'] == 'CONNECTED':
+            self.down.discard(server)
+        elif request['_signal_'] == 'ON_DATA' and request.get('RAW') is not None:
+            now = time.time()
+            previous = self.last_seen.get(server, 0)
+            self.last_seen[server] = now
+            key = hash(request['RAW'])
+            if key in self.seen:
+                self.duplicates += 1
+                request['_signal_'] = 'DUPLICATE'
+                return
+            self.remember(key)
+            if self.leader is None:
+                self.leader = server
+            elif server is not self.leader:
+                last = self.last_seen.get(self.leader, 0)
+                if self.leader in self.down:
+                    reason = 'disconnected'
+                elif now - last >= self.silence and previous > last:
+                    # leader 最后一条数据后，这个连接还收到过 leader 没有收到的数据
+                    reason = 'silence'
+                else:
+                    reason = None
+                if reason is not None:
+                    request['FAILOVER'] = {'reason': reason, 'gap': round(now - last, 6)}
+                    self.leader = server
+            request['LEADER'] = server is self.leader
@@ -0,0 +1,247 @@
+"""深度数据 (spot/depth, futures/depth, swap/depth, */depth_l2_tbt, */depth5)
+
+ws 发来的是 partial (全量) 和 update (增量) 数据，需要在本地合并成完整的 order book，
+合并后用 checksum 校验，校验失败时重新订阅该频道。
+
+合并后的 order book 按 DEPTH 设置的频率写到 redis 的 okex/<name>/<table>:<instrument_id> 中 (hash)，
+并发布到同名频道，没有新数据时由 Ws2redis 的定时任务写入节流后还没写的 order book:
+    best_bid, best_bid_size, best_ask, best_ask_size, mid, spread, timestamp, checksum
+    bids, asks: 前 levels 档，json 格式，如 [["8.8", "96.99", "1"], ...]
+
+设置:
+    DEPTH:
+      levels: 20     # 保存的档数
+      interval: 0.1  # 每个 order book 最短写入间隔(秒)
+"""
+import bisect
+import json
+import logging
+import time
+import zlib
+
+from ..interceptor import Interceptor
+from ..okex import subscribe, unsubscribe
+
+logger = logging.getLogger(__name__)
+
+TABLES = ('/depth', '/depth_l2_tbt', '/depth5')
+
+
+def is_depth(table):
+    return table.endswith(TABLES)
+
+
+def checksum(bids, asks):
+    # 前 25 档 bid 和 ask 交替拼接 price:size，crc32 转换为有符号 32 位整数
+    parts = []
+    for i in range(25):
+        if i < len(bids):
+            parts += bids[i][:2]
+        if i < len(asks):
+            parts += asks[i][:2]
+    crc = zlib.crc32(':'.join(parts).encode('utf-8'))
+    return crc - (1 << 32) if crc >= (1 << 31) else crc
+
+
+class Side:
+    # 一边的深度，按价格排序，bids 从高到低，asks 从低到高
+
+    def __init__(self, descending):
+        self.sign = -1 if descending else 1
+        self.keys = []
+        self.levels = {}
+
+    def clear(self):
+        self.keys = []
+        self.levels = {}
+
+    def update(self, levels):
+        for level in levels:
+            key = self.sign * float(level[0])
+            if float(level[1]) == 0:
+                if self.levels.pop(key, None) is not None:
+                    del self.keys[bisect.bisect_left(self.keys, key)]
+            else:
+                if key not in self.levels:
+                    bisect.insort(self.keys, key)
+                self.levels[key] = level
+
+    def top(self, n):
+        return [self.levels[key] for key in self.keys[:n]]
+
+
+class OrderBook:
+    def __init__(self, table, instrument_id):
+        self.table = table
+        self.instrument_id = instrument_id
+        self.bids = Side(descending=True)
+        self.asks = Side(descending=False)
+        self.timestamp = None
+        self.checksum = None
+        # 最近一次写到 redis 的时间
+        self.written = 0
+
+    def apply(self, data, action='partial'):
+        """合并数据，返回 checksum 是否正确"""
+        if action == 'partial':
+            self.bids.clear()
+            self.asks.clear()
+        self.bids.update(data.get('bids', []))
+        self.asks.update(data.get('asks', []))
+        self.timestamp = data.get('timestamp')
+        self.checksum = data.get('checksum')
+        if self.checksum is None:
+            return True
+        return checksum(self.bids.top(25), self.asks.top(25)) == self.checksum
+
+    def snapshot(self, levels=20):
+        # 没有数据的字段为 ''，这样写入 redis 时会覆盖旧的值
+        bids = self.bids.top(levels)
+        asks = self.asks.top(levels)
+        data = {
+            'instrument_id': self.instrument_id,
+            'timestamp': self.timestamp or '',
+            'checksum': '' if self.checksum is None else self.checksum,
+            'bids': json.dumps(bids),
+            'asks': json.dumps(asks),
+            'best_bid': bids[0][0] if bids else '',
+            'best_bid_size': bids[0][1] if bids else '',
+            'best_ask': asks[0][0] if asks else '',
+            'best_ask_size': asks[0][1] if asks else '',
+            'mid': '',
+            'spread': '',
+        }
+        if bids and asks:
+            best_bid, best_ask = float(bids[0][0]), float(asks[0][0])
+            data.update(mid=(best_bid + best_ask) / 2, spread=best_ask - best_bid)
+        return data
+
+
+class Depth(Interceptor):
+    """在本地合并深度数据
+
+    合并后需要写到 redis 的 order book 放在 request['BOOKS'] 中，由 Ws2redis 写入，写入失败时用 retry 放回
+    热备模式下已有 order book 时忽略不是 leader 的连接的 partial 数据(见 dedup.py)
+    """
+
+    def __init__(self, settings=None):
+        super().__init__('Depth')
+        settings = (settings or {}).get('DEPTH') or {}
+        self.levels = settings.get('levels', 20)
+        self.interval = settings.get('interval', 0.1)
+        self.books = {}
+        # 有更新还没写到 redis 的 order book
+        self.dirty = set()
+
+    async def enter(self, request):
+        if request['_signal_'] in ('CONNECTED', 'DISCONNECTED') and not request.get('STANDBY'):
+            # 重新订阅后会收到 partial 数据，热备模式下另一个连接仍在线时不清除
+            self.books = {}
+            self.dirty = set()
+        elif request['_signal_'] == 'ON_DATA':
+            table = request['DATA'].get('table')
+            if table is None:
+                # 只有频道数据由 Ws2redis 写入 BOOKS
+                return
+            if is_depth(table):
+                action = request['DATA'].get('action', 'partial')
+                for data in request['DATA'].get('data', []):
+                    self.apply(request, table, data, action)
+            request['BOOKS'] = self.due()
+
+    def apply(self, request, table, data, action):
+        key = (table, data['instrument_id'])
+        book = self.books.get(key)
+        if book is None:
+            if action != 'partial':
+                # 还没有收到 partial 数据
+                return
+            book = self.books[key] = OrderBook(table, data['instrument_id'])
+        elif request['DATA'].get('action') == 'partial' and request.get('LEADER') is False:
+            # 热备模式下另一个连接重连后的 partial，leader 的增量数据是接着已有的 order book 的，不能替换
+            logger.debug(f"{table}:{data['instrument_id']} 忽略热备连接的 partial 数据")
+            return
+        if book.apply(data, action):
+            self.dirty.add(key)
+        else:
+            channel = f"{table}:{data['instrument_id']}"
+            logger.warning(f"{channel} checksum 校验失败，重新订阅")
+            del self.books[key]
+            self.dirty.discard(key)
+            unsubscribe(request, channel)
+            subscribe(request, channel)
+
+    def due(self):
+        # 到了写入时间的 order book
+        now = time.time()
+        books = []
+        for key in list(self.dirty):
+            book = self.books[key]
+            if now - book.written >= self.interval:
+                book.written = now
+                books.append(book)
+                self.dirty.discard(key)
+        return books
+
+    def retry(self, books):
+        """写入失败或被取消时放回 due() 取出的 order book，interval 秒后再写；已重新订阅的不放回"""
+        for book in books:
+            key = (book.table, book.instrument_id)
+            if self.books.get(key) is book:
+                self.dirty.add(key)
+
+    def wait(self):
+        # 距离下一个 order book 到写入时间的秒数，最多 interval 秒
+        if not self.dirty:
+            return self.interval
+        written = min(self.books[key].written for key in self.dirty)
+        return min(self.interval, max(0.001, written + self.interval - time.time()))
+
+
+def write_books(ctx, books):
+    for book in books:
+        key = f"okex/{ctx['name']}/{book.table}:{book.instrument_id}"
+        snapshot = book.snapshot(ctx['depth_levels'])
+        ctx['pipe'].hmset_dict(key, snapshot)
+        ctx['pipe'].publish(key, ctx['codec'].dumps(snapshot))
+
+
+# 保存到 redis
+async def write(ctx):
+    if 'response' not in ctx:
+        write_books(ctx, ctx.get('books', []))
+        if is_depth(ctx['data']['table']):
+            # 标记已处理
+            ctx['response'] = True
+
+
+# 从 redis 取数据
+async def read(ctx):
+    """取合并后的深度数据
+
+    例：`get('pub', 'spot/depth', {'instrument_id': 'BTC-USDT'})`
+        levels 可选参数，只取前 levels 档
+        fields 可选参数，只取这些字段，如 ['best_bid', 'best_ask', 'mid', 'spread']
+    """
+    if ('response' not in ctx) and is_depth(ctx['path']):
+        if 'instrument_id' not in ctx:
+            raise ValueError(f"需要参数 instrument_id！ ")
+        key = f"okex/{ctx['name']}/{ctx['path']}:{ctx['instrument_id']}"
+        fields = ctx.get('fields')
+        if fields:
+            values = await ctx['redis'].hmget(key, *fields, encoding='utf-8')
+            data = dict(zip(fields, values))
+        else:
+            data = await ctx['redis'].hgetall(key, encoding='utf-8')
+        for side in ('bids', 'asks'):
+            if data.get(side) is not None:
+                data[side] = json.loads(data[side])
+                if 'levels' in ctx:
+                    data[side] = data[side][:ctx['levels']]
+        ctx['response'] = data
+
+
+config = {
+    "write": {'enter': write},
+    "read": {'enter': read}
+}
@@ -0,0 +1,88 @@
+"""有索引数据的读取
+
+k 线 (okex/<name>/<table>:<instrument_id>) 及 uni_id 表 (okex/<name>/<table>) 使用有序集合做索引，
+每个索引项对应一个 hash (<index>/<id>)，使用一个 lua 脚本一次取出所需的数据。
+
+ctx 参数:
+    n: 最多取最新的 n 条
+    start, end: 按 score 取数据，k 线为时间(秒)，uni_id 表为 id
+    fields: 只取这些字段，如 ['timestamp', 'close']
+    format: 'numpy' 或 'pandas' 时按列返回，见 columnar.py
+"""
+from . import columnar
+from .script import Script
+
+# KEYS[1]: 索引
+# ARGV: start, end, n, field1, field2, ...
+# 返回: {ids, rows}，没有指定字段时 row 为 HGETALL 的结果，否则为 HMGET 的结果
+RANGE = Script("""
+local key = KEYS[1]
+local n = tonumber(ARGV[3])
+local ids
+if ARGV[1] ~= '' or ARGV[2] ~= '' then
+    local min = ARGV[1] ~= '' and ARGV[1] or '-inf'
+    local max = ARGV[2] ~= '' and ARGV[2] or '+inf'
+    if n > 0 then
+        local rev = redis.call('ZREVRANGEBYSCORE', key, max, min, 'LIMIT', 0, n)
+        ids = {}
+        for i = #rev, 1, -1 do
+            ids[#ids + 1] = rev[i]
+        end
+    else
+        ids = redis.call('ZRANGEBYSCORE', key, min, max)
+    end
+elseif n > 0 then
+    ids = redis.call('ZRANGE', key, -n, -1)
+else
+    ids = redis.call('ZRANGE', key, 0, -1)
+end
+local rows = {}
+for i, id in ipairs(ids) do
+    if #ARGV > 3 then
+        rows[i] = redis.call('HMGET', key .. '/' .. id, unpack(ARGV, 4))
+    else
+        rows[i] = redis.call('HGETALL', key .. '/' .. id)
+    end
+end
+return {ids, rows}
+""")
+
+
+def _str(v):
+    return v.decode('utf-8') if isinstance(v, bytes) else v
+
+
+async def fetch(redis, key, start=None, end=None, n=None, fields=None, decode=True):
+    """返回 (ids, rows)，rows 中每一项为 fields 对应的值列表，没有 fields 时为 HGETALL 的 key, value 交替列表"""
+    args = ['' if start is None else start, '' if end is None else end, n or 0, *(fields or [])]
+    ids, rows = await RANGE(redis, [key], args)
+    if decode:
+        return [_str(i) for i in ids], [[_str(v) for v in row] for row in rows]
+    return ids, rows
+
+
+async def read(ctx, key, start=None, end=None, default_fields=None):
+    # 返回字典列表，按 score 先后排序，已过期的数据不返回
+    fields = ctx.get('fields')
+    if ctx.get('format') is not None:
+        return await read_columns(ctx, key, start, end, fields or default_fields)
+
+    _ids, rows = await fetch(ctx['redis'], key, start, end, ctx.get('n'), fields)
+    datas = []
+    for row in rows:
+        if fields:
+            if any(v is not None for v in row):
+                datas.append(dict(zip(fields, row)))
+        elif row:
+            datas.append(dict(zip(row[::2], row[1::2])))
+    return datas
+
+
+async def read_columns(ctx, key, start=None, end=None, fields=None):
+    # 按列返回，不生成每行的字典
+    _ids, rows = await fetch(ctx['redis'], key, start, end, ctx.get('n'), fields, decode=False)
+    if fields:
+        rows = [row for row in rows if any(v is not None for v in row)]
+    else:
+        fields, rows = columnar.hash_rows(rows)
+    return columnar.frame(fields, rows, ctx['format'])
@@ -2,18 +2,10 @@
 
 
 import logging
-import json
-
-logger = logging.getLogger(__name__)
-
-MAXLENGTH = 1000
 
+from . import index, stream
 
-async def redis_clear(redis, path="okex/*"):
-    # 清除 redis 服务器中的相关数据
-    keys = await redis.keys(path)
-    for key in keys:
-        await redis.delete(key)
+logger = logging.getLogger(__name__)
 
 
 def endswith(s, ends):
@@ -31,76 +23,104 @@ uni_id = {
 
 
 async def write(ctx):
+    # 写命令放到 ctx['pipe'] 中，由 Ws2redis 一次发送，不能 await
     if 'response' not in ctx:
         table = ctx['data']['table']
+        pipe = ctx['pipe']
         logger.debug(f"receive from ws: {table}")
 
-        # 对于数组，使用各个 id 排序，最多保存 MAXLENGTH 项
+        # 对于数组，使用各个 id 排序，按保留规则删除多余或过期的项
         end = endswith(table, uni_id.keys())
         if end is not None:
             # 使用数组 要有一个唯一数做为 key
             uid = uni_id[end]
             key = f"okex/{ctx['name']}/{table}"
+            if ctx['settings'].get('UNI_ID_STORAGE', 'zset') == 'stream':
+                stream.write(ctx, key, table)
+                ctx['response'] = True
+                return
+            _max_row, _min_score, _check_expired, ttl = ctx['retention'].args(table, by_time=False)
             for data in ctx['data']['data']:
-                await ctx['redis'].zadd(key, data[uid], data[uid])
-                len = await ctx['redis'].zcard(key)
-                if len > MAXLENGTH:
-                    await ctx['redis'].zremrangebyrank('key', 0, len - MAXLENGTH)
-                await ctx['redis'].hmset_dict(f"{key}/{data[uid]}", data)
+                pipe.zadd(key, int(data[uid]), data[uid])
+                pipe.hmset_dict(f"{key}/{data[uid]}", data)
+                if ttl:
+                    pipe.expire(f"{key}/{data[uid]}", ttl)
+            ctx['retention'].trim(ctx, key, table)
             ctx['response'] = True
 
         elif table == 'spot/account':
             # currency 唯一
             for data in ctx['data']['data']:
                 key = f"okex/{ctx['name']}/{table}:{data['currency']}"
-                await ctx['redis'].hmset_dict(key, data)
-                await ctx['redis'].publish(key, json.dumps(data))
+                pipe.hmset_dict(key, data)
+                pipe.publish(key, ctx['codec'].dumps(data))
             ctx['response'] = True
         elif table == 'futures/account':
             for data in ctx['data']['data']:
                 for k, v in data.items():
                     key = f"okex/{ctx['name']}/{table}:{k}"
-                    await ctx['redis'].hmset_dict(key, v)
-                    await ctx['redis'].publish(key, json.dumps(v))
+                    pipe.hmset_dict(key, v)
+                    pipe.publish(key, ctx['codec'].dumps(v))
             ctx['response'] = True
         elif table == 'futures/instruments':
             key = f"okex/{ctx['name']}/{table}"
-            # 先删除原有数据
-            await redis_clear(ctx['redis'], key + '*')
+            # 在临时 key 中重建集合，再 RENAME 替换，读取时不会看到空的集合
+            old = await ctx['redis'].smembers(key, encoding='utf-8')
+            tmp = f"{key}:rebuild"
+            ids = [data['instrument_id'] for data in ctx['data']['data'][0]]
+            pipe.delete(tmp)
             for data in ctx['data']['data'][0]:
-                await ctx['redis'].sadd(key, data['instrument_id'])
-                await ctx['redis'].hmset_dict(f"{key}:{data['instrument_id']}", data)
+                pipe.hmset_dict(f"{key}:{data['instrument_id']}", data)
+            if ids:
+                pipe.sadd(tmp, *ids)
+                pipe.rename(tmp, key)
+            else:
+                pipe.delete(key)
+            # 已下线的合约
+            stale = set(old) - set(ids)
+            if stale:
+                pipe.unlink(*[f"{key}:{uid}" for uid in stale])
             ctx['response'] = True
         else:
-
+            conflate = ctx.get('conflate')
+            if conflate is not None and not conflate.match(table):
+                conflate = None
             for data in ctx['data']['data']:
                 # 对所有一个 instrument_id 只有一条数据的有效，如果是有多条数据，需要在前面处理
                 if 'instrument_id' in data:
-                    key = f"okex/{ctx['name']}/{table}:{data['instrument_id']}"
-                    await ctx['redis'].hmset_dict(key, data)
-                    await ctx['redis'].publish(key, json.dumps(data))
+                    if conflate is not None:
+                        # 只保留最新的一条，由 Ws2redis 定时写入，见 conflate.py
+                        conflate.add(table, data)
+                    else:
+                        write_row(ctx, table, data)
                     ctx['response'] = True
                 else:
                     logger.error(f"不知道如何处理：{table}\r\n{data}")
 
 
+def write_row(ctx, table, data):
+    # 保存一个 instrument_id 的最新数据并发布
+    key = f"okex/{ctx['name']}/{table}:{data['instrument_id']}"
+    ttl = ctx['retention'].rule(table)['ttl']
+    ctx['pipe'].hmset_dict(key, data)
+    if ttl:
+        ctx['pipe'].expire(key, ttl)
+    ctx['pipe'].publish(key, ctx['codec'].dumps(data))
+
+
 async def read(ctx):
     if 'response' not in ctx:
         end = endswith(ctx['path'], uni_id.keys())
         if end is not None:
             key = f"okex/{ctx['name']}/{ctx['path']}"
-            index = 0
-            if 'n' in ctx:
-                l = await ctx['redis'].zcard(key)
-                if ctx['n'] < l:
-                    index = l - ctx['n']
-            ids = await ctx['redis'].zrange(key, index, encoding='utf-8')
-            datas = []
-            for uid in ids:
-                data = await ctx['redis'].hgetall(f"{key}:{uid}", encoding='utf-8')
-                datas.append(data)
-            # logger.info(candles)
-            ctx['response'] = datas
+            if ctx.get('settings', {}).get('UNI_ID_STORAGE', 'zset') == 'stream':
+                # stream 项的 id 是 okws 收到数据的时间，不是 trade_id 等，不能按 id 取一段数据
+                if ctx.get('start') is not None or ctx.get('end') is not None:
+                    raise ValueError(f"UNI_ID_STORAGE 为 stream 时不支持参数 start、end：{ctx['path']}")
+                ctx['response'] = await stream.read(ctx['redis'], key, ctx.get('n'), ctx.get('fields'), ctx.get('format'))
+                return
+            # n, start, end (id), fields, format 参数见 index.py
+            ctx['response'] = await index.read(ctx, key, ctx.get('start'), ctx.get('end'))
         elif ctx['path'] == 'spot/account':
             if 'currency' in ctx:
                 key = f"okex/{ctx['name']}/{ctx['path']}:{ctx['currency']}"
@@ -111,12 +131,10 @@ async def read(ctx):
         elif ctx['path'] == 'futures/instruments':
             key = f"okex/{ctx['name']}/{ctx['path']}"
             ids = await ctx['redis'].smembers(key, encoding='utf-8')
-            datas = []
+            pipe = ctx['redis'].pipeline()
             for uid in ids:
-                data = await ctx['redis'].hgetall(f"{key}:{uid}", encoding='utf-8')
-                datas.append(data)
-            # logger.info(candles)
-            ctx['response'] = datas
+                pipe.hgetall(f"{key}:{uid}", encoding='utf-8')
+            ctx['response'] = await pipe.execute()
 
         else:
             if 'instrument_id' in ctx:
@@ -0,0 +1,146 @@
+"""k 线的紧凑存储方式
+
+settings 中 CANDLE_STORAGE: packed 时使用，缺省为 hash (有序集合保存 timestamp，每根 k 线一个 hash)。
+每个 instrument 只有一个有序集合 okex/<name>/<table>:<instrument_id>，score 为 k 线时间(秒)，
+member 为按 FIELDS 顺序用逗号连接的 k 线数据，如:
+    2020-11-12T13:20:00.000Z,15866.1,15877.3,15852.5,15877.3,5966,37.5977
+没有每根 k 线一个 key 的开销，占用的内存少很多，见 benchmarks/candle_storage_bench.py。
+保留规则中的 ttl 对这种方式无效，使用 max_row 或 max_age。
+
+更改后运行 okws -c okws.yaml --migrate 转换已有数据。
+"""
+import logging
+
+from . import columnar
+from .script import Script
+
+logger = logging.getLogger(__name__)
+
+# 同 candle.FIELDS
+FIELDS = ["timestamp", "open", "high", "low", "close", "volume", "currency_volume"]
+
+# 保存一根 k 线，一次 EVALSHA 完成，同 candle.UPSERT:
+#   seed 为 '1' 时，如果是新的 k 线，发布上一根 k 线；
+#   替换同一时间的 k 线，按保留规则删除多余或过期的 k 线，删除的数量累计在 stats 中。
+# KEYS: okex/<name>/<table>:<instrument_id>, okex/<name>/retention
+# ARGV: score, member, table, max_row, min_score, seed
+UPSERT = Script("""
+local FIELDS = {'timestamp', 'open', 'high', 'low', 'close', 'volume', 'currency_volume'}
+local key = KEYS[1]
+local score = ARGV[1]
+if ARGV[6] == '1' and #redis.call('ZRANGEBYSCORE', key, score, score) == 0 then
+    local last = redis.call('ZRANGE', key, -1, -1)
+    if #last > 0 then
+        local candle, start = {}, 1
+        for _, f in ipairs(FIELDS) do
+            local stop = string.find(last[1], ',', start, true)
+            if stop == nil then
+                candle[f] = string.sub(last[1], start)
+                break
+            end
+            candle[f] = string.sub(last[1], start, stop - 1)
+            start = stop + 1
+        end
+        redis.call('PUBLISH', key, cjson.encode({candle = candle, timestamp = candle['timestamp']}))
+    end
+end
+redis.call('ZREMRANGEBYSCORE', key, score, score)
+redis.call('ZADD', key, score, ARGV[2])
+local n = 0
+local max_row = tonumber(ARGV[4])
+if max_row > 0 then
+    n = n + redis.call('ZREMRANGEBYRANK', key, 0, -max_row - 1)
+end
+if ARGV[5] ~= '' then
+    n = n + redis.call('ZREMRANGEBYSCORE', key, '-inf', '(' .. ARGV[5])
+end
+if n > 0 then
+    redis.call('HINCRBY', KEYS[2], ARGV[3], n)
+end
+return n
+""")
+
+
+def pack(candle):
+    return ','.join(str(candle.get(f, '')) for f in FIELDS)
+
+
+def unpack(member):
+    return dict(zip(FIELDS, member.split(',')))
+
+
+def queue(ctx, key, stats, args):
+    """args: [score, member, table, max_row, min_score, seed]，放到 ctx['pipe'] 中执行"""
+    return UPSERT.queue(ctx, [key, stats], args)
+
+
+async def read(ctx, key, start=None, end=None):
+    # 参数同 index.read，一次 redis 请求
+    redis = ctx['redis']
+    n = ctx.get('n')
+    if start is not None or end is not None:
+        lo = float('-inf') if start is None else start
+        hi = float('inf') if end is None else end
+        if n:
+            members = await redis.zrevrangebyscore(key, hi, lo, offset=0, count=n, encoding='utf-8')
+            members.reverse()
+        else:
+            members = await redis.zrangebyscore(key, lo, hi, encoding='utf-8')
+    else:
+        members = await redis.zrange(key, -n if n else 0, -1, encoding='utf-8')
+
+    fields = ctx.get('fields')
+    rows = [member.split(',') for member in members]
+    if fields:
+        pos = [FIELDS.index(f) if f in FIELDS else None for f in fields]
+        rows = [[None if i is None else row[i] for i in pos] for row in rows]
+    if ctx.get('format') is not None:
+        return columnar.frame(fields or FIELDS, rows, ctx['format'])
+    return [dict(zip(fields or FIELDS, row)) for row in rows]
+
+
+async def migrate(redis, key, storage):
+    """在 hash 和 packed 两种方式之间转换一个 instrument 的 k 线，返回转换的 k 线数量
+
+    先写到临时 key，再 RENAME 覆盖原来的有序集合，最后删除 hash。
+    """
+    if await redis.type(key) != b'zset':
+        return 0
+    members = await redis.zrange(key, 0, -1, withscores=True, encoding='utf-8')
+    if not members:
+        return 0
+    is_packed = ',' in members[0][0]
+    tmp = f"{key}:migrate"
+    if storage == 'packed' and not is_packed:
+        pipe = redis.pipeline()
+        futs = [pipe.hgetall(f"{key}/{ts}", encoding='utf-8') for ts, _score in members]
+        await pipe.execute()
+        pipe = redis.pipeline()
+        pipe.delete(tmp)
+        n = 0
+        for (ts, score), fut in zip(members, futs):
+            candle = fut.result()
+            if candle:
+                pipe.zadd(tmp, score, pack(candle))
+                n += 1
+        if n > 0:
+            pipe.rename(tmp, key)
+        else:
+            pipe.delete(key)
+        for ts, _score in members:
+            pipe.unlink(f"{key}/{ts}")
+    elif storage == 'hash' and is_packed:
+        pipe = redis.pipeline()
+        pipe.delete(tmp)
+        n = 0
+        for member, score in members:
+            candle = unpack(member)
+            pipe.zadd(tmp, score, candle['timestamp'])
+            pipe.hmset_dict(f"{key}/{candle['timestamp']}", candle)
+            n += 1
+        pipe.rename(tmp, key)
+    else:
+        return 0
+    await pipe.execute()
+    logger.info(f"{key}: 已转换 {n} 根 k 线到 {storage}")
+    return n
@@ -0,0 +1,127 @@
+"""数据保留策略
+
+对有索引的数据(uni_id 表的 okex/<name>/<table> 及 k 线的 okex/<name>/<table>:<instrument_id>)，
+删除多余或过期的索引项时，同时删除对应的 hash (<index>/<id>)。
+
+配置(settings):
+    MAX_ROW: 缺省最多保存记录数
+    RETENTION: 按频道名匹配(fnmatch)的保留规则，先匹配的优先，如：
+        RETENTION:
+          "*/trade": {max_row: 500, ttl: 3600}
+          "*/candle60s": {max_row: 1440, max_age: 86400}
+      max_row: 最多保存记录数
+      max_age: 最长保存时间(秒)，k 线按 k 线时间计算，uni_id 表按写入时间计算(等同于 ttl)
+      ttl: hash 的过期时间(秒)
+    UNI_ID_STORAGE 为 stream 时 uni_id 表只支持 max_row (XADD MAXLEN)，max_age、ttl 不起作用，第一次写入时记录警告。
+
+删除的 key 数量按频道名累计在 okex/<name>/retention 中。
+"""
+import fnmatch
+import logging
+import time
+
+from .script import Script
+
+logger = logging.getLogger(__name__)
+
+# 删除多余或过期的索引项及对应的 hash，返回删除的 hash 数量
+TRIM_FUNCTION = """
+local function evict(key, members)
+    local n = 0
+    for _, m in ipairs(members) do
+        if redis.call('ZREM', key, m) == 1 then
+            n = n + redis.call('DEL', key .. '/' .. m)
+        end
+    end
+    return n
+end
+
+local function trim(key, stats, table_name, max_row, min_score, check_expired)
+    local n = 0
+    if min_score ~= '' then
+        n = n + evict(key, redis.call('ZRANGEBYSCORE', key, '-inf', '(' .. min_score))
+    end
+    if max_row > 0 then
+        n = n + evict(key, redis.call('ZRANGE', key, 0, -max_row - 1))
+    end
+    if check_expired == '1' then
+        -- hash 已经过期的索引项
+        while true do
+            local first = redis.call('ZRANGE', key, 0, 0)
+            if #first == 0 or redis.call('EXISTS', key .. '/' .. first[1]) == 1 then
+                break
+            end
+            redis.call('ZREM', key, first[1])
+        end
+    end
+    if n > 0 then
+        redis.call('HINCRBY', stats, table_name, n)
+    end
+    return n
+end
+"""
+
+# KEYS: index, stats
+# ARGV: table, max_row, min_score, check_expired
+TRIM = Script(TRIM_FUNCTION + """
+return trim(KEYS[1], KEYS[2], ARGV[1], tonumber(ARGV[2]), ARGV[3], ARGV[4])
+""")
+
+
+class Retention:
+    def __init__(self, settings=None):
+        if settings is None:
+            settings = {}
+        self.default = {'max_row': settings.get('MAX_ROW', 1000), 'max_age': None, 'ttl': None}
+        self.rules = settings.get('RETENTION') or {}
+        self._cache = {}
+        # 已警告过 max_age、ttl 不起作用的 stream 表
+        self._ignored = set()
+
+    def rule(self, table):
+        if table not in self._cache:
+            self._cache[table] = self.default
+            for pattern, rule in self.rules.items():
+                if fnmatch.fnmatchcase(table, pattern):
+                    self._cache[table] = {**self.default, **rule}
+                    break
+        return self._cache[table]
+
+    def stream_max_row(self, table):
+        """stream 方式的 uni_id 表的最多保存记录数，没有限制时为 None"""
+        rule = self.rule(table)
+        if (rule['max_age'] or rule['ttl']) and table not in self._ignored:
+            self._ignored.add(table)
+            logger.warning(f"{table} 使用 stream 存储，只支持 max_row，保留规则中的 max_age、ttl 不起作用：{rule}")
+        return rule['max_row'] or None
+
+    def args(self, table, by_time=True):
+        """返回 (max_row, min_score, check_expired, ttl)
+
+        by_time: 索引的 score 是否为时间(秒)，否则 max_age 用 hash 的过期时间实现
+        """
+        rule = self.rule(table)
+        max_row = rule['max_row'] or 0
+        ttl = rule['ttl'] or 0
+        min_score = ''
+        if rule['max_age']:
+            if by_time:
+                min_score = time.time() - rule['max_age']
+            elif not ttl or rule['max_age'] < ttl:
+                ttl = rule['max_age']
+        return max_row, min_score, '1' if ttl else '0', ttl
+
+    def trim(self, ctx, key, table):
+        # uni_id 表，放到 ctx['pipe'] 中执行
+        max_row, min_score, check_expired, _ttl = self.args(table, by_time=False)
+        return TRIM.queue(ctx, [key, stats_key(ctx['name'])], [table, max_row, min_score, check_expired])
+
+
+def stats_key(name):
+    return f"okex/{name}/retention"
+
+
+async def reclaimed(redis, name):
+    # 各频道已删除的 key 数量
+    stats = await redis.hgetall(stats_key(name), encoding='utf-8')
+    return {table: int(n) for table, n in stats.items()}
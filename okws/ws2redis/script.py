@@ -0,0 +1,50 @@
+"""redis lua 脚本
+
+使用 EVALSHA 执行脚本，连接 redis 后先 load 一次，
+当 redis 重启或 SCRIPT FLUSH 后返回 NOSCRIPT 错误时，重新加载脚本后再执行。
+放在 ctx['pipe'] 中的脚本在 pipe 执行之后才重新执行，REDIS_BATCH 为 multi 时这些脚本在事务之外执行，
+不与同一事务中的其它命令原子执行；只在脚本缓存被清空后的第一条消息上出现，之后的消息不受影响。
+"""
+import hashlib
+
+from aioredis.errors import ReplyError
+
+
+def is_noscript(error):
+    return isinstance(error, ReplyError) and str(error).startswith('NOSCRIPT')
+
+
+class Script:
+    def __init__(self, source):
+        self.source = source
+        self.sha = hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+    async def load(self, redis):
+        await redis.script_load(self.source)
+
+    async def __call__(self, redis, keys=None, args=None):
+        # 直接执行脚本
+        keys = keys or []
+        args = args or []
+        try:
+            return await redis.evalsha(self.sha, keys, args)
+        except ReplyError as e:
+            if not is_noscript(e):
+                raise
+            await self.load(redis)
+            return await redis.evalsha(self.sha, keys, args)
+
+    def queue(self, ctx, keys=None, args=None):
+        # 放到 ctx['pipe'] 中和其它命令一起发送，发送后由 rerun_noscript 处理 NOSCRIPT 错误
+        keys = keys or []
+        args = args or []
+        fut = ctx['pipe'].evalsha(self.sha, keys, args)
+        ctx.setdefault('scripts', []).append((self, fut, keys, args))
+        return fut
+
+
+async def rerun_noscript(redis, scripts):
+    # ctx['pipe'] 执行后，重新加载并执行因 NOSCRIPT 而失败的脚本
+    for script, fut, keys, args in scripts:
+        if fut.done() and not fut.cancelled() and is_noscript(fut.exception()):
+            await script(redis, keys, args)
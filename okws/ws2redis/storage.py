@@ -0,0 +1,34 @@
+"""数据的存储方式
+
+okws 启动时把 UNI_ID_STORAGE、CANDLE_STORAGE 写到 okex/<name>/storage (hash) 中，
+client 按 redis 中记录的方式读取，不需要与 okws 使用相同的设置；没有记录时(旧版本的 okws)使用 client 的设置。
+记录在 client 中缓存 ttl 秒，--migrate 转换数据后也更新记录。
+"""
+import time
+
+DEFAULTS = {'UNI_ID_STORAGE': 'zset', 'CANDLE_STORAGE': 'hash'}
+
+
+def key(name):
+    return f"okex/{name}/storage"
+
+
+def modes(settings):
+    return {field: settings.get(field) or default for field, default in DEFAULTS.items()}
+
+
+class Cache:
+    """client 端每个服务名的存储方式，超过 ttl 秒重新读取"""
+
+    def __init__(self, ttl=10):
+        self.ttl = ttl
+        # name -> (读取时间, {field: 存储方式})
+        self.items = {}
+
+    async def settings(self, redis, name, settings):
+        """返回按 okex/<name>/storage 更新后的 settings"""
+        now = time.monotonic()
+        item = self.items.get(name)
+        if item is None or now - item[0] > self.ttl:
+            item = self.items[name] = (now, await redis.hgetall(key(name), encoding='utf-8'))
+        return {**settings, **item[1]} if item[1] else settings
@@ -0,0 +1,109 @@
+"""uni_id 表 (/trade, /order, /order_algo) 的 redis stream 存储方式
+
+settings 中 UNI_ID_STORAGE: stream 时使用，缺省为 zset (有序集合保存 id，每个 id 一个 hash)。
+    写: XADD okex/<name>/<table> MAXLEN ~ max_row，每条数据一个 stream 项，保留规则中的 max_age、ttl 不起作用
+    读: 最新 n 条数据只需一次 XREVRANGE
+    订阅: 可以使用 XREAD 或消费组 XREADGROUP 读取，不会像 pub/sub 那样丢失数据
+
+注意：order 每次状态更新都会追加一项，而 zset 方式只保存每个 id 的最新状态。
+更改 UNI_ID_STORAGE 后运行 okws -c okws.yaml --migrate 在两种方式之间转换已有数据。
+"""
+import logging
+
+from . import columnar
+
+logger = logging.getLogger(__name__)
+
+
+def decode(fields):
+    # aioredis 返回的是 bytes
+    return {k.decode('utf-8') if isinstance(k, bytes) else k: v.decode('utf-8') if isinstance(v, bytes) else v
+            for k, v in fields.items()}
+
+
+def write(ctx, key, table):
+    # 只按 max_row 删除旧数据，见 retention.py
+    max_row = ctx['retention'].stream_max_row(table)
+    for data in ctx['data']['data']:
+        ctx['pipe'].xadd(key, data, max_len=max_row)
+
+
+async def read(redis, key, n=None, fields=None, format=None):
+    # 返回最新的 n 条数据，按时间先后排序，fields 指定只返回的字段，format 见 columnar.py
+    messages = await redis.xrevrange(key, count=n)
+    if format is not None:
+        messages = [values for _mid, values in reversed(messages)]
+        if fields:
+            rows = [[values.get(f.encode('utf-8')) for f in fields] for values in messages]
+            return columnar.frame(fields, rows, format)
+        return columnar.frame(*columnar.hash_rows([[x for kv in values.items() for x in kv]
+                                                    for values in messages]), format)
+    datas = [decode(values) for _mid, values in reversed(messages)]
+    if fields:
+        datas = [{f: data.get(f) for f in fields} for data in datas]
+    return datas
+
+
+async def migrate(redis, key, storage='stream', uid=None):
+    """在 zset + hash 和 stream 两种方式之间转换一个 uni_id 表，返回转换的数据条数
+
+    先写到临时 key，再 RENAME 覆盖原来的 key。
+    转换为 zset 时需要 uid (如 trade_id)，stream 中同一个 id 的多次更新只保留最后一条。
+    """
+    key_type = await redis.type(key)
+    if storage == 'stream' and key_type == b'zset':
+        return await _to_stream(redis, key)
+    if storage == 'zset' and key_type == b'stream':
+        if uid is None:
+            raise ValueError(f"{key}: 转换为 zset 时需要 uid")
+        return await _to_zset(redis, key, uid)
+    return 0
+
+
+async def _to_stream(redis, key):
+    # 最后删除 hash
+    ids = await redis.zrange(key, encoding='utf-8')
+    pipe = redis.pipeline()
+    futs = [pipe.hgetall(f"{key}/{uid}", encoding='utf-8') for uid in ids]
+    await pipe.execute()
+
+    tmp = f"{key}:migrate"
+    pipe = redis.pipeline()
+    pipe.delete(tmp)
+    n = 0
+    for fut in futs:
+        data = fut.result()
+        if data:
+            pipe.xadd(tmp, data)
+            n += 1
+    if n > 0:
+        pipe.rename(tmp, key)
+    else:
+        pipe.delete(key)
+    for uid in ids:
+        pipe.unlink(f"{key}/{uid}")
+    await pipe.execute()
+    logger.info(f"{key}: 已转换 {n} 条数据到 stream")
+    return n
+
+
+async def _to_zset(redis, key, uid):
+    # 先写 hash，RENAME 后 zset 才指向它们
+    latest = {}
+    for _mid, fields in await redis.xrange(key):
+        data = decode(fields)
+        if data.get(uid):
+            latest[data[uid]] = data
+    tmp = f"{key}:migrate"
+    pipe = redis.pipeline()
+    pipe.delete(tmp)
+    for uid_value, data in latest.items():
+        pipe.zadd(tmp, int(uid_value), uid_value)
+        pipe.hmset_dict(f"{key}/{uid_value}", data)
+    if latest:
+        pipe.rename(tmp, key)
+    else:
+        pipe.delete(key)
+    await pipe.execute()
+    logger.info(f"{key}: 已转换 {len(latest)} 条数据到 zset")
+    return len(latest)
@@ -1,7 +1,10 @@
+import asyncio
+import json
 import logging
+import time
 
 from ..interceptor import Interceptor
-from ..okex import subscribe
+from ..okex import error_channels
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -10,23 +13,141 @@ logger.setLevel(logging.DEBUG)
 class Subscribe(Interceptor):
     """
     记录 ws 连接所订阅频道，并在重联时重新订阅
+    分片模式下每个连接一个 Subscribe，只记录本连接的频道，shard 为连接序号
+
+    重新订阅在另一个任务中分批发送，不阻塞数据处理(订阅的回复也要由处理任务接收):
+        每批最多 chunk 个频道，args 不超过 max_bytes 字节，最多 inflight 批没有收到回复，
+        timeout 秒内没有收到回复的频道重新订阅，最多重试 retries 次，收到 error 回复的频道不再重试。
+    完成后把 RESUBSCRIBED 信号放到连接的接收队列中，与数据一样由处理任务交给 app，由 Ws2redis 在 okex/<name>/event 上发送
+        {"op": "RESUBSCRIBED", "channels": 频道数, "chunks": 批数, "retried": 重试的频道数, "failed": [没有成功的频道], "duration": 秒}
+    发送订阅指令出错时 failed 为没有成功的频道，并带有 "error": 错误信息
     """
 
-    def __init__(self):
+    def __init__(self, shard=None, settings=None):
         super().__init__('Subscribe')
+        self.shard = shard
         self.subscribed = set()
+        settings = (settings or {}).get('RESUBSCRIBE') or {}
+        self.chunk = settings.get('chunk', 100)
+        self.max_bytes = settings.get('max_bytes', 4000)
+        self.inflight = settings.get('inflight', 2)
+        self.timeout = settings.get('timeout', 10)
+        self.retries = settings.get('retries', 2)
+        # 连接 -> 正在重新订阅的任务，还没有收到回复的频道，收到 error 回复的频道，收到回复的通知
+        self.tasks = {}
+        self.pending = {}
+        self.errors = {}
+        self.acked = {}
+
+    def chunks(self, channels):
+        """按 chunk 及 max_bytes 分批"""
+        chunk, size = [], 0
+        for channel in channels:
+            # json 中每个频道多出引号、逗号及空格
+            length = len(channel.encode('utf-8')) + 4
+            if chunk and (len(chunk) >= self.chunk or size + length > self.max_bytes):
+                yield chunk
+                chunk, size = [], 0
+            chunk.append(channel)
+            size += length
+        if chunk:
+            yield chunk
+
+    async def wait(self, server, limit, deadline):
+        """等待没有回复的频道数不超过 limit，超时返回 False"""
+        pending, acked = self.pending[server], self.acked[server]
+        while len(pending) > limit:
+            acked.clear()
+            try:
+                await asyncio.wait_for(acked.wait(), deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def resubscribe(self, server, channels):
+        start = time.perf_counter()
+        total = len(channels)
+        pending = self.pending[server] = set()
+        errors = self.errors[server] = set()
+        self.acked[server] = asyncio.Event()
+        chunks = retried = 0
+        # 还没有发送的频道
+        unsent = set(channels)
+        error = None
+        try:
+            for attempt in range(self.retries + 1):
+                deadline = time.perf_counter() + self.timeout
+                for chunk in self.chunks(channels):
+                    # 没有回复的超过 inflight 批时等待，超时后继续发送
+                    await self.wait(server, (self.inflight - 1) * self.chunk, deadline)
+                    pending.update(chunk)
+                    chunks += 1
+                    await server.send(json.dumps({"op": "subscribe", "args": chunk}))
+                    unsent.difference_update(chunk)
+                if await self.wait(server, 0, deadline) or attempt == self.retries:
+                    break
+                channels = [channel for channel in channels if channel in pending]
+                retried += len(channels)
+                logger.warning(f"shard {self.shard} {len(channels)} 个频道 {self.timeout} 秒内没有订阅成功，重新订阅")
+        except Exception as e:
+            logger.exception(f"shard {self.shard} 重新订阅出错")
+            error = repr(e)
+        finally:
+            # 重连时旧任务被取消，这时已经有新的任务
+            if self.pending.get(server) is pending:
+                del self.pending[server]
+                del self.errors[server]
+                del self.acked[server]
+            if self.tasks.get(server) is asyncio.current_task():
+                del self.tasks[server]
+        result = {'channels': total, 'chunks': chunks, 'retried': retried,
+                  'failed': sorted(pending | errors | unsent), 'duration': round(time.perf_counter() - start, 3)}
+        if error is not None:
+            result['error'] = error
+        logger.info(f"shard {self.shard} 重新订阅完成：{result}")
+        # 不直接调用 app，由处理任务按顺序处理
+        await server.queue.put('RESUBSCRIBED', {'RESUBSCRIBED': result})
+
+    def done(self, task):
+        # 其它没有处理的错误
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"shard {self.shard} 重新订阅任务出错", exc_info=task.exception())
+
+    def cancel(self, server):
+        task = self.tasks.pop(server, None)
+        if task is not None:
+            task.cancel()
 
     async def enter(self, request):
+        server = request.get('_server_')
         if request['_signal_'] == 'CONNECTED':
+            self.cancel(server)
             if self.subscribed:
-                logger.debug(f"CONNECTED, subscribe channels {self.subscribed}")
-                subscribe(request, list(self.subscribed))
+                logger.debug(f"CONNECTED, shard {self.shard} subscribe channels {self.subscribed}")
+                self.tasks[server] = asyncio.create_task(self.resubscribe(server, sorted(self.subscribed)))
+                self.tasks[server].add_done_callback(self.done)
+        elif request['_signal_'] in ('DISCONNECTED', 'EXIT'):
+            self.cancel(server)
         elif request['_signal_'] == 'ON_DATA':
             if "event" in request['DATA'] and request['DATA'].get('event') == 'subscribe':
                 # 订阅了频道
-                self.subscribed.add(request['DATA'].get('channel'))
-                logger.debug(f"subscribed channel {request['DATA'].get('channel')}")
+                channel = request['DATA'].get('channel')
+                self.subscribed.add(channel)
+                if server in self.pending:
+                    self.pending[server].discard(channel)
+                    self.acked[server].set()
+                logger.debug(f"shard {self.shard} subscribed channel {channel}")
+
+            elif request['DATA'].get('event') == 'error' and server in self.pending:
+                # 错误信息中有频道名时，该频道订阅失败，不再等待及重试
+                data = request['DATA']
+                failed = error_channels(data, self.pending[server])
+                if failed:
+                    self.pending[server].difference_update(failed)
+                    self.errors[server].update(failed)
+                    self.acked[server].set()
+                    logger.warning(f"shard {self.shard} 订阅失败：{failed} {data}")
 
             elif "event" in request['DATA'] and request['DATA'].get('event') == 'unsubscribe':
-                self.subscribed.remove(request['DATA'].get('channel'))
-                logger.debug(f"unsubscribe channel {request['DATA'].get('channel')}")
+                self.subscribed.discard(request['DATA'].get('channel'))
+                logger.debug(f"shard {self.shard} unsubscribe channel {request['DATA'].get('channel')}")
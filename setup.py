@@ -24,6 +24,12 @@ setup(
     keywords="exchange websockets api",
     packages=find_packages(exclude=["tests"]),
     install_requires=install_requires,
+    extras_require={
+        "numpy": ["numpy"],
+        "pandas": ["numpy", "pandas"],
+        "orjson": ["orjson"],
+        "ujson": ["ujson>=5.2"],
+    },
     tests_require=['pytest', 'pytest-asyncio'],
     test_suite='tests',
     # include_package_data=True,
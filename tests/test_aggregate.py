@@ -0,0 +1,44 @@
+import pytest
+
+from okws.ws2redis.aggregate import Aggregator, Bar, timestamp
+from okws.ws2redis.candle import FIELDS, score
+
+
+def candle(ts, o, h, l, c, v):
+    return dict(zip(FIELDS, [ts, o, h, l, c, v, '0']))
+
+
+def test_targets():
+    aggregator = Aggregator({'CANDLE_AGGREGATE': {'candle60s': [300, 3600]}})
+    assert aggregator.targets('swap/candle60s') == [(300, 'swap/candle300s'), (3600, 'swap/candle3600s')]
+    assert aggregator.targets('swap/candle300s') == []
+    assert aggregator.targets('spot/ticker') == []
+    with pytest.raises(ValueError):
+        Aggregator({'CANDLE_AGGREGATE': {'candle60s': [90]}})
+
+
+def test_bar():
+    start = score('2020-11-12T13:20:00.000Z')
+    assert timestamp(start) == '2020-11-12T13:20:00.000Z'
+    bar = Bar(start)
+    bar.tick(candle('2020-11-12T13:20:00.000Z', '10', '12', '9', '11', '1.1'))
+    bar.tick(candle('2020-11-12T13:20:00.000Z', '10', '13', '9', '12', '2.2'))
+    bar.tick(candle('2020-11-12T13:21:00.000Z', '12', '12.5', '8', '8.5', '0.1'))
+    # 旧的基础 k 线不处理
+    assert not bar.tick(candle('2020-11-12T13:20:00.000Z', '1', '1', '1', '1', '1'))
+    assert bar.candle() == {
+        'timestamp': '2020-11-12T13:20:00.000Z',
+        'open': '10', 'high': '13', 'low': '8', 'close': '8.5',
+        'volume': '2.3', 'currency_volume': '0',
+    }
+
+
+def test_rollover():
+    aggregator = Aggregator({'CANDLE_AGGREGATE': {'candle60s': [300]}})
+    t0 = score('2020-11-12T13:20:00.000Z')
+    bar, new = aggregator.bar('spot/candle300s', 'ETH-USDT', 300, t0 + 60)
+    assert new and bar.start == t0
+    assert aggregator.bar('spot/candle300s', 'ETH-USDT', 300, t0 + 120) == (bar, False)
+    bar2, new = aggregator.bar('spot/candle300s', 'ETH-USDT', 300, t0 + 300)
+    assert not new and bar2.start == t0 + 300
+    assert aggregator.bar('spot/candle300s', 'ETH-USDT', 300, t0 + 240) == (None, False)
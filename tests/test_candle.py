@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+import aioredis
+import pytest
+
+from okws import cleanup
+from okws.ws2redis.app import Ws2redis
+from okws.ws2redis.candle import FIELDS, score, update
+from okws.ws2redis.packed import pack, unpack
+
+
+def candle(timestamp, close):
+    return {'timestamp': timestamp, 'close': close}
+
+
+def test_score():
+    assert score('2020-11-12T13:20:00.000Z') == 1605187200
+    assert score(1605187200) == 1605187200
+    assert score(None) is None
+
+
+def test_update():
+    candles = {}
+    key = ('spot/candle60s', 'ETH-USDT')
+    # 重启后第一根，由 redis 判断
+    assert update(candles, key, candle('2020-11-12T13:20:00.000Z', '1')) == (True, None)
+    assert update(candles, key, candle('2020-11-12T13:20:00.000Z', '2')) == (False, None)
+    # 新的 k 线，上一根收线
+    assert update(candles, key, candle('2020-11-12T13:21:00.000Z', '3')) == \
+        (False, candle('2020-11-12T13:20:00.000Z', '2'))
+    # 旧的 k 线不改变当前 k 线
+    assert update(candles, key, candle('2020-11-12T13:20:00.000Z', '4')) == (False, None)
+    assert candles[key] == candle('2020-11-12T13:21:00.000Z', '3')
+
+
+def test_pack():
+    bar = dict(zip(FIELDS, ['2020-11-12T13:20:00.000Z', '15866.1', '15877.3', '15852.5', '15877.3', '5966', '37.5977']))
+    member = pack(bar)
+    assert member == '2020-11-12T13:20:00.000Z,15866.1,15877.3,15852.5,15877.3,5966,37.5977'
+    assert unpack(member) == bar
+
+
+def candle_frame(timestamp, close):
+    return {'_signal_': 'ON_DATA', 'DATA': {'table': 'spot/candle60s', 'data': [
+        {'instrument_id': 'ETH-USDT', 'candle': [timestamp, '1', '2', '0.5', close, '10', '0.1']}]}}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('mode', ['pipeline', 'multi'])
+async def test_upsert(mode):
+    # 需要本机运行 redis-server
+    key = 'okex/test_candle/spot/candle60s:ETH-USDT'
+    events = await aioredis.create_redis('redis://localhost')
+    ch, = await events.subscribe(key)
+    ws2redis = Ws2redis('test_candle', settings={'REDIS_BATCH': mode})
+    await ws2redis.enter({'_signal_': 'READY'})
+    redis = ws2redis.redis
+    try:
+        await cleanup.clear(redis, 'okex/test_candle/*')
+        # 新的 k 线，再更新同一根 k 线
+        await ws2redis.enter(candle_frame('2020-11-12T13:20:00.000Z', '1'))
+        await ws2redis.enter(candle_frame('2020-11-12T13:20:00.000Z', '2'))
+        assert await redis.zrange(key, encoding='utf-8') == ['2020-11-12T13:20:00.000Z']
+        assert await redis.hget(f"{key}/2020-11-12T13:20:00.000Z", 'close', encoding='utf-8') == '2'
+
+        # 重启后(没有本地状态)由脚本判断收线，脚本被清除后重新加载再执行
+        await ws2redis.close()
+        ws2redis = Ws2redis('test_candle', settings={'REDIS_BATCH': mode})
+        await ws2redis.enter({'_signal_': 'READY'})
+        redis = ws2redis.redis
+        await redis.script_flush()
+        await ws2redis.enter(candle_frame('2020-11-12T13:21:00.000Z', '3'))
+        assert await redis.zcard(key) == 2
+        assert await redis.hget(f"{key}/2020-11-12T13:21:00.000Z", 'close', encoding='utf-8') == '3'
+        closed = json.loads(await asyncio.wait_for(ch.get(), 1))
+        assert closed['timestamp'] == '2020-11-12T13:20:00.000Z' and closed['candle']['close'] == '2'
+    finally:
+        await cleanup.clear(redis, 'okex/test_candle/*')
+        await ws2redis.close()
+        events.close()
+        await events.wait_closed()
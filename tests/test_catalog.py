@@ -0,0 +1,24 @@
+from okws.ws2redis.catalog import ages, args, instruments_key, parse
+
+
+def test_keys():
+    assert instruments_key('tests', 'spot/ticker') == 'okex/tests/catalog/spot/ticker/instruments'
+    assert args('tests') == (['okex/tests/catalog'], ['-inf'])
+
+
+def test_parse():
+    result = [b'spot/ticker', b'1605187200.5', [b'ETH-USDT', b'1605187200.5', b'BTC-USDT', b'1605187100'],
+              b'spot/account', b'1605187000', []]
+    assert parse(result) == {
+        'spot/ticker': {'updated': 1605187200.5, 'instruments': {'ETH-USDT': 1605187200.5, 'BTC-USDT': 1605187100.0}},
+        'spot/account': {'updated': 1605187000.0, 'instruments': {}},
+    }
+
+
+def test_ages():
+    result = [[b'99.5', b'98'], [b'99', None], [None, None]]
+    assert ages(['ETH-USDT', 'BTC-USDT', 'XXX'], result, now=100) == {
+        'ETH-USDT': {'received': 0.5, 'exchange': 2.0},
+        'BTC-USDT': {'received': 1.0, 'exchange': None},
+        'XXX': {'received': None, 'exchange': None},
+    }
@@ -0,0 +1,41 @@
+import aioredis
+import pytest
+import redis
+
+from okws import cleanup
+
+redis_url = 'redis://localhost'
+
+
+@pytest.mark.asyncio
+async def test_clear():
+    r = await aioredis.create_redis(redis_url)
+    try:
+        pipe = r.pipeline()
+        for i in range(1200):
+            pipe.set(f"okex/test_cleanup/{i}", 1)
+        pipe.set("okex/test_cleanup_other", 1)
+        await pipe.execute()
+
+        progress = []
+        n = await cleanup.clear(r, "okex/test_cleanup/*", batch=500, progress=lambda s, d: progress.append(d),
+                                pipeline=2)
+        assert n == 1200
+        # 每 2 个 UNLINK 发送一次
+        assert progress == [1000, 1200]
+        assert await r.exists("okex/test_cleanup_other")
+        await r.unlink("okex/test_cleanup_other")
+    finally:
+        r.close()
+        await r.wait_closed()
+
+
+def test_clear_sync():
+    r = redis.Redis.from_url(redis_url)
+    for i in range(10):
+        r.set(f"okex/test_cleanup/{i}", 1)
+    progress = []
+    assert cleanup.clear_sync(r, "okex/test_cleanup/*", batch=3, progress=lambda s, d: progress.append(d),
+                              pipeline=2) == 10
+    assert progress == [6, 10]
+    assert cleanup.clear_sync(r, "okex/test_cleanup/*") == 0
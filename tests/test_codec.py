@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from okws.codec import available, get_codec, memoize
+
+
+def test_get_codec():
+    assert 'json' in available()
+    assert get_codec('json').name == 'json'
+    assert get_codec('auto').name in available()
+    with pytest.raises(ValueError):
+        get_codec('pickle')
+
+
+def test_memoize():
+    calls = []
+
+    def dumps(obj):
+        calls.append(obj)
+        return json.dumps(obj)
+
+    codec = memoize(get_codec('json')._replace(dumps=dumps))
+    row = {'instrument_id': 'ETH-USDT', 'last': '600.1'}
+    assert codec.dumps(row) == json.dumps(row)
+    assert codec.dumps(row) == json.dumps(row)
+    assert len(calls) == 1
+    codec.dumps({'instrument_id': 'BTC-USDT'})
+    assert len(calls) == 2
+
+
+def test_same_bytes():
+    # 不同 codec 发布及保存的数据相同
+    row = {'instrument_id': 'ETH-USDT', 'table': 'spot/ticker', 'note': '中文 é', 'last': 600.1, 'size': None}
+    expected = json.dumps(row)
+    for name in available():
+        assert get_codec(name).dumps(row) == expected, name
+        assert get_codec(name).loads(expected.encode('utf-8')) == row
@@ -0,0 +1,58 @@
+import pytest
+
+from okws.ws2redis import columnar
+
+np = pytest.importorskip('numpy')
+
+
+def test_candle_frame():
+    fields = ['timestamp', 'open', 'close', 'volume']
+    rows = [
+        [b'2020-11-12T13:20:00.000Z', b'15866.1', b'15877.3', b'5966'],
+        [b'2020-11-12T13:21:00.000Z', b'15877.3', b'15870', None],
+    ]
+    data = columnar.frame(fields, rows)
+    assert data['timestamp'].dtype == np.int64
+    assert list(data['timestamp']) == [1605187200000, 1605187260000]
+    assert data['close'].dtype == np.float64
+    assert data['close'][1] == 15870.0
+    assert np.isnan(data['volume'][1])
+
+
+def test_hash_rows():
+    rows = [
+        [b'trade_id', b'1', b'side', b'buy', b'price', b'1.5'],
+        [],
+        [b'side', b'sell', b'trade_id', b'2', b'price', b'2'],
+    ]
+    fields, rows = columnar.hash_rows(rows)
+    data = columnar.frame(fields, rows)
+    assert fields == ['trade_id', 'side', 'price']
+    assert list(data['trade_id']) == [1, 2]
+    assert list(data['side']) == ['buy', 'sell']
+    assert list(data['price']) == [1.5, 2.0]
+
+
+def test_missing():
+    # 缺少时间或 id 字段时为 nan
+    fields = ['timestamp', 'trade_id', 'price']
+    rows = [[b'2020-11-12T13:20:00.000Z', b'1', b'1.5'], [None, b'', None]]
+    data = columnar.frame(fields, rows)
+    assert data['timestamp'].dtype == np.float64 and data['trade_id'].dtype == np.float64
+    assert (data['timestamp'][0], data['trade_id'][0]) == (1605187200000, 1)
+    assert np.isnan(data['timestamp'][1]) and np.isnan(data['trade_id'][1]) and np.isnan(data['price'][1])
+
+    fields, rows = columnar.hash_rows([[b'trade_id', b'1', b'side', b'buy'], [b'side', b'sell']])
+    assert np.isnan(columnar.frame(fields, rows)['trade_id'][1])
+
+
+def test_empty():
+    data = columnar.frame(['timestamp', 'close'], [])
+    assert len(data['timestamp']) == 0
+
+
+def test_pandas():
+    pytest.importorskip('pandas')
+    df = columnar.frame(['timestamp', 'close'], [[b'2020-11-12T13:20:00.000Z', b'1']], 'pandas')
+    assert list(df.columns) == ['timestamp', 'close']
+    assert df['close'].iloc[0] == 1.0
@@ -0,0 +1,41 @@
+from okws.ws2redis.conflate import Conflate
+
+
+def test_match():
+    conflate = Conflate({'CONFLATE': {'tables': ['*/ticker', '*/mark_price']}})
+    assert conflate.enabled
+    assert conflate.match('spot/ticker')
+    assert conflate.match('swap/mark_price')
+    assert not conflate.match('spot/trade')
+    assert not Conflate({}).enabled
+
+
+def test_take():
+    conflate = Conflate({'CONFLATE': {'tables': ['*/ticker'], 'max_rows': 2}})
+    conflate.add('spot/ticker', {'instrument_id': 'ETH-USDT', 'last': '1'})
+    conflate.add('spot/ticker', {'instrument_id': 'ETH-USDT', 'last': '2'})
+    assert not conflate.full.is_set()
+    conflate.add('spot/ticker', {'instrument_id': 'BTC-USDT', 'last': '3'})
+    assert conflate.full.is_set()
+
+    rows, stats = conflate.take()
+    assert rows == [('spot/ticker', {'instrument_id': 'ETH-USDT', 'last': '2'}),
+                    ('spot/ticker', {'instrument_id': 'BTC-USDT', 'last': '3'})]
+    assert stats == {'received': 3, 'written': 2, 'coalesced': 1}
+    assert not conflate.full.is_set()
+    assert conflate.take() == ([], {'received': 0, 'written': 0, 'coalesced': 0})
+
+
+def test_restore():
+    conflate = Conflate({'CONFLATE': {'tables': ['*/ticker']}})
+    conflate.add('spot/ticker', {'instrument_id': 'ETH-USDT', 'last': '1'})
+    conflate.add('spot/ticker', {'instrument_id': 'BTC-USDT', 'last': '2'})
+    rows, stats = conflate.take()
+    # 写入时又收到新数据
+    conflate.add('spot/ticker', {'instrument_id': 'ETH-USDT', 'last': '3'})
+    conflate.restore(rows, stats)
+    rows, stats = conflate.take()
+    assert sorted(rows, key=lambda row: row[1]['instrument_id']) == [
+        ('spot/ticker', {'instrument_id': 'BTC-USDT', 'last': '2'}),
+        ('spot/ticker', {'instrument_id': 'ETH-USDT', 'last': '3'})]
+    assert stats == {'received': 3, 'written': 2, 'coalesced': 1}
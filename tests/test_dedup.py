@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from okws.failover import FailoverWebsockets
+from okws.ws2redis.dedup import Dedup
+from okws.ws2redis.depth import Depth, checksum
+
+pytestmark = pytest.mark.asyncio
+
+A, B = object(), object()
+
+
+def frame(server, raw):
+    return {'_signal_': 'ON_DATA', '_server_': server, 'RAW': raw}
+
+
+async def test_duplicate():
+    dedup = Dedup({'STANDBY': {'window': 2}})
+    for server, raw, signal in [(A, b'1', 'ON_DATA'), (B, b'1', 'DUPLICATE'), (B, b'2', 'ON_DATA'),
+                                (A, b'2', 'DUPLICATE'), (A, b'3', 'ON_DATA'), (B, b'3', 'DUPLICATE'),
+                                # 超出 window 后不再比较
+                                (B, b'1', 'ON_DATA')]:
+        request = frame(server, raw)
+        await dedup.enter(request)
+        assert request['_signal_'] == signal
+        assert 'FAILOVER' not in request
+    assert dedup.duplicates == 3
+
+
+async def test_failover():
+    dedup = Dedup({'STANDBY': {'silence': 60}})
+    await dedup.enter(frame(A, b'1'))
+    await dedup.enter({'_signal_': 'DISCONNECTED', '_server_': A})
+    request = frame(B, b'2')
+    await dedup.enter(request)
+    assert request['FAILOVER']['reason'] == 'disconnected'
+    assert 0 <= request['FAILOVER']['gap'] < 60
+    assert dedup.leader is B
+
+    # 没有断开，超过 silence 秒都没有数据时不切换
+    dedup.silence = 0
+    await dedup.enter({'_signal_': 'CONNECTED', '_server_': A})
+    request = frame(A, b'3')
+    await dedup.enter(request)
+    assert 'FAILOVER' not in request and not request['LEADER']
+    # leader 超过 silence 秒没有数据，另一个连接在这期间收到过数据
+    request = frame(A, b'4')
+    await dedup.enter(request)
+    assert request['FAILOVER']['reason'] == 'silence'
+    assert dedup.leader is A and request['LEADER']
+
+
+def depth(server, action, bids, asks, book_bids, book_asks):
+    # book_bids, book_asks: 合并后的 order book，用于计算 checksum
+    data = {'table': 'spot/depth', 'action': action, 'data': [
+        {'instrument_id': 'BTC-USDT', 'bids': bids, 'asks': asks, 'checksum': checksum(book_bids, book_asks)}]}
+    return {'_signal_': 'ON_DATA', '_server_': server, 'RAW': repr(data).encode(), 'DATA': data}
+
+
+async def test_depth_partial():
+    # 两个连接的深度数据交错到达，B 重连后的 partial 不替换 leader 合并的 order book
+    dedup, order_books = Dedup({}), Depth({'DEPTH': {'interval': 0}})
+    asks = [['101', '1', '1']]
+    bids = [['100', '1', '1']]
+    stream = [
+        depth(A, 'partial', bids, asks, bids, asks),
+        depth(B, 'partial', bids, asks, bids, asks),
+        depth(B, 'update', [['99', '1', '1']], [], bids + [['99', '1', '1']], asks),
+        depth(A, 'update', [['99', '1', '1']], [], bids + [['99', '1', '1']], asks),
+        # B 重连后收到的 partial 是另一个时间的全量数据
+        depth(B, 'partial', [['98', '5', '1']], asks, [['98', '5', '1']], asks),
+        depth(A, 'update', [['100', '2', '1']], [], [['100', '2', '1'], ['99', '1', '1']], asks),
+        depth(B, 'update', [['100', '2', '1']], [], [['100', '2', '1'], ['99', '1', '1']], asks),
+    ]
+    for request in stream:
+        await dedup.enter(request)
+        if request['_signal_'] == 'ON_DATA':
+            await order_books.enter(request)
+        assert 'response' not in request
+    book = order_books.books[('spot/depth', 'BTC-USDT')]
+    assert book.bids.top(5) == [['100', '2', '1'], ['99', '1', '1']]
+
+
+async def test_dispatch():
+    received = []
+
+    async def app(request):
+        received.append((request['_signal_'], request['STANDBY']))
+
+    ws = FailoverWebsockets(app)
+    ws.lock = asyncio.Lock()
+    a, b = ws.clients
+    for signal, server in [('CONNECTED', a), ('CONNECTED', b), ('DISCONNECTED', a), ('DISCONNECTED', b),
+                           ('EXIT', a), ('EXIT', b)]:
+        await ws.dispatch({'_signal_': signal, '_server_': server})
+    assert received == [('CONNECTED', False), ('CONNECTED', True), ('DISCONNECTED', True),
+                        ('DISCONNECTED', False), ('EXIT', False)]
@@ -0,0 +1,154 @@
+import asyncio
+import zlib
+
+import pytest
+
+from okws import cleanup
+from okws.ws2redis import app
+from okws.ws2redis.app import Ws2redis
+from okws.ws2redis.depth import Depth, OrderBook, checksum
+
+
+def crc(s):
+    c = zlib.crc32(s.encode('utf-8'))
+    return c - (1 << 32) if c >= (1 << 31) else c
+
+
+def test_checksum():
+    bids = [['3366.1', '7', '0', '3'], ['3366', '6', '3', '4']]
+    asks = [['3366.8', '9', '10', '3'], ['3368', '8', '3', '4'], ['3369', '1', '0', '1']]
+    assert checksum(bids, asks) == crc('3366.1:7:3366.8:9:3366:6:3368:8:3369:1')
+
+
+def test_order_book():
+    book = OrderBook('spot/depth', 'BTC-USDT')
+    bids = [['100', '1', '1'], ['99', '2', '1']]
+    asks = [['101', '1', '1'], ['102', '3', '1']]
+    assert book.apply({'bids': bids, 'asks': asks, 'checksum': checksum(bids, asks)}, 'partial')
+
+    # 删除 99，增加 100.5，修改 102
+    update = {'bids': [['99', '0', '0'], ['100.5', '4', '1']], 'asks': [['102', '5', '2']]}
+    new_bids = [['100.5', '4', '1'], ['100', '1', '1']]
+    new_asks = [['101', '1', '1'], ['102', '5', '2']]
+    update['checksum'] = checksum(new_bids, new_asks)
+    assert book.apply(update, 'update')
+    assert book.bids.top(5) == new_bids
+    assert book.asks.top(5) == new_asks
+
+    snapshot = book.snapshot(1)
+    assert snapshot['best_bid'] == '100.5'
+    assert snapshot['best_ask'] == '101'
+    assert snapshot['mid'] == 100.75
+    assert snapshot['spread'] == 0.5
+
+    assert not book.apply({'bids': [['100.5', '1', '1']], 'checksum': 1}, 'update')
+
+
+@pytest.mark.asyncio
+async def test_resubscribe():
+    depth = Depth({'DEPTH': {'interval': 0}})
+    bids = [['100', '1', '1']]
+    asks = [['101', '1', '1']]
+    request = {'_signal_': 'ON_DATA', 'DATA': {'table': 'spot/depth', 'action': 'partial', 'data': [
+        {'instrument_id': 'BTC-USDT', 'bids': bids, 'asks': asks, 'checksum': checksum(bids, asks)}]}}
+    await depth.enter(request)
+    assert [book.instrument_id for book in request['BOOKS']] == ['BTC-USDT']
+    assert 'response' not in request
+
+    request = {'_signal_': 'ON_DATA', 'DATA': {'table': 'spot/depth', 'action': 'update', 'data': [
+        {'instrument_id': 'BTC-USDT', 'bids': [['100', '2', '1']], 'asks': [], 'checksum': 0}]}}
+    await depth.enter(request)
+    assert request['BOOKS'] == []
+    assert request['response'] == [{'op': 'unsubscribe', 'args': ['spot/depth:BTC-USDT']},
+                                   {'op': 'subscribe', 'args': ['spot/depth:BTC-USDT']}]
+
+
+def partial(instrument_id='BTC-USDT', bid='100'):
+    bids, asks = [[bid, '1', '1']], [['101', '1', '1']]
+    return {'_signal_': 'ON_DATA', 'DATA': {'table': 'spot/depth', 'action': 'partial', 'data': [
+        {'instrument_id': instrument_id, 'bids': bids, 'asks': asks, 'checksum': checksum(bids, asks)}]}}
+
+
+@pytest.mark.asyncio
+async def test_due():
+    depth = Depth({'DEPTH': {'interval': 60}})
+    request = partial()
+    await depth.enter(request)
+    assert len(request['BOOKS']) == 1
+
+    # 节流中的更新等到写入时间
+    await depth.enter(partial(bid='99'))
+    assert depth.dirty and 0 < depth.wait() <= 60
+    # 不写入的事件消息不取走 order book
+    request = {'_signal_': 'ON_DATA', 'DATA': {'event': 'subscribe', 'channel': 'spot/ticker:BTC-USDT'}}
+    await depth.enter(request)
+    assert 'BOOKS' not in request and depth.dirty
+
+    depth.books[('spot/depth', 'BTC-USDT')].written -= 60
+    assert depth.wait() == 0.001
+    book, = depth.due()
+    assert book.bids.top(1) == [['99', '1', '1']]
+    assert not depth.dirty and depth.wait() == 60
+
+
+@pytest.mark.asyncio
+async def test_timer_flush():
+    # 需要本机运行 redis-server，没有新数据时由定时任务写入最后的更新
+    depth = Depth({'DEPTH': {'interval': 0.05}})
+    ws2redis = Ws2redis('test_depth', settings={'DEPTH': {'interval': 0.05}}, depth=depth)
+    await ws2redis.enter({'_signal_': 'READY'})
+    try:
+        for bid in ('100', '99'):
+            request = partial(bid=bid)
+            await depth.enter(request)
+            await ws2redis.enter(request)
+        key = 'okex/test_depth/spot/depth:BTC-USDT'
+        assert await ws2redis.redis.hget(key, 'best_bid', encoding='utf-8') == '100'
+        await asyncio.sleep(0.15)
+        assert await ws2redis.redis.hget(key, 'best_bid', encoding='utf-8') == '99'
+    finally:
+        await cleanup.clear(ws2redis.redis, 'okex/test_depth/*')
+        await ws2redis.close()
+
+
+class FailingPipeline:
+    # 模拟发送时连接断开
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+    async def execute(self, *, return_exceptions=False):
+        raise ConnectionError('redis 连接断开')
+
+
+@pytest.mark.asyncio
+async def test_write_failed(monkeypatch):
+    # 需要本机运行 redis-server，写入失败的 order book 放回 dirty，下次再写
+    depth = Depth({'DEPTH': {'interval': 60}})
+    ws2redis = Ws2redis('test_depth', settings={'DEPTH': {'interval': 60}}, depth=depth)
+    await ws2redis.enter({'_signal_': 'READY'})
+    key = 'okex/test_depth/spot/depth:BTC-USDT'
+    try:
+        with monkeypatch.context() as m:
+            m.setattr(app, 'batch', lambda redis, mode: FailingPipeline())
+            request = partial()
+            await depth.enter(request)
+            assert request['BOOKS'] and not depth.dirty
+            with pytest.raises(ConnectionError):
+                await ws2redis.enter(request)
+            assert depth.dirty == {('spot/depth', 'BTC-USDT')}
+
+            # 定时任务写入失败也放回
+            depth.books[('spot/depth', 'BTC-USDT')].written -= 60
+            with pytest.raises(ConnectionError):
+                await ws2redis.write_books()
+            assert depth.dirty == {('spot/depth', 'BTC-USDT')}
+            # 失败后仍按 interval 节流
+            assert depth.wait() > 59
+
+        depth.books[('spot/depth', 'BTC-USDT')].written -= 60
+        await ws2redis.write_books()
+        assert not depth.dirty
+        assert await ws2redis.redis.hget(key, 'best_bid', encoding='utf-8') == '100'
+    finally:
+        await cleanup.clear(ws2redis.redis, 'okex/test_depth/*')
+        await ws2redis.close()
@@ -0,0 +1,104 @@
+import aioredis
+import pytest
+
+from okws import cleanup
+from okws.ws2redis import candle, normal
+from okws.ws2redis.candle import FIELDS, score
+
+TIMESTAMPS = [f'2020-11-12T13:2{i}:00.000Z' for i in range(5)]
+
+
+async def fill(redis):
+    # k 线和 uni_id 表都是 有序集合 + 每项一个 hash
+    pipe = redis.pipeline()
+    key = 'okex/test_index/spot/candle60s:ETH-USDT'
+    for i, ts in enumerate(TIMESTAMPS):
+        pipe.zadd(key, score(ts), ts)
+        pipe.hmset_dict(f"{key}/{ts}", dict(zip(FIELDS, [ts, '1', '2', '0.5', str(i), '10', '0.1'])))
+    key = 'okex/test_index/spot/trade'
+    for i in range(1, 6):
+        pipe.zadd(key, i, str(i))
+        pipe.hmset_dict(f"{key}/{i}", {'trade_id': str(i), 'side': 'buy', 'price': f'{i}.5'})
+    await pipe.execute()
+
+
+async def read(module, redis, path, **params):
+    ctx = {'redis': redis, 'name': 'test_index', 'path': path, **params}
+    await module.read(ctx)
+    return ctx['response']
+
+
+@pytest.mark.asyncio
+async def test_read():
+    # 需要本机运行 redis-server
+    redis = await aioredis.create_redis('redis://localhost', encoding='utf-8')
+    try:
+        await fill(redis)
+        bars = await read(candle, redis, 'spot/candle60s', instrument_id='ETH-USDT')
+        assert [b['timestamp'] for b in bars] == TIMESTAMPS
+        assert bars[0] == dict(zip(FIELDS, [TIMESTAMPS[0], '1', '2', '0.5', '0', '10', '0.1']))
+
+        # 最新的 n 条
+        bars = await read(candle, redis, 'spot/candle60s', instrument_id='ETH-USDT', n=2)
+        assert [b['timestamp'] for b in bars] == TIMESTAMPS[3:]
+
+        # start/end 可以是时间字符串或秒数，与 n 一起使用时取这段时间内最新的 n 条
+        bars = await read(candle, redis, 'spot/candle60s', instrument_id='ETH-USDT',
+                          start=TIMESTAMPS[1], end=score(TIMESTAMPS[3]))
+        assert [b['timestamp'] for b in bars] == TIMESTAMPS[1:4]
+        bars = await read(candle, redis, 'spot/candle60s', instrument_id='ETH-USDT', start=TIMESTAMPS[1], n=2)
+        assert [b['timestamp'] for b in bars] == TIMESTAMPS[3:]
+
+        bars = await read(candle, redis, 'spot/candle60s', instrument_id='ETH-USDT', n=1, fields=['timestamp', 'close'])
+        assert bars == [{'timestamp': TIMESTAMPS[4], 'close': '4'}]
+
+        trades = await read(normal, redis, 'spot/trade')
+        assert [t['trade_id'] for t in trades] == ['1', '2', '3', '4', '5']
+        assert trades[0] == {'trade_id': '1', 'side': 'buy', 'price': '1.5'}
+        trades = await read(normal, redis, 'spot/trade', start=2, end=4, fields=['price'])
+        assert trades == [{'price': '2.5'}, {'price': '3.5'}, {'price': '4.5'}]
+        trades = await read(normal, redis, 'spot/trade', end=4, n=2)
+        assert [t['trade_id'] for t in trades] == ['3', '4']
+
+        # 已过期 (hash 已删除，索引项还在) 的数据不返回
+        await redis.delete('okex/test_index/spot/trade/5')
+        trades = await read(normal, redis, 'spot/trade', fields=['trade_id'])
+        assert trades == [{'trade_id': str(i)} for i in range(1, 5)]
+        assert len(await read(normal, redis, 'spot/trade')) == 4
+    finally:
+        await cleanup.clear(redis, 'okex/test_index/*')
+        redis.close()
+        await redis.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_read_columns():
+    np = pytest.importorskip('numpy')
+    redis = await aioredis.create_redis('redis://localhost')
+    try:
+        await fill(redis)
+        data = await read(candle, redis, 'spot/candle60s', instrument_id='ETH-USDT', n=3, format='numpy')
+        assert list(data) == FIELDS
+        assert data['timestamp'].dtype == np.int64
+        assert list(data['timestamp']) == [score(ts) * 1000 for ts in TIMESTAMPS[2:]]
+        assert list(data['close']) == [2.0, 3.0, 4.0]
+
+        data = await read(normal, redis, 'spot/trade', start=2, fields=['trade_id', 'price'], format='numpy')
+        assert list(data) == ['trade_id', 'price']
+        assert list(data['trade_id']) == [2, 3, 4, 5]
+        assert list(data['price']) == [2.5, 3.5, 4.5, 5.5]
+
+        # 没有 fields 时按 hash 中的字段
+        data = await read(normal, redis, 'spot/trade', n=2, format='numpy')
+        assert set(data) == {'trade_id', 'side', 'price'}
+        assert list(data['side']) == ['buy', 'buy']
+
+        pytest.importorskip('pandas')
+        df = await read(candle, redis, 'spot/candle60s', instrument_id='ETH-USDT', fields=['timestamp', 'close'],
+                        format='pandas')
+        assert list(df.columns) == ['timestamp', 'close']
+        assert len(df) == 5
+    finally:
+        await cleanup.clear(redis, 'okex/test_index/*')
+        redis.close()
+        await redis.wait_closed()
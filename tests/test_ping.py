@@ -0,0 +1,100 @@
+import asyncio
+import zlib
+
+import pytest
+import websockets
+
+from okws.okex import is_pong
+from okws.websocket import RTT, Websockets
+
+
+def deflate(data):
+    compress = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return compress.compress(data) + compress.flush()
+
+
+def test_is_pong():
+    assert is_pong(deflate(b'pong'))
+    assert is_pong('pong')
+    assert not is_pong(deflate(b'ping'))
+    assert not is_pong(deflate(b'{"table": "spot/ticker", "data": []}' * 2))
+    assert not is_pong(b'not deflate')
+
+
+def test_rtt():
+    rtt = RTT(samples=3)
+    assert rtt.last is None
+    assert rtt.stats() == {'missed': 0, 'samples': 0}
+    for seconds in (0.1, 0.004, 0.03, 0.012):
+        rtt.add(seconds)
+    rtt.miss()
+    stats = rtt.stats()
+    assert stats['samples'] == 3
+    assert stats['missed'] == 1
+    assert (stats['last'], stats['min'], stats['max']) == (12, 4, 30)
+    assert (stats['le_5ms'], stats['le_20ms'], stats['le_50ms']) == (1, 2, 3)
+
+
+@pytest.mark.asyncio
+async def test_reconnect_on_missed_pong():
+    # 服务器回复 3 次 pong 后不再回复，连接仍然保持(类似半开的 TCP 连接)
+    pongs = 3
+
+    async def handler(ws):
+        nonlocal pongs
+        async for msg in ws:
+            if msg == 'ping' and pongs > 0:
+                pongs -= 1
+                await ws.send(deflate(b'pong'))
+
+    connected = asyncio.Event()
+    reconnected = asyncio.Event()
+
+    async def app(request):
+        if request['_signal_'] == 'CONNECTED':
+            (reconnected if connected.is_set() else connected).set()
+
+    async with websockets.serve(handler, 'localhost', 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        client = Websockets(app, ws_url=f"ws://localhost:{port}", ping_interval=0.05, ping_timeout=0.2,
+                            is_pong=is_pong)
+        task = asyncio.create_task(client.run())
+        try:
+            await asyncio.wait_for(reconnected.wait(), 5)
+        finally:
+            client.close()
+            await task
+    assert client.rtt.stats()['samples'] == 3
+    assert client.rtt.missed >= 1
+
+
+@pytest.mark.asyncio
+async def test_disconnected_after_processor():
+    # 处理任务结束后才发送 DISCONNECTED
+    async def handler(ws):
+        await ws.send('data')
+        await ws.wait_closed()
+
+    events = []
+    received = asyncio.Event()
+
+    async def app(request):
+        if request['_signal_'] == 'ON_DATA':
+            received.set()
+            try:
+                await asyncio.sleep(10)
+            finally:
+                # 取消后还要一段时间才结束
+                await asyncio.sleep(0.1)
+                events.append('processed')
+        elif request['_signal_'] in ('DISCONNECTED', 'EXIT'):
+            events.append(request['_signal_'])
+
+    async with websockets.serve(handler, 'localhost', 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        client = Websockets(app, ws_url=f"ws://localhost:{port}")
+        task = asyncio.create_task(client.run())
+        await asyncio.wait_for(received.wait(), 5)
+        client.close()
+        await task
+    assert events == ['processed', 'DISCONNECTED', 'EXIT']
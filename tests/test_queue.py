@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from okws import cleanup
+from okws.websocket import RTT, FrameQueue
+from okws.ws2redis.app import Ws2redis
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_drop_oldest():
+    queue = FrameQueue(2, 'drop_oldest')
+    for i in range(4):
+        await queue.put('ON_DATA', i)
+    assert [await queue.get() for _ in range(2)] == [('ON_DATA', 2), ('ON_DATA', 3)]
+    assert queue.stats()['dropped'] == 2
+
+
+async def test_conflate():
+    queue = FrameQueue(2, 'conflate', conflate_key=lambda frame: frame[0])
+    await queue.put('ON_DATA', ('a', 1))
+    await queue.put('ON_DATA', ('b', 1))
+    await queue.put('ON_DATA', ('a', 2))
+    assert len(queue) == 2
+    assert await queue.get() == ('ON_DATA', ('a', 2))
+    assert queue.stats()['conflated'] == 1
+
+
+async def test_block():
+    queue = FrameQueue(1)
+    await queue.put('ON_DATA', 1)
+    put = asyncio.create_task(queue.put('ON_DATA', 2))
+    await asyncio.sleep(0.01)
+    assert not put.done()
+    assert await queue.get() == ('ON_DATA', 1)
+    queue.task_done()
+    await put
+    assert await queue.get() == ('ON_DATA', 2)
+    queue.task_done()
+    await asyncio.wait_for(queue.join(), 1)
+    stats = queue.stats()
+    assert stats['processed'] == 2
+    assert stats['blocked'] > 0
+
+
+async def test_beat_without_data():
+    # 需要本机运行 redis-server，数据中断时队列的统计数据仍然更新，status 不更新
+    class Server:
+        queue = FrameQueue(10)
+        rtt = RTT()
+
+    ws2redis = Ws2redis('test_queue', settings={'HEARTBEAT': 0})
+    await ws2redis.enter({'_signal_': 'READY'})
+    try:
+        await ws2redis.enter({'_signal_': 'CONNECTED', '_server_': Server()})
+        await ws2redis.redis.delete(ws2redis.status_path)
+        await Server.queue.put('ON_DATA', 1)
+        Server.rtt.miss()
+        await ws2redis.beat()
+        assert await ws2redis.redis.hget(ws2redis.queue_path, 'depth', encoding='utf-8') == '1'
+        assert await ws2redis.redis.hget(ws2redis.rtt_path, 'missed', encoding='utf-8') == '1'
+        assert not await ws2redis.redis.exists(ws2redis.status_path)
+    finally:
+        await cleanup.clear(ws2redis.redis, 'okex/test_queue/*')
+        await ws2redis.close()
+
+
+async def test_connected_ttl():
+    # 需要本机运行 redis-server，CONNECTED 与 ON_DATA 一样约 2 个心跳间隔后过期
+    ws2redis = Ws2redis('test_queue', settings={'HEARTBEAT': 5})
+    await ws2redis.enter({'_signal_': 'READY'})
+    try:
+        await ws2redis.enter({'_signal_': 'CONNECTED'})
+        assert await ws2redis.redis.get(ws2redis.status_path, encoding='utf-8') == 'CONNECTED'
+        assert 5 < await ws2redis.redis.ttl(ws2redis.status_path) <= 10
+    finally:
+        await cleanup.clear(ws2redis.redis, 'okex/test_queue/*')
+        await ws2redis.close()
@@ -3,6 +3,9 @@ import pytest
 import asyncio
 import logging
 import aioredis
+from okws import cleanup
+from okws.aioclient import Client
+from okws.redis_cmd import RedisCommand
 
 pytestmark = pytest.mark.asyncio
 redis_url = 'redis://localhost'
@@ -46,3 +49,51 @@ async def test_cmd():
             send_exit_cmd())
     except asyncio.CancelledError:
         logger.info("catch CancelledError!!")
+
+
+async def test_request():
+    # 同一个 client 同时等待的指令各自收到自己的回复，客户端超时后回复列表会过期
+    channel = 'test_request'
+    info_key = 'test_request/info'
+    cmd = RedisCommand(redis_url, info_key)
+    cmd.redis = await aioredis.create_redis(redis_url)
+    sub = await aioredis.create_redis(redis_url)
+    ch, = await sub.subscribe(channel)
+    # 先发出的指令后回复，c 在客户端超时后才回复
+    delays = {'a': 0.3, 'b': 0.1, 'c': 1.5}
+    replies = []
+
+    async def reply(msg):
+        await asyncio.sleep(delays[msg['name']])
+        await cmd.redis_msg(msg, 'info', msg['name'], 80000)
+
+    async def respond():
+        while await ch.wait_message():
+            msg = await ch.get_json()
+            replies.append(asyncio.create_task(reply(msg)))
+
+    responder = asyncio.create_task(respond())
+    client = Client(redis_url, info_key, channel)
+    await client.init()
+    try:
+        a, b = await asyncio.gather(client.request({'op': 'test', 'name': 'a'}),
+                                    client.request({'op': 'test', 'name': 'b'}))
+        assert (a['message'], a['rid']) == ('a', 1)
+        assert (b['message'], b['rid']) == ('b', 2)
+        assert a['latency'] > b['latency']
+
+        c = await client.request({'op': 'test', 'name': 'c'}, timeout=1)
+        assert c['errorCode'] == 80020
+        await asyncio.gather(*replies)
+        key = f"{client.redis_path}/3"
+        assert await cmd.redis.llen(key) == 1
+        assert 0 < await cmd.redis.ttl(key) <= RedisCommand.REPLY_EXPIRE
+        # 取走的回复不留下 key
+        assert not await cmd.redis.exists(f"{client.redis_path}/1", f"{client.redis_path}/2")
+    finally:
+        responder.cancel()
+        await client.close()
+        await cleanup.clear(cmd.redis, f"{info_key}/*")
+        for redis in (cmd.redis, sub):
+            redis.close()
+            await redis.wait_closed()
@@ -0,0 +1,69 @@
+import aioredis
+import pytest
+
+from okws import cleanup
+from okws.ws2redis import retention
+from okws.ws2redis.retention import Retention
+
+
+def test_rule():
+    retention = Retention({
+        'MAX_ROW': 100,
+        'RETENTION': {
+            '*/trade': {'max_row': 500, 'ttl': 3600},
+            '*/candle*': {'max_age': 86400},
+        }
+    })
+    assert retention.rule('spot/trade') == {'max_row': 500, 'max_age': None, 'ttl': 3600}
+    assert retention.rule('swap/candle60s') == {'max_row': 100, 'max_age': 86400, 'ttl': None}
+    assert retention.rule('spot/ticker') == {'max_row': 100, 'max_age': None, 'ttl': None}
+
+
+def test_args():
+    retention = Retention({'RETENTION': {'*/order': {'max_age': 60}, '*/candle60s': {'max_age': 60}}})
+    # uni_id 表 max_age 使用 hash 过期时间
+    assert retention.args('spot/order', by_time=False) == (1000, '', '1', 60)
+    max_row, min_score, check_expired, ttl = retention.args('spot/candle60s')
+    assert (max_row, check_expired, ttl) == (1000, '0', 0)
+    assert min_score > 0
+
+
+def test_stream_max_row(caplog):
+    retention = Retention({'RETENTION': {'*/trade': {'max_row': 500, 'ttl': 3600}, '*/order': {'max_row': 0}}})
+    assert retention.stream_max_row('spot/trade') == 500
+    assert retention.stream_max_row('swap/trade') == 500
+    assert retention.stream_max_row('spot/order') is None
+    # 每个表只警告一次
+    warnings = [r for r in caplog.records if r.levelname == 'WARNING']
+    assert [r.getMessage().split()[0] for r in warnings] == ['spot/trade', 'swap/trade']
+    retention.stream_max_row('spot/trade')
+    assert len([r for r in caplog.records if r.levelname == 'WARNING']) == 2
+
+
+@pytest.mark.asyncio
+async def test_trim():
+    # 需要本机运行 redis-server
+    redis = await aioredis.create_redis('redis://localhost')
+    key = 'okex/test_retention/spot/trade'
+    stats = retention.stats_key('test_retention')
+    try:
+        pipe = redis.pipeline()
+        for i in range(5):
+            pipe.zadd(key, i, str(i))
+            pipe.hmset_dict(f"{key}/{i}", {'trade_id': str(i)})
+        await pipe.execute()
+
+        assert await retention.TRIM(redis, [key, stats], ['spot/trade', 3, '', '0']) == 2
+        assert await redis.zrange(key, encoding='utf-8') == ['2', '3', '4']
+        assert not await redis.exists(f"{key}/0", f"{key}/1")
+        assert await redis.exists(f"{key}/2")
+        assert await retention.reclaimed(redis, 'test_retention') == {'spot/trade': 2}
+
+        # 按 score 删除过期的索引项
+        assert await retention.TRIM(redis, [key, stats], ['spot/trade', 0, 4, '0']) == 2
+        assert await redis.zrange(key, encoding='utf-8') == ['4']
+        assert await retention.reclaimed(redis, 'test_retention') == {'spot/trade': 4}
+    finally:
+        await cleanup.clear(redis, 'okex/test_retention/*')
+        redis.close()
+        await redis.wait_closed()
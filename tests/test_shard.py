@@ -0,0 +1,97 @@
+import json
+
+import pytest
+
+from okws.startup import each_shard
+from okws.shard import Router, ShardedWebsockets
+
+
+def test_hash():
+    router = Router(4)
+    channels = [f"spot/depth_l2_tbt:{c}-USDT" for c in ('BTC', 'ETH', 'LTC', 'EOS', 'XRP', 'DOT')]
+    shards = [router.shard(c) for c in channels]
+    # 同一个频道总在同一个连接上，与订阅顺序无关
+    assert shards == [Router(4).shard(c) for c in channels]
+    assert all(0 <= n < 4 for n in shards)
+    assert sum(router.load) == len(channels)
+
+
+def test_load():
+    router = Router(3, 'load')
+    assert [router.shard(f"spot/trade:{i}") for i in range(6)] == [0, 1, 2, 0, 1, 2]
+    assert router.shard('spot/trade:0') == 0
+    assert router.release('spot/trade:1') == 1
+    assert router.release('spot/trade:1') is None
+    # 退订后空出的连接优先分配
+    assert router.shard('spot/trade:6') == 1
+    assert router.shards() == [['spot/trade:0', 'spot/trade:3'], ['spot/trade:4', 'spot/trade:6'],
+                               ['spot/trade:2', 'spot/trade:5']]
+
+
+def test_split():
+    router = Router(2, 'load')
+    assert router.split('subscribe', ['a', 'b', 'c']) == {0: ['a', 'c'], 1: ['b']}
+    assert router.split('unsubscribe', ['c', 'x']) == {0: ['c'], None: ['x']}
+
+
+def test_config():
+    with pytest.raises(ValueError):
+        Router(0)
+    with pytest.raises(ValueError):
+        Router(2, 'random')
+
+
+@pytest.mark.asyncio
+async def test_send():
+    async def app(request):
+        pass
+
+    ws = ShardedWebsockets(lambda n: app, 2, 'load')
+    sent = []
+    for n, client in enumerate(ws.clients):
+        async def send(msg, n=n):
+            sent.append((n, json.loads(msg)))
+        client.send = send
+
+    await ws.send(json.dumps({'op': 'subscribe', 'args': ['a', 'b', 'c']}))
+    assert sent == [(0, {'op': 'subscribe', 'args': ['a', 'c']}), (1, {'op': 'subscribe', 'args': ['b']})]
+    sent.clear()
+    await ws.send(json.dumps({'op': 'unsubscribe', 'args': ['b', 'x']}))
+    assert sent == [(1, {'op': 'unsubscribe', 'args': ['b']}),
+                    (0, {'op': 'unsubscribe', 'args': ['x']}), (1, {'op': 'unsubscribe', 'args': ['x']})]
+
+
+@pytest.mark.asyncio
+async def test_error_reply():
+    # 订阅收到 error 回复的频道从 Router 中释放
+    async def app(request):
+        # 代替 Decode
+        request['DATA'] = json.loads(request['RAW'])
+
+    ws = ShardedWebsockets(lambda n: app, 2, 'load')
+    for client in ws.clients:
+        async def send(msg):
+            pass
+        client.send = send
+    await ws.send(json.dumps({'op': 'subscribe', 'args': ['spot/ticker:BTC-USDT', 'spot/tickr:BTC-USDT']}))
+    assert ws.router.load == [1, 1]
+
+    error = {'event': 'error', 'message': "Channel spot/tickr:BTC-USDT doesn't exist", 'errorCode': 30040}
+    # 其它连接的 error 回复不释放本连接的频道
+    await ws.clients[0].run_app('ON_DATA', RAW=json.dumps(error))
+    assert ws.router.channels == {'spot/ticker:BTC-USDT': 0, 'spot/tickr:BTC-USDT': 1}
+    await ws.clients[1].run_app('ON_DATA', RAW=json.dumps(error))
+    assert ws.router.channels == {'spot/ticker:BTC-USDT': 0}
+    assert ws.router.load == [1, 0]
+    # 重新订阅时重新分配
+    assert ws.router.split('subscribe', ['spot/tickr:BTC-USDT']) == {1: ['spot/tickr:BTC-USDT']}
+
+
+def test_each_shard():
+    done = each_shard(2, lambda e: e.get('op') == 'CONNECTED')
+    # 同一个连接重连、热备连接的事件不计
+    assert not done({'op': 'CONNECTED', 'shard': 0})
+    assert not done({'op': 'CONNECTED', 'shard': 0})
+    assert not done({'op': 'CONNECTED', 'shard': 1, 'standby': True})
+    assert not done({'op': 'DISCONNECTED', 'shard': 1})
+    assert done({'op': 'CONNECTED', 'shard': 1})
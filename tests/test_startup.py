@@ -0,0 +1,74 @@
+import asyncio
+import json
+
+import aioredis
+import pytest
+
+from okws.cli import start_server
+from okws.startup import wait_event
+
+pytestmark = pytest.mark.asyncio
+redis_url = 'redis://localhost'
+
+
+async def test_wait_event():
+    # 需要本机运行 redis-server
+    redis = await aioredis.create_redis(redis_url)
+    sub = await aioredis.create_redis(redis_url)
+    try:
+        ch, = await sub.subscribe('okex/test_startup/event')
+        for event in ({'op': 'CONNECTED'}, {'event': 'login'}):
+            await redis.publish_json('okex/test_startup/event', event)
+        # 跳过不符合的事件
+        assert await wait_event(ch, lambda e: e.get('event') == 'login', 1)
+        # 没有事件时超时
+        start = asyncio.get_event_loop().time()
+        assert not await wait_event(ch, lambda e: True, 0.2)
+        assert asyncio.get_event_loop().time() - start >= 0.2
+    finally:
+        for r in (redis, sub):
+            r.close()
+            await r.wait_closed()
+
+
+class FakeClient:
+    # 代替 aioclient.Client，事件由测试发送
+    def __init__(self, redis):
+        self.redis = redis
+        self.subscribed = asyncio.Event()
+
+    async def open_ws(self, name, server):
+        return {'event': 'info', 'message': '', 'errorCode': 80000}
+
+    async def subscribe(self, name, channels):
+        self.subscribed.set()
+
+
+async def test_start_server():
+    redis = await aioredis.create_redis(redis_url)
+    key = 'okex/test_startup/ready'
+    event_path = 'okex/test_startup/event'
+    config = {'settings': {'STARTUP_TIMEOUT': 2, 'REDIS_URL': redis_url, 'HEARTBEAT': 1},
+              'subscribes': [{'server': 'test_startup', 'channels': ['spot/ticker:BTC-USDT']}]}
+    client = FakeClient(redis)
+    try:
+        await redis.delete(key)
+        task = asyncio.create_task(start_server(client, config, {'name': 'test_startup'}))
+        await asyncio.sleep(0.2)
+        # 还没有连接时不写 ready
+        assert not await redis.exists(key)
+
+        await redis.publish_json(event_path, {'op': 'CONNECTED'})
+        await asyncio.wait_for(client.subscribed.wait(), 1)
+        assert not await redis.exists(key)
+        await redis.publish_json(event_path, {'event': 'subscribe', 'channel': 'spot/ticker:BTC-USDT'})
+        await redis.publish_json(event_path, {'op': 'FIRST_DATA', 'table': 'spot/ticker'})
+        report = await asyncio.wait_for(task, 2)
+
+        assert report['login'] is None
+        assert 0.2 <= report['connected'] <= report['subscribed'] <= report['first_data']
+        assert json.loads(await redis.get(key)) == report
+    finally:
+        await redis.delete(key)
+        redis.close()
+        await redis.wait_closed()
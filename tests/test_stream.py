@@ -0,0 +1,61 @@
+import aioredis
+import pytest
+
+from okws import cleanup
+from okws.ws2redis import storage, stream
+from okws.ws2redis.normal import config as normal
+
+
+@pytest.mark.asyncio
+async def test_migrate():
+    # 需要本机运行 redis-server
+    redis = await aioredis.create_redis('redis://localhost')
+    key = 'okex/test_stream/spot/order'
+    try:
+        pipe = redis.pipeline()
+        for i in range(3):
+            pipe.zadd(key, i, str(i))
+            pipe.hmset_dict(f"{key}/{i}", {'order_id': str(i), 'state': '0'})
+        await pipe.execute()
+
+        assert await stream.migrate(redis, key, 'stream') == 3
+        assert await redis.type(key) == b'stream'
+        assert not await redis.exists(f"{key}/0")
+        # 同一个 id 的多次更新，转换回 zset 时只保留最后一条
+        await redis.xadd(key, {'order_id': '1', 'state': '2'})
+        assert await stream.migrate(redis, key, 'stream') == 0
+
+        assert await stream.migrate(redis, key, 'zset', 'order_id') == 3
+        assert await redis.type(key) == b'zset'
+        assert await redis.zrange(key, encoding='utf-8') == ['0', '1', '2']
+        assert await redis.hgetall(f"{key}/1", encoding='utf-8') == {'order_id': '1', 'state': '2'}
+        assert not await redis.exists(f"{key}:migrate")
+    finally:
+        await cleanup.clear(redis, 'okex/test_stream/*')
+        redis.close()
+        await redis.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_read_range():
+    # stream 方式不能按 trade_id 取一段数据
+    ctx = {'name': 'test_stream', 'path': 'spot/trade', 'settings': {'UNI_ID_STORAGE': 'stream'}, 'start': 1}
+    with pytest.raises(ValueError):
+        await normal['read']['leave'](ctx)
+
+
+@pytest.mark.asyncio
+async def test_storage():
+    # 需要本机运行 redis-server，client 按 okws 记录的存储方式读取
+    redis = await aioredis.create_redis('redis://localhost')
+    cache = storage.Cache(ttl=0)
+    settings = {'UNI_ID_STORAGE': 'zset', 'MAX_ROW': 10}
+    try:
+        assert await cache.settings(redis, 'test_stream', settings) is settings
+        await redis.hmset_dict(storage.key('test_stream'), storage.modes({'UNI_ID_STORAGE': 'stream'}))
+        assert await cache.settings(redis, 'test_stream', settings) == {
+            'UNI_ID_STORAGE': 'stream', 'CANDLE_STORAGE': 'hash', 'MAX_ROW': 10}
+    finally:
+        await cleanup.clear(redis, 'okex/test_stream/*')
+        redis.close()
+        await redis.wait_closed()
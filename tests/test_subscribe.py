@@ -0,0 +1,128 @@
+import asyncio
+import json
+
+import pytest
+
+from okws.websocket import FrameQueue
+from okws.ws2redis.subscribe import Subscribe
+
+
+class Server:
+    """回复订阅指令，lost 中的频道第一次订阅时没有回复，errors 中的频道回复 error"""
+
+    def __init__(self, subscribe, lost=(), errors=()):
+        self.subscribe = subscribe
+        self.lost = set(lost)
+        self.errors = set(errors)
+        self.sent = []
+        self.queue = FrameQueue()
+
+    async def send(self, msg):
+        args = json.loads(msg)['args']
+        self.sent.append(args)
+        for channel in args:
+            if channel in self.lost:
+                self.lost.discard(channel)
+                continue
+            if channel in self.errors:
+                data = {'event': 'error', 'message': f"Channel {channel} doesn't exist", 'errorCode': 30040}
+            else:
+                data = {'event': 'subscribe', 'channel': channel}
+            # 回复由处理任务另外处理
+            asyncio.get_running_loop().call_soon(asyncio.ensure_future, self.subscribe.enter(
+                {'_signal_': 'ON_DATA', '_server_': self, 'DATA': data}))
+
+    @property
+    def signals(self):
+        return [(signal, request) for signal, request, _enqueued, _key in self.queue.items]
+
+
+def test_chunks():
+    subscribe = Subscribe(settings={'RESUBSCRIBE': {'chunk': 3, 'max_bytes': 30}})
+    channels = [f"spot/ticker:{i}" for i in range(5)]
+    assert list(subscribe.chunks(channels)) == [channels[:1], channels[1:2], channels[2:3], channels[3:4],
+                                                channels[4:]]
+    subscribe.max_bytes = 4000
+    assert list(subscribe.chunks(channels)) == [channels[:3], channels[3:]]
+    assert list(subscribe.chunks([])) == []
+
+
+@pytest.mark.asyncio
+async def test_resubscribe():
+    subscribe = Subscribe(settings={'RESUBSCRIBE': {'chunk': 2, 'timeout': 0.2, 'retries': 1}})
+    channels = [f"spot/ticker:{i}" for i in range(5)]
+    subscribe.subscribed = set(channels)
+    server = Server(subscribe, lost=[channels[3]])
+
+    await subscribe.enter({'_signal_': 'CONNECTED', '_server_': server})
+    await asyncio.wait_for(subscribe.tasks[server], 2)
+
+    assert server.sent == [channels[:2], channels[2:4], channels[4:], [channels[3]]]
+    (signal, request), = server.signals
+    assert signal == 'RESUBSCRIBED'
+    result = request['RESUBSCRIBED']
+    assert (result['channels'], result['chunks'], result['retried'], result['failed']) == (5, 4, 1, [])
+    assert result['duration'] >= 0.2
+    assert subscribe.pending == {} and subscribe.tasks == {}
+
+
+@pytest.mark.asyncio
+async def test_failed():
+    subscribe = Subscribe(settings={'RESUBSCRIBE': {'timeout': 0.05, 'retries': 0}})
+    subscribe.subscribed = {'spot/ticker:A', 'spot/ticker:B'}
+    server = Server(subscribe, lost=['spot/ticker:B'])
+    await subscribe.enter({'_signal_': 'CONNECTED', '_server_': server})
+    await asyncio.wait_for(subscribe.tasks[server], 2)
+    assert server.signals[0][1]['RESUBSCRIBED']['failed'] == ['spot/ticker:B']
+
+
+@pytest.mark.asyncio
+async def test_cancel_on_disconnect():
+    subscribe = Subscribe(settings={'RESUBSCRIBE': {'timeout': 10}})
+    subscribe.subscribed = {'spot/ticker:A'}
+    server = Server(subscribe, lost=['spot/ticker:A'])
+    await subscribe.enter({'_signal_': 'CONNECTED', '_server_': server})
+    task = subscribe.tasks[server]
+    await asyncio.sleep(0.01)
+    await subscribe.enter({'_signal_': 'DISCONNECTED', '_server_': server})
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert subscribe.pending == {} and server.signals == []
+
+
+@pytest.mark.asyncio
+async def test_error_reply():
+    # 收到 error 回复的频道不再等待及重试，spot/ticker:A-SWAP 不影响 spot/ticker:A
+    subscribe = Subscribe(settings={'RESUBSCRIBE': {'timeout': 5, 'retries': 2}})
+    subscribe.subscribed = {'spot/ticker:A', 'spot/ticker:B'}
+    server = Server(subscribe, errors=['spot/ticker:B'])
+    await subscribe.enter({'_signal_': 'CONNECTED', '_server_': server})
+    await asyncio.wait_for(subscribe.enter({'_signal_': 'ON_DATA', '_server_': server, 'DATA': {
+        'event': 'error', 'message': "Channel spot/ticker:A-SWAP doesn't exist"}}), 1)
+    await asyncio.wait_for(subscribe.tasks[server], 1)
+    result = server.signals[0][1]['RESUBSCRIBED']
+    assert (result['failed'], result['retried']) == (['spot/ticker:B'], 0)
+    assert server.sent == [['spot/ticker:A', 'spot/ticker:B']]
+
+
+@pytest.mark.asyncio
+async def test_send_error():
+    # 发送出错时报告没有成功的频道
+    subscribe = Subscribe(settings={'RESUBSCRIBE': {'chunk': 1, 'inflight': 1}})
+    subscribe.subscribed = {'spot/ticker:A', 'spot/ticker:B'}
+    server = Server(subscribe)
+    calls = 0
+
+    async def send(msg):
+        nonlocal calls
+        calls += 1
+        if calls == 2:
+            raise ConnectionError('closed')
+        await Server.send(server, msg)
+
+    server.send = send
+    await subscribe.enter({'_signal_': 'CONNECTED', '_server_': server})
+    await asyncio.wait_for(subscribe.tasks[server], 1)
+    result = server.signals[0][1]['RESUBSCRIBED']
+    assert result['failed'] == ['spot/ticker:B']
+    assert result['error'] == "ConnectionError('closed')"
@@ -0,0 +1,131 @@
+import asyncio
+import json
+
+import aioredis
+import pytest
+
+from okws import cleanup
+from okws.worker import SUPERVISOR_ID, Supervisor, worker_channel
+
+REDIS_URL = 'redis://localhost'
+LISTEN_CHANNEL = 'test-worker'
+
+
+def test_assign():
+    supervisor = Supervisor(settings={'WORKERS': 3, 'LISTEN_CHANNEL': 'trade-ws'})
+    supervisor.owners = {'a': 0, 'b': 0, 'c': 2}
+    # 分配到服务最少的进程
+    assert supervisor.assign({'op': 'open', 'name': 'd', 'args': {}}) == 1
+    # servers 中指定 worker
+    assert supervisor.assign({'op': 'open', 'name': 'd', 'args': {'worker': 0}}) == 0
+    # 超出范围时按负载分配
+    assert supervisor.assign({'op': 'open', 'name': 'd', 'args': {'worker': 5}}) == 1
+    assert worker_channel('trade-ws', 1) == 'trade-ws/worker/1'
+
+
+class Worker:
+    """以下测试需要本机运行 redis-server，用订阅 <LISTEN_CHANNEL>/worker/<序号> 代替工作进程"""
+
+    def __init__(self, index):
+        self.index = index
+        self.cmds = []
+
+    async def __aenter__(self):
+        self.redis = await aioredis.create_redis(REDIS_URL)
+        self.ch, = await self.redis.subscribe(worker_channel(LISTEN_CHANNEL, self.index))
+        return self
+
+    async def __aexit__(self, *args):
+        self.redis.close()
+        await self.redis.wait_closed()
+
+    async def get(self):
+        cmd = await asyncio.wait_for(self.ch.get_json(), 2)
+        self.cmds.append(cmd)
+        return cmd
+
+
+class Server:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+async def supervisor(workers=2):
+    supervisor = Supervisor(REDIS_URL, 'test-worker/info', {'WORKERS': workers, 'LISTEN_CHANNEL': LISTEN_CHANNEL,
+                                                            'STARTUP_TIMEOUT': 1})
+    supervisor.redis = await aioredis.create_redis_pool(REDIS_URL)
+    return supervisor
+
+
+async def command(supervisor, cmd):
+    server = Server()
+    await supervisor.execute({'_signal_': 'ON_DATA', '_server_': server, '_data_': json.dumps(cmd)})
+    return server
+
+
+async def reply(supervisor, cmd):
+    ret = await supervisor.redis.blpop(f"test-worker/info/{cmd['id']}/{cmd['rid']}", timeout=1, encoding='utf-8')
+    return json.loads(ret[1])
+
+
+@pytest.mark.asyncio
+async def test_forward():
+    s = await supervisor()
+    try:
+        async with Worker(0) as w0, Worker(1) as w1:
+            await command(s, {'op': 'open', 'name': 'a', 'args': {}, 'id': 'c', 'rid': 1})
+            await command(s, {'op': 'open', 'name': 'b', 'args': {}, 'id': 'c', 'rid': 2})
+            assert (await w0.get())['name'] == 'a' and (await w1.get())['name'] == 'b'
+            # 之后的指令转发给服务名所在的进程
+            await command(s, {'op': 'subscribe', 'name': 'b', 'args': ['spot/ticker:A'], 'id': 'c', 'rid': 3})
+            assert (await w1.get())['args'] == ['spot/ticker:A']
+            assert s.subscribed['b'] == {'spot/ticker:A': True}
+
+            cmd = {'op': 'subscribe', 'name': 'x', 'args': [], 'id': 'c', 'rid': 4}
+            await command(s, cmd)
+            assert (await reply(s, cmd))['errorCode'] == 80011
+
+            cmd = {'op': 'servers', 'id': 'c', 'rid': 5}
+            await command(s, cmd)
+            assert (await reply(s, cmd))['message'] == ['a', 'b']
+
+            cmd = {'op': 'quit_server', 'id': 'c', 'rid': 6}
+            server = await command(s, cmd)
+            assert (await w0.get())['op'] == 'quit_server' and (await w1.get())['op'] == 'quit_server'
+            assert (await reply(s, cmd))['errorCode'] == 80000
+            assert server.closed
+    finally:
+        await cleanup.clear(s.redis, 'test-worker/info/*')
+        s.redis.close()
+        await s.redis.wait_closed()
+
+
+@pytest.mark.asyncio
+async def test_restore():
+    s = await supervisor(1)
+    events = await aioredis.create_redis(REDIS_URL)
+    try:
+        async with Worker(0) as w0:
+            # 两个服务名，第一个的工作进程没有回复连接事件
+            s.owners = {'a': 0, 'b': 0}
+            s.opened = {'a': {'op': 'open', 'name': 'a', 'args': {}},
+                        'b': {'op': 'open', 'name': 'b', 'args': {'shards': 2}}}
+            s.subscribed = {'a': {'spot/ticker:A': True}, 'b': {'spot/ticker:B': True, 'spot/ticker:C': True}}
+            task = asyncio.create_task(s.restore(0))
+            assert await w0.get() == {'op': 'open', 'name': 'a', 'args': {}, 'id': SUPERVISOR_ID}
+            # 超时后仍然订阅
+            assert await w0.get() == {'op': 'subscribe', 'name': 'a', 'args': ['spot/ticker:A'], 'id': SUPERVISOR_ID}
+            assert (await w0.get())['name'] == 'b'
+            for shard in (0, 0, 1):
+                assert not task.done()
+                await events.publish_json('okex/b/event', {'op': 'CONNECTED', 'shard': shard})
+            assert await w0.get() == {'op': 'subscribe', 'name': 'b', 'args': ['spot/ticker:B', 'spot/ticker:C'],
+                                      'id': SUPERVISOR_ID}
+            await asyncio.wait_for(task, 1)
+    finally:
+        events.close()
+        await events.wait_closed()
+        s.redis.close()
+        await s.redis.wait_closed()